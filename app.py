@@ -16,20 +16,24 @@
 # This script is licensed under the GNU General Public License v3.0
 #
 import streamlit as st # type: ignore
-from typing import Dict, Any
+from typing import Dict, Any, Mapping
+from selection import Selection, is_valid_hostname
 import builder
+import catalog
+import estimate
 import logging
-import json
-import re
+import profiling
+import registry
 
 # Constants
 SCRIPT_TEMPLATE = 'template.sh'
+KICKSTART_TEMPLATE = 'kickstart.ks'
 DNF_OR_FLATPAK_OPTIONS = [('dnf', 'DNF'), ('flatpak', 'Flatpak')]
 DNF_OR_FLATPAK_OR_APPIMAGE_OPTIONS = [('dnf', 'DNF'), ('flatpak', 'Flatpak'), ('appimage', 'AppImage')]
 VIRTUALBOX_OPTIONS = [('without_extension', 'VirtualBox Only'), ('with_extension', 'VirtualBox & Extenstion Pack')]
 DOCKER_OPTIONS = [('install_standard', 'Docker Only'), ('install_portainer', 'Docker & Portainer'), ('install_nvidia_toolkit', 'Docker & Nvidia Toolkit'), ('install_portainer_and_nvidia_toolkit', 'Docker & Both')]
 FONT_OPTIONS = [('core', 'Core Fonts'), ('windows', 'Windows Fonts')]
-DISK_OPTIONS = [('ssd', 'SSD'), ('hdd', 'HDD')]
+DEFAULT_CUSTOM_TEXT = '# Each command goes on a new line.'
 
 st.set_page_config(
     page_title="F-Pass Creator",
@@ -61,37 +65,30 @@ logging.basicConfig(
     datefmt='%Y-%m-%d %H:%M:%S'
 )
 
-def load_template() -> str:
-    with open(SCRIPT_TEMPLATE, 'r') as file:
-        return file.read()
-
-def add_selected_key(data: Dict[str, Any]) -> Dict[str, Any]:
-    # Iterate over the dictionary
-    for key, value in data.items():
-        if isinstance(value, dict):
-            # If the current dictionary contains 'apps', add 'selected' key to each app
-            if 'apps' in value:
-                for app_key, app_value in value['apps'].items():
-                    # Ensure that each app entry has a 'selected' key
-                    if 'selected' not in app_value:
-                        app_value['selected'] = False  # Default value
-            else:
-                # Recursively apply to nested dictionaries
-                add_selected_key(value)
-    return data
-
-def load_app_data(file_name: str) -> dict:
-    try:
-        with open(file_name, 'r') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        logging.error(f"{file_name} not found!")
-        return {}
-    except json.JSONDecodeError:
-        logging.error(f"{file_name} is not a valid JSON file!")
-        return {}
-
-def render_sidebar() -> Dict[str, Any]:
+def get_widget_key(options_category: str, options_subcategory: str, options_app: str) -> str:
+    return f"{options_category}_{options_subcategory}_apps_{options_app}"
+
+def restore_shared_selection(app_index: Mapping[str, catalog.AppEntry], app_positions: Mapping[str, int]):
+    # Seed the widgets once per session from a selection token in the URL
+    token = st.query_params.get("selection")
+    if not token or st.session_state.get("selection_restored"):
+        return
+    st.session_state.selection_restored = True
+
+    shared_selection = Selection.from_token(token, app_positions)
+    if shared_selection is None:
+        st.warning("⚠️ The shared selection in this link is invalid or was created for a different app list.")
+        return
+
+    for options_app, entry in app_index.items():
+        app_key = get_widget_key(entry.category, entry.subcategory, options_app)
+        st.session_state[app_key] = shared_selection.is_selected(options_app)
+        if options_app in shared_selection.install_types:
+            st.session_state[f"{app_key}_install_type"] = shared_selection.install_types[options_app]
+        for field, value in shared_selection.entered_values.get(options_app, {}).items():
+            st.session_state[f"{app_key}_{field}"] = value
+
+def render_sidebar() -> tuple:
     # Centered, clickable logo to reload the page
     st.sidebar.markdown("""
         <div style="display: flex; justify-content: center; align-items: center; padding: 10px;">
@@ -102,17 +99,22 @@ def render_sidebar() -> Dict[str, Any]:
         """, unsafe_allow_html=True)
     st.sidebar.header("Configuration Options")
 
-    # Create a dictionary of supported distros, their matching json files
-    supported_distros = {"Fedora 40": 'fedora40.json'}
-    selected_distro = st.sidebar.selectbox("Choose a Distribution", list(supported_distros.keys()), help="Load the list of options for your distro.")
+    # The supported releases and spins are listed in catalogs.json; only the selected one is loaded
+    supported_distros = registry.load_registry()
+    selected_distro = st.sidebar.selectbox("Choose a Distribution", list(supported_distros), help="Load the list of options for your distro.")
+    distro_name = selected_distro or registry.DEFAULT_RELEASE
 
-    if selected_distro:
-        distro_file = supported_distros[selected_distro]
-    else: #Default to Fedora 40 if nothing has been selected
-        distro_file = supported_distros["Fedora 40"]
-    
-    distro_data = load_app_data(distro_file) # Load the distro data
-    distro_data = add_selected_key(distro_data) # Ensure all app entries have a 'selected' key
+    # The parsed catalog is shared by all sessions; this session only keeps a compact selection
+    with profiling.stage(st.session_state, "load_catalog"):
+        cached_catalog = catalog.load_cached_catalog(distro_name)
+    distro_catalog, app_positions, app_index = cached_catalog.catalog, cached_catalog.app_positions, cached_catalog.app_index
+    restore_shared_selection(app_index, app_positions)
+
+    # The selection persists across reruns so that a section can rerun on its own
+    selection = st.session_state.get("selection")
+    if selection is None or selection.app_positions is not app_positions:
+        selection = Selection(app_positions)
+        st.session_state.selection = selection
 
     output_mode = st.sidebar.selectbox(
         "Selected Terminal Output Mode",
@@ -123,27 +125,45 @@ def render_sidebar() -> Dict[str, Any]:
     if output_mode =="Quiet":
         st.warning("⚠️ Quiet mode is recommended for advanced users only. Most errors and prompts will not be displayed, which could lead to system instability.")
 
+    prefetch = st.sidebar.checkbox(
+        "Prefetch Downloads",
+        key="prefetch_downloads",
+        help="Download Flatpak apps and files while the system upgrades, so they install from the local copies."
+    )
+
+    # Created here so the section fragments can refresh it when they rerun on their own
+    script_preview = st.empty()
+
     # Generate the sidebar sections for the selected distro
-    for options_category in distro_data:
+    for options_category in distro_catalog:
         if options_category != "name":
-            render_app_section(distro_data, options_category)
+            with st.sidebar:
+                render_app_section(distro_catalog, app_index, selection, options_category, script_preview, output_mode)
 
     with st.sidebar.expander("Custom Script"): # Section for adding a custom script
         st.warning("""⚠️ **Caution**: Intended for advanced users. Incorrect shell commands can potentially harm your system or render it inoperable.  
                    Use with care!""")
         
-        default_custom_text = '# Each command goes on a new line.'
-        distro_data["custom_script"] = st.text_area(
+        custom_script = st.text_area(
             "Custom Commands:",
-            value=default_custom_text,
+            value=DEFAULT_CUSTOM_TEXT,
             help="Enter any additional shell commands you want to run at the end of the script.",
             height=200,
             key="custom_script_input"
         )
         
-        if distro_data["custom_script"].strip() != default_custom_text:
+        if custom_script.strip() != DEFAULT_CUSTOM_TEXT:
             st.info("Remember to review your custom commands in the script preview before downloading.")
 
+    # Keep the URL in sync so the current selection can be shared or reloaded
+    st.query_params["selection"] = selection.to_token()
+
+    # Apply the selection to a per-rerun view of the catalog for the builders
+    with profiling.stage(st.session_state, "selection_overlay"):
+        distro_data = catalog.create_selection_overlay(distro_catalog, selection, app_index)
+    distro_data["custom_script"] = custom_script
+    distro_data["prefetch"] = prefetch
+
     
     # Placeholder at the bottom of the sidebar
     sidebar_bottom = st.sidebar.empty()
@@ -186,11 +206,17 @@ def render_sidebar() -> Dict[str, Any]:
     </div>
     """, unsafe_allow_html=True)
 
-    return distro_data, output_mode
+    return distro_data, output_mode, script_preview
 
-def render_app_section(distro_data: Dict[str, Any], options_category: str) -> Dict[str, Any]:
-    with st.sidebar.expander(distro_data[options_category]['name']):
-        subcategories = list(distro_data[options_category].items())
+@st.fragment
+def render_app_section(distro_catalog: Mapping[str, Any], app_index: Mapping[str, catalog.AppEntry], selection: Selection, options_category: str, script_preview, output_mode: str) -> Selection:
+    # Each section is a fragment, so toggling an app only reruns its own section
+    fragment_rerun = not st.session_state.get("page_rendering")
+    if fragment_rerun and st.session_state.get("profiling"):
+        profiling.start_rerun(st.session_state, "fragment")
+
+    with profiling.stage(st.session_state, f"render_app_section:{options_category}"), st.expander(distro_catalog[options_category]['name']):
+        subcategories = list(distro_catalog[options_category].items())
         special_case_apps = {
             "set_hostname": handle_hostname,
             "enable_rpmfusion": handle_rpmfusion,
@@ -201,130 +227,144 @@ def render_app_section(distro_data: Dict[str, Any], options_category: str) -> Di
         }
         
         for options_subcategory, subcategory_data in subcategories:
-            if options_subcategory == "name":
+            if not isinstance(subcategory_data, Mapping) or 'apps' not in subcategory_data:
                 continue
             
             st.subheader(subcategory_data['name'])
             
             for options_app, app_data in subcategory_data['apps'].items():
+                app_key = get_widget_key(options_category, options_subcategory, options_app)
                 app_selected = st.checkbox(
                     app_data['name'],
-                    key=f"{options_category}_{options_subcategory}_apps_{options_app}",
+                    key=app_key,
                     help=app_data.get('description', '')
                 )
-                app_data['selected'] = app_selected
+                selection.set_selected(options_app, app_selected)
 
                 if options_app in special_case_apps:
                     special_case_apps[options_app](
                         app_selected,
-                        subcategory_data=subcategory_data,
                         options_category=options_category,
                         options_subcategory=options_subcategory,
                         options_app=options_app,
-                        distro_data=distro_data
+                        app_index=app_index,
+                        selection=selection
                     )
                 else:
                     if app_selected and 'installation_types' in app_data:
                         installation_type = st.radio(
                             f"Choose {app_data['name']} installation type:",
                             list(app_data['installation_types'].keys()),
-                            key=f"{options_category}_{options_subcategory}_apps_{options_app}_install_type"
+                            key=f"{app_key}_install_type"
                         )
-                        subcategory_data['apps'][options_app]['installation_type'] = installation_type
+                        selection.install_types[options_app] = installation_type
 
                 if app_selected and options_app not in {"set_hostname", "extra_swap_space"}:
-                    dict_key = (options_category, options_subcategory, "apps", options_app)
-                    handle_warnings_and_messages(options_app, distro_data, dict_key)
-
-    return distro_data
+                    handle_warnings_and_messages(options_app, app_index, selection)
+
+    # When only this section reran, refresh the part of the preview it affects
+    if fragment_rerun:
+        refresh_script_preview(distro_catalog, app_index, selection, output_mode, script_preview)
+        profiling.finish_rerun(st.session_state)
+
+    return selection
+
+def refresh_script_preview(distro_catalog: Mapping[str, Any], app_index: Mapping[str, catalog.AppEntry], selection: Selection, output_mode: str, script_preview):
+    st.query_params["selection"] = selection.to_token()
+
+    with profiling.stage(st.session_state, "selection_overlay"):
+        distro_data = catalog.create_selection_overlay(distro_catalog, selection, app_index)
+    distro_data["custom_script"] = st.session_state.get("custom_script_input", DEFAULT_CUSTOM_TEXT)
+    distro_data["prefetch"] = st.session_state.get("prefetch_downloads", False)
+
+    # Only the sections affected by the change are built again (builder.build_section)
+    with profiling.stage(st.session_state, "build_script_parts"):
+        script_parts = builder.build_script_parts(distro_data, output_mode)
+    with profiling.stage(st.session_state, "build_script"):
+        script = build_script(distro_data, output_mode, script_parts)
+    render_script_preview(script_preview, script, distro_data)
+
+def render_script_preview(script_preview, script: str, distro_data: Dict[str, Any]):
+    # The preview, and what the selection downloads when repository metadata is available (estimate.py)
+    with script_preview.container():
+        st.code(script, language="bash")
+        metadata_dir = estimate.get_metadata_dir()
+        if metadata_dir:
+            with profiling.stage(st.session_state, "estimate"):
+                rows = estimate.estimate_selection(distro_data, estimate.load_metadata_index(metadata_dir))
+            total = rows[-1]
+            with st.expander(f"Estimated download: {estimate.format_size(total['download_bytes'])}, about {estimate.format_duration(total['total_seconds'])}"):
+                st.caption(f"At {estimate.DEFAULT_BANDWIDTH_MBIT:g} Mbit/s. Packages and apps that are not in the metadata are not counted.")
+                st.dataframe(estimate.get_display_rows(rows), hide_index=True, use_container_width=True)
 
 def handle_hostname(app_selected: bool, **kwargs):
-    def is_valid_hostname(hostname: str) -> bool:
-        if not hostname or len(hostname) > 253:
-            return False
-
-        regex = re.compile(
-            r'^(?!-)[A-Za-z0-9-]{1,63}(?<!-)$'
-            r'(\.[A-Za-z0-9-]{1,63})*$'
-        )
-
-        # Split hostname by dots and validate each label
-        labels = hostname.split('.')
-        return all(regex.match(label) for label in labels)
-    
-    distro_data = kwargs.get('distro_data', {})
-    hostname_data = distro_data.get("system_config", {}).get("recommended_settings", {}).get("apps", {}).get("set_hostname", {})
+    app_index = kwargs['app_index']
+    selection = kwargs['selection']
+    app_key = get_widget_key(kwargs['options_category'], kwargs['options_subcategory'], kwargs['options_app'])
     
     if app_selected:
-        entered_hostname = st.text_input("Enter the new hostname:")
+        entered_hostname = st.text_input("Enter the new hostname:", key=f"{app_key}_entered_name")
 
-        try:
-            if is_valid_hostname(entered_hostname):
-                hostname_data["entered_name"] = entered_hostname
-        except KeyError as e:
-            logging.warning(f"KeyError: Missing expected key {e} in distro_data.")
+        if is_valid_hostname(entered_hostname):
+            selection.entered_values["set_hostname"] = {"entered_name": entered_hostname}
         else:
-            if hostname_data["entered_name"] == "":
-                hostname_data["entered_name"] = hostname_data["default"]
-                dict_key = ("system_config", "recommended_settings", "apps", "set_hostname")
-                handle_warnings_and_messages("set_hostname", distro_data, dict_key)
+            try:
+                default_hostname = app_index["set_hostname"].record["default"]
+            except KeyError as e:
+                logging.warning(f"KeyError: Missing expected key {e} in the app index.")
+            else:
+                selection.entered_values["set_hostname"] = {"entered_name": default_hostname}
+                handle_warnings_and_messages("set_hostname", app_index, selection)
      
 def handle_rpmfusion(app_selected: bool, **kwargs):
-    distro_data = kwargs['distro_data']
+    selection = kwargs['selection']
 
     if app_selected:
-        distro_data["system_config"]["useful_repos"]["apps"]["enable_rpmfusion"]["selected"] = app_selected
+        selection.set_selected("enable_rpmfusion", app_selected)
 
 def handle_special_installation_types(app_selected: bool, **kwargs):
-    subcategory_data = kwargs['subcategory_data']
     options_category = kwargs['options_category']
     options_subcategory = kwargs['options_subcategory']
     options_app = kwargs['options_app']
+    selection = kwargs['selection']
 
     INSTALL_OPTIONS = {
         "install_virtualbox": ("VirtualBox Extension Pack", VIRTUALBOX_OPTIONS, "Select if you wish to download the VirtualBox Extension Pack."),
         "install_docker_engine": ("Docker Installation Options", DOCKER_OPTIONS, "Select if you wish to install Portainer and/or the Nvidia container toolkit."),
-        "install_microsoft_fonts": ("Windows Font Groups", FONT_OPTIONS, "Choose how to install Windows fonts."),
-        "extra_swap_space": ("Select Disk Type:", DISK_OPTIONS, "Choose the type of drive being used.")
+        "install_microsoft_fonts": ("Windows Font Groups", FONT_OPTIONS, "Choose how to install Windows fonts.")
     }
 
     install_type_title, install_options, help_text = INSTALL_OPTIONS.get(options_app, (None, None, None))
     
     if app_selected:
-        app_key = f"{options_category}_{options_subcategory}_apps_{options_app}_install_type"
+        app_key = f"{get_widget_key(options_category, options_subcategory, options_app)}_install_type"
         installation_type = render_installation_type_selector(install_type_title, install_options, app_key, help_text)
-        subcategory_data['apps'][options_app]['installation_type'] = installation_type
+        selection.install_types[options_app] = installation_type
 
 def handle_swapspace(app_selected: bool, **kwargs):
-    subcategory_data = kwargs['subcategory_data']
-    options_category = kwargs['options_category']
-    options_subcategory = kwargs['options_subcategory']
-    options_app = kwargs['options_app']
-    distro_data = kwargs.get('distro_data', {})
-    swap_data = distro_data.get("advanced_settings", {}).get("system_settings", {}).get("apps", {}).get("extra_swap_space", {})
-    dict_key = ("advanced_settings", "system_settings", "apps", "extra_swap_space")
+    app_index = kwargs['app_index']
+    selection = kwargs['selection']
+    swap_data = app_index["extra_swap_space"].record
+    app_key = get_widget_key(kwargs['options_category'], kwargs['options_subcategory'], kwargs['options_app'])
 
     if app_selected:
-        entered_size = st.text_input("Enter the desired swap size in GB: (Max: 32)")
+        entered_size = st.text_input("Enter the desired swap size in GB: (Max: 32, leave empty to size it to the memory)", key=f"{app_key}_entered_size")
 
         try:
-            if entered_size.strip() and 1 <= int(entered_size) <= 32:
-                swap_data["entered_size"] = f"{int(entered_size)}G"
-                handle_special_installation_types(
-                        "extra_swap_space",
-                        subcategory_data=subcategory_data,
-                        options_category=options_category,
-                        options_subcategory=options_subcategory,
-                        options_app=options_app,
-                        distro_data=distro_data
-                    )
+            # Accept a trailing "G", as used by restored selections
+            entered_size = entered_size.strip().upper().removesuffix("G")
+            if not entered_size or entered_size == "AUTO":
+                # The script sizes the swap file to the memory it finds
+                selection.entered_values["extra_swap_space"] = {"entered_size": swap_data["default"]}
+            elif 1 <= int(entered_size) <= 32:
+                selection.entered_values["extra_swap_space"] = {"entered_size": f"{int(entered_size)}G"}
             else:
                 # Handle the case where input is invalid but not an exception
-                swap_data["entered_size"] = swap_data["default"]
-                handle_warnings_and_messages("extra_swap_space", distro_data, dict_key)
+                selection.entered_values["extra_swap_space"] = {"entered_size": swap_data["default"]}
+                handle_warnings_and_messages("extra_swap_space", app_index, selection)
         except ValueError:
-            swap_data["entered_size"] = swap_data["default"]
-            handle_warnings_and_messages("extra_swap_space", distro_data, dict_key)
+            selection.entered_values["extra_swap_space"] = {"entered_size": swap_data["default"]}
+            handle_warnings_and_messages("extra_swap_space", app_index, selection)
 
 def render_installation_type_selector(install_type_title: str, install_options: list, app_key:str, help_text: str) -> str:
     return st.radio(
@@ -335,26 +375,28 @@ def render_installation_type_selector(install_type_title: str, install_options:
         help=help_text
     )
 
-def handle_warnings_and_messages(options_app: str, distro_data: Dict[str, Any], dict_key: tuple):
-    target_data = distro_data[dict_key[0]][dict_key[1]][dict_key[2]][dict_key[3]]
-    codec_apps = {"install_multimedia_codecs", "install_intel_codecs", "install_nvidia_codecs", "install_amd_codecs"}
+def handle_warnings_and_messages(options_app: str, app_index: Mapping[str, catalog.AppEntry], selection: Selection):
+    target_data = app_index[options_app].record
     warning_message = ""
 
+    # Enable the apps this one requires, as the builder would
+    selected = {app_id: selection.install_types.get(app_id) for app_id in selection.selected_apps()}
+    for app_id, (installation_type, required_by) in catalog.resolve_requirements(app_index, selected).items():
+        selection.set_selected(app_id)
+        if installation_type is not None:
+            selection.install_types[app_id] = installation_type
+        if required_by == options_app:
+            st.warning(f"{app_index[app_id].record['name']} has been enabled, as {target_data['name']} requires it.")
+
     if target_data.get("warning", {}):
         if options_app == "set_hostname":
-            default_hostname = distro_data["system_config"]["recommended_settings"]["apps"]["set_hostname"]["default"]
+            default_hostname = app_index["set_hostname"].record["default"]
             warning_message = target_data["warning"].format(default_hostname=default_hostname)
-        elif options_app in codec_apps:
-            if not distro_data["system_config"]["useful_repos"]["apps"]["enable_rpmfusion"]["selected"]:
-                distro_data["system_config"]["useful_repos"]["apps"]["enable_rpmfusion"]["selected"] = True
-                st.warning("RPM Fusion has been enabled due to codec dependencies.")
-            if options_app == "install_nvidia_codecs":
-                warning_message = target_data["warning"]
         elif options_app == "install_virtualbox":
-            if distro_data['virtualization_apps']['virtualization_apps']['apps']['install_virtualbox']['installation_type'] == "with_extension":
+            if selection.install_types.get("install_virtualbox") == "with_extension":
                 warning_message = target_data["warning"]
         elif options_app == "install_microsoft_fonts":
-            if distro_data['customization']['fonts']['apps']['install_microsoft_fonts']['installation_type'] == "windows":
+            if selection.install_types.get("install_microsoft_fonts") == "windows":
                 warning_message = target_data["warning"]
         else:
             warning_message = target_data["warning"]
@@ -362,22 +404,12 @@ def handle_warnings_and_messages(options_app: str, distro_data: Dict[str, Any],
         if warning_message != "":
             st.warning(warning_message)
 
-def build_script(distro_data: Dict[str, Any], output_mode: str) -> str:
-    if distro_data["custom_script"] == "# Each command goes on a new line.":
-        script_parts = {
-            "system_config": builder.build_system_config(distro_data, output_mode),
-            "system_upgrade": builder.build_system_upgrade(distro_data, output_mode),
-            "app_install": builder.build_app_install(distro_data, output_mode),
-        }
-    else: 
-        script_parts = {
-            "system_config": builder.build_system_config(distro_data, output_mode),
-            "system_upgrade": builder.build_system_upgrade(distro_data, output_mode),
-            "app_install": builder.build_app_install(distro_data, output_mode),
-            "custom_script": builder.build_custom_script(distro_data, output_mode),
-        }
+def build_script(distro_data: Dict[str, Any], output_mode: str, script_parts: Dict[str, str] = None) -> str:
+    script_parts = dict(script_parts or builder.build_script_parts(distro_data, output_mode))
+    if distro_data["custom_script"] == DEFAULT_CUSTOM_TEXT:
+        script_parts.pop("custom_script", None)
 
-    preview_script = f"(...)  # Script header\n\n# Selected distro: {distro_data['system_config']['recommended_settings']['apps']['set_hostname']['default']}\n# Output Mode: {output_mode}\n\n"
+    preview_script = f"(...)  # Script header\n\n# Selected distro: {catalog.get_app_data(distro_data, 'set_hostname')['default']}\n# Output Mode: {output_mode}\n\n"
 
     # Rework this. Customization currently gets an App Install label
     for placeholder, content in script_parts.items():
@@ -389,19 +421,6 @@ def build_script(distro_data: Dict[str, Any], output_mode: str) -> str:
 
     return preview_script
 
-def build_full_script(template: str, distro_data: Dict[str, Any], output_mode: str) -> str:
-    script_parts = {
-        "system_config": builder.build_system_config(distro_data, output_mode),
-        "system_upgrade": builder.build_system_upgrade(distro_data, output_mode),
-        "app_install": builder.build_app_install(distro_data, output_mode),
-        "custom_script": builder.build_custom_script(distro_data, output_mode),
-    }
-
-    for placeholder, content in script_parts.items():
-        template = template.replace(f"{{{{{placeholder}}}}}", content)
-
-    return template
-
 def main():
     # Display header with a logo and links
     st.markdown("""
@@ -452,17 +471,31 @@ def main():
     if 'script_built' not in st.session_state:
         st.session_state.script_built = False
 
-    template = load_template()
-    distro_data, output_mode = render_sidebar()
+    st.session_state.profiling = profiling.is_enabled(st.query_params)
+    if st.session_state.profiling:
+        profiling.start_rerun(st.session_state, "page")
 
-    script_preview = st.empty()
+    template = builder.load_template(SCRIPT_TEMPLATE)
+
+    # Lets the section fragments tell a full page run apart from rerunning on their own
+    st.session_state.page_rendering = True
+    try:
+        distro_data, output_mode, script_preview = render_sidebar()
+    finally:
+        st.session_state.page_rendering = False
 
-    updated_script = build_script(distro_data, output_mode)
-    script_preview.code(updated_script, language="bash")
+    with profiling.stage(st.session_state, "build_script_parts"):
+        script_parts = builder.build_script_parts(distro_data, output_mode)
+    with profiling.stage(st.session_state, "build_script"):
+        updated_script = build_script(distro_data, output_mode, script_parts)
+    render_script_preview(script_preview, updated_script, distro_data)
 
     if st.button("Build Your Script"):
-        full_script = build_full_script(template, distro_data, output_mode)
+        with profiling.stage(st.session_state, "build_full_script"):
+            full_script = builder.build_full_script(template, distro_data, output_mode)  # Reuses the preview's sections
         st.session_state.full_script = full_script
+        with profiling.stage(st.session_state, "build_kickstart"):
+            st.session_state.kickstart = builder.build_kickstart(builder.load_template(KICKSTART_TEMPLATE), template, distro_data, output_mode)
         st.session_state.script_built = True
 
     # Display download button and instructions if script has been built
@@ -473,6 +506,13 @@ def main():
             file_name="f-pass.sh",
             mime="text/plain"
         )
+        st.download_button(
+            label="Download as Kickstart Sections",
+            data=st.session_state.kickstart,
+            file_name="f-pass.ks",
+            mime="text/plain",
+            help="For automated installs: the same setup as Kickstart %packages and %post sections, run by Anaconda during installation."
+        )
 
         st.markdown("""
         ### Your Script Has Been Created!
@@ -502,8 +542,17 @@ def main():
     st.markdown(f"""
     ### Impotant Notes:
     <span style="visibility: hidden;">....</span>⚠️ This script will install programs and make changes to your system. Use with care.  
-    <span style="visibility: hidden;">....</span>🛠️ This script may work with other distributions, but these commands were written with {distro_data['system_config']['recommended_settings']['apps']['set_hostname']['default']} in mind.  
+    <span style="visibility: hidden;">....</span>🛠️ This script may work with other distributions, but these commands were written with {catalog.get_app_data(distro_data, 'set_hostname')['default']} in mind.  
     """, unsafe_allow_html=True)
 
+    if st.session_state.profiling:
+        render_profile_panel(profiling.finish_rerun(st.session_state))
+
+def render_profile_panel(record: Dict[str, Any]):
+    # Sections that rerun on their own are logged, and counted in the session's timings the next time the page reruns
+    with st.expander("Profiling"):
+        st.caption(f"Session {record['session']}, rerun {record['rerun']}: {record['total_ms']:.1f} ms")
+        st.dataframe(profiling.get_session_rows(st.session_state, record), hide_index=True, use_container_width=True)
+
 if __name__ == "__main__":
     main()
@@ -0,0 +1,249 @@
+# Benchmarks for the catalog and builder pipeline
+#
+# Runs the catalog loading and script building steps against the real distro json file and
+# against synthetic catalogs of growing size, at several selection densities, loads a release
+# from synthetic registries of growing size, and reports the median time and peak memory of
+# each step:
+#
+#   python benchmark.py                      # Run and compare against the stored baseline
+#   python benchmark.py --save-baseline      # Run and store the results as the new baseline
+#   python benchmark.py --sizes 1000 --check # Exit with an error status if anything regressed
+#
+# Times depend on the machine, so baselines should be compared on the machine that stored them.
+# benchmark_baseline.json is kept out of git for that reason.
+#
+from typing import Dict, Any, Callable, Optional
+import argparse
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import builder
+import catalog
+import registry
+from selection import Selection
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_DISTRO = os.path.join(BASE_DIR, 'fedora40.json')
+DEFAULT_BASELINE = os.path.join(BASE_DIR, 'benchmark_baseline.json')
+DEFAULT_SIZES = [1000, 10000, 100000]
+DEFAULT_DENSITIES = [0.01, 0.1, 0.5]
+DEFAULT_RELEASE_COUNTS = [1, 100]
+
+def measure(func: Callable, setup: Optional[Callable] = None, repeat: int = 3) -> Dict[str, float]:
+    # Setup runs before every call and is not measured. Peak memory is measured in a separate
+    # call, as tracemalloc slows down the code it traces.
+    times = []
+    for _ in range(repeat):
+        args = setup() if setup else ()
+        gc.collect()
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+
+    args = setup() if setup else ()
+    gc.collect()
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {"time": statistics.median(times), "peak_kib": peak / 1024}
+
+def make_synthetic_catalog(base_catalog: Dict[str, Any], app_count: int) -> Dict[str, Any]:
+    # Repeat the subcategories of the real catalog with numbered ids until there are app_count apps.
+    # The first copy keeps the real ids, so apps the builders look up by id (set_hostname,
+    # extra_swap_space, enable_rpmfusion, ...) still exist.
+    synthetic_catalog, total, copy = {}, 0, 0
+    while total < app_count:
+        suffix = f"_{copy}" if copy else ""
+        for options_category, options_category_content in base_catalog.items():
+            if not isinstance(options_category_content, dict):
+                synthetic_catalog.setdefault(options_category, options_category_content)
+                continue
+
+            category = synthetic_catalog.setdefault(options_category, {})
+            for options_subcategory, subcategory_content in options_category_content.items():
+                if not isinstance(subcategory_content, dict) or 'apps' not in subcategory_content:
+                    category.setdefault(options_subcategory, subcategory_content)
+                    continue
+
+                apps = {}
+                for app_id, app_data in subcategory_content['apps'].items():
+                    if total >= app_count:
+                        break
+                    apps[f"{app_id}{suffix}"] = app_data
+                    total += 1
+                if apps:
+                    category[f"{options_subcategory}{suffix}"] = dict(subcategory_content, apps=apps)
+        copy += 1
+
+    return synthetic_catalog
+
+def make_selection(app_index: Dict[str, Any], app_positions: Dict[str, int], density: float, seed: int = 0) -> Selection:
+    rng = random.Random(seed)
+    selection = Selection(app_positions)
+    for app_id in rng.sample(list(app_index), max(1, round(len(app_index) * density))):
+        selection.set_selected(app_id)
+        installation_types = app_index[app_id].record.get('installation_types', {})
+        if installation_types:
+            selection.install_types[app_id] = rng.choice(list(installation_types))
+
+    selection.entered_values["set_hostname"] = {"entered_name": "benchmark"}
+    selection.entered_values["extra_swap_space"] = {"entered_size": "8"}
+    return selection
+
+def benchmark_catalog(name: str, file_name: str, densities: list[float], repeat: int) -> Dict[str, Dict[str, float]]:
+    results = {}
+
+    def load_cold():
+        catalog._CATALOG_CACHE.pop(file_name, None)
+        return catalog.load_cached_catalog(file_name)
+
+    results[f"{name}/load_app_data"] = measure(lambda: catalog.load_app_data(file_name), repeat=repeat)
+    results[f"{name}/load_cached_catalog (cold)"] = measure(load_cold, repeat=repeat)
+    results[f"{name}/load_cached_catalog (warm)"] = measure(lambda: catalog.load_cached_catalog(file_name), repeat=repeat)
+
+    cached = catalog.load_cached_catalog(file_name)
+    template = builder.load_template()
+
+    for density in densities:
+        case = f"{name}/{density:.0%}"
+        selection = make_selection(cached.app_index, cached.app_positions, density)
+
+        # The builders select dependencies in place, so each call gets a fresh overlay, and no sections built before
+        def setup():
+            builder.clear_section_cache()
+            return (catalog.create_selection_overlay(cached.catalog, selection, cached.app_index),)
+
+        # The full script again after one more app is selected, with the sections of the previous selection cached
+        changed_selection = make_selection(cached.app_index, cached.app_positions, density)
+        changed_selection.set_selected(next(app_id for app_id, entry in cached.app_index.items()
+                                            if not selection.is_selected(app_id) and entry.get_install_method().method == "flatpak"))
+
+        def setup_changed():
+            builder.clear_section_cache()
+            builder.build_full_script(template, catalog.create_selection_overlay(cached.catalog, selection, cached.app_index), "Quiet")
+            return (catalog.create_selection_overlay(cached.catalog, changed_selection, cached.app_index),)
+
+        results[f"{case}/create_selection_overlay"] = measure(lambda: catalog.create_selection_overlay(cached.catalog, selection, cached.app_index), repeat=repeat)
+        results[f"{case}/build_system_config"] = measure(lambda distro_data: builder.build_system_config(distro_data, "Quiet"), setup, repeat)
+        results[f"{case}/build_app_install"] = measure(lambda distro_data: builder.build_app_install(distro_data, "Quiet"), setup, repeat)
+        results[f"{case}/build_full_script"] = measure(lambda distro_data: builder.build_full_script(template, distro_data, "Quiet"), setup, repeat)
+        results[f"{case}/build_full_script (one app changed)"] = measure(lambda distro_data: builder.build_full_script(template, distro_data, "Quiet"), setup_changed, repeat)
+
+    return results
+
+def benchmark_registry(distro_file: str, release_count: int, repeat: int) -> Dict[str, Dict[str, float]]:
+    # A registry of spins of the distro file, each renaming a category. Loading one of them should
+    # take as long whatever the number of releases.
+    results, name = {}, f"registry-{release_count}"
+    with tempfile.TemporaryDirectory() as temp_dir:
+        registry_file = os.path.join(temp_dir, "catalogs.json")
+        releases = {"base": {"file": os.path.abspath(distro_file)}}
+        for number in range(release_count):
+            with open(os.path.join(temp_dir, f"spin-{number}.json"), 'w') as f:
+                json.dump({"system_config": {"name": f"System Configuration (spin {number})"}}, f)
+            releases[f"spin {number}"] = {"base": "base", "file": f"spin-{number}.json"}
+        with open(registry_file, 'w') as f:
+            json.dump(releases, f)
+
+        release = f"spin {release_count - 1}"
+        signature = registry.get_signature(release, registry_file)
+
+        def load_registry_cold():
+            registry._REGISTRY_CACHE.pop(registry_file, None)
+            return registry.load_registry(registry_file)
+
+        results[f"{name}/load_registry (cold)"] = measure(load_registry_cold, repeat=repeat)
+        results[f"{name}/compile_release"] = measure(lambda: registry.compile_release(registry.load_registry(registry_file), release), repeat=repeat)
+        registry.load_release(release, signature, registry_file)
+        results[f"{name}/load_release (compiled)"] = measure(lambda: registry.load_release(release, signature, registry_file), repeat=repeat)
+        registry._REGISTRY_CACHE.pop(registry_file, None)
+
+    return results
+
+def run_benchmarks(distro_file: str, sizes: list[int], densities: list[float], repeat: int, release_counts: list[int] = DEFAULT_RELEASE_COUNTS) -> Dict[str, Dict[str, float]]:
+    results = benchmark_catalog(os.path.splitext(os.path.basename(distro_file))[0], distro_file, densities, repeat)
+    for release_count in release_counts:
+        results.update(benchmark_registry(distro_file, release_count, repeat))
+
+    base_catalog = catalog.load_app_data(distro_file)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for size in sizes:
+            file_name = os.path.join(temp_dir, f"synthetic-{size}.json")
+            with open(file_name, 'w') as f:
+                json.dump(make_synthetic_catalog(base_catalog, size), f)
+            results.update(benchmark_catalog(f"synthetic-{size}", file_name, densities, repeat))
+            catalog._CATALOG_CACHE.pop(file_name, None)
+
+    return results
+
+def load_baseline(file_name: str) -> Dict[str, Dict[str, float]]:
+    try:
+        with open(file_name, 'r') as f:
+            return json.load(f).get("results", {})
+    except (OSError, json.JSONDecodeError):
+        return {}
+
+def save_baseline(file_name: str, results: Dict[str, Dict[str, float]]):
+    with open(file_name, 'w') as f:
+        json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2, sort_keys=True)
+        f.write("\n")
+
+def report(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]], threshold: float) -> list[str]:
+    # Print the results next to the baseline, and return the benchmarks that got slower or bigger
+    regressions = []
+    print(f"{'benchmark':<60} {'time (ms)':>11} {'peak (KiB)':>12} {'vs baseline':>18}")
+    for name, result in results.items():
+        comparison = ""
+        base = baseline.get(name)
+        if base:
+            time_ratio = result["time"] / base["time"] if base["time"] else 1.0
+            memory_ratio = result["peak_kib"] / base["peak_kib"] if base["peak_kib"] else 1.0
+            comparison = f"{time_ratio:5.2f}x {memory_ratio:5.2f}x mem"
+            # Differences under a millisecond are mostly noise
+            slower = time_ratio > threshold and result["time"] - base["time"] > 0.001
+            if slower or memory_ratio > threshold:
+                regressions.append(name)
+                comparison += " !"
+        print(f"{name:<60} {result['time'] * 1000:>11.2f} {result['peak_kib']:>12.1f} {comparison:>18}")
+    return regressions
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the F-PASS catalog and builder pipeline.")
+    parser.add_argument("--distro", default=DEFAULT_DISTRO, help="Distro json file. Default: fedora40.json")
+    parser.add_argument("--sizes", type=int, nargs="*", default=DEFAULT_SIZES, help="App counts of the synthetic catalogs. Default: 1000 10000 100000")
+    parser.add_argument("--densities", type=float, nargs="+", default=DEFAULT_DENSITIES, help="Fractions of apps selected. Default: 0.01 0.1 0.5")
+    parser.add_argument("--releases", type=int, nargs="*", default=DEFAULT_RELEASE_COUNTS, help="Release counts of the synthetic registries. Default: 1 100")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per benchmark; the median is reported. Default: 3")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline file. Default: benchmark_baseline.json")
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline.")
+    parser.add_argument("--threshold", type=float, default=1.25, help="Time or memory ratio that counts as a regression. Default: 1.25")
+    parser.add_argument("--check", action="store_true", help="Exit with an error status if any benchmark regressed.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None) -> int:
+    args = parse_args(argv)
+    results = run_benchmarks(args.distro, args.sizes, args.densities, args.repeat, args.releases)
+    baseline = load_baseline(args.baseline)
+    regressions = report(results, baseline, args.threshold)
+    if not baseline and not args.save_baseline:
+        print(f"No baseline in {args.baseline}. Run with --save-baseline to store one on this machine.")
+
+    if args.save_baseline:
+        save_baseline(args.baseline, results)
+        print(f"Baseline saved to {args.baseline}")
+    elif regressions:
+        print(f"{len(regressions)} benchmark(s) regressed by more than {args.threshold:.2f}x")
+        return 1 if args.check else 0
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
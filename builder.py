@@ -1,115 +1,560 @@
-from typing import Dict, Any
+from typing import Dict, Any, Mapping, Optional
+from catalog import AppEntry, get_app_data, get_app_index, get_commands, get_install_order, get_selected_ids, resolve_requirements, select_app, sort_install_order
+from steps import Step, DownloadStep, FlatpakInstallStep, PackageInstallStep, RepoAddStep, add_network_retries, bind_parameters, get_batch_step, lift_downloads, parse_commands, remove_shared_setup, render_steps, split_repo_setup
+import functools
+import hashlib
+import os
+import re
+import shlex
+import threading
+
+SCRIPT_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'template.sh')
+KICKSTART_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'kickstart.ks')
+DEFERRED_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'deferred.sh')
+DEFERRED_SCRIPT = "/usr/local/libexec/f-pass-deferred.sh"
+DEFERRED_WORK_DIR = "/var/lib/F-PASS/deferred"
+
+# The helper functions of the script template, which the Kickstart %post section and the deferred installs use too
+HELPERS_PATTERN = re.compile(r"^# >>> Helpers.*?\n(.*?)^# <<< Helpers", re.DOTALL | re.MULTILINE)
+
+# The placeholders of a template, e.g. {{app_install}}
+PLACEHOLDER_PATTERN = re.compile(r"\{\{(\w+)\}\}")
+
+# Built sections shared by the preview, the full script and the Kickstart, by every rerun and every session,
+# keyed by the section and a fingerprint of what it is built from. The oldest are dropped first.
+SECTION_CACHE_SIZE = 32
+_SECTION_CACHE: Dict[tuple, tuple] = {}
+_SECTION_CACHE_LOCK = threading.Lock()
+_SYSTEM_CONFIG_MASKS: Dict[int, tuple] = {}
+
+# Installs wget for the download lanes, which can run before any app installs it. It runs before the lanes start,
+# as DNF cannot run in the download lanes while the dnf lane holds its lock.
+WGET_INSTALL_COMMAND = "command -v wget > /dev/null || dnf -y install wget"
+
+# Kinds of detect items checked by already_present (template.sh), and their keys in an app's "detect"
+DETECT_KINDS = {"package": "packages", "flatpak": "flatpaks", "repo": "repos"}
+
+def build_step(step_id: str, name: str, commands: list[str], resumable: bool = True, detect: list[str] = ()) -> list[str]:
+    # step_start and step_end (template.sh) record the step's duration and exit status in the telemetry log.
+    # step_start fails for steps a previous run completed, so a rerun resumes where it stopped, unless
+    # the step is not resumable. already_present skips steps whose detect items were there before the
+    # script started. The commands are not indented, as they may contain heredocs.
+    condition = f"step_start {step_id} {shlex.quote(name)}{'' if resumable else ' always'}"
+    if detect:
+        condition = f"! already_present {shlex.quote(name)} {' '.join(shlex.quote(item) for item in detect)} && {condition}"
+    return [f"if {condition}; then", *commands, f"step_end {step_id}", "fi"]
+
+def build_lane(lane: str, section: str, commands: list[str], resumable: bool = True) -> list[str]:
+    # Wrap the commands in a function and start it as a background job in the given lane.
+    # start_lane (template.sh) waits for the previous job of the same lane before starting.
+    function_name = f"{section}_{lane}_lane"
+    step_commands = build_step(f"{section}_{lane}", f"{section.capitalize()} ({lane} lane)", commands, resumable)
+    return [f"{function_name}() {{", *(f"    {cmd}" for cmd in step_commands), "}", f"start_lane {lane} {function_name}", ""]
+
+def is_kickstart_package(batch_step: Optional[Step]) -> bool:
+    # Plain DNF installs that need no repositories set up in %post can be part of Anaconda's install transaction
+    return isinstance(batch_step, PackageInstallStep) and not batch_step.requires
+
+def get_detect_items(entry: AppEntry, app_data: Dict[str, Any]) -> list[str]:
+    # What shows that an app is already present: its "detect" entry (per installation type or for the
+    # app), or else the packages of apps that only install packages. Package groups cannot be detected.
+    installation_type = app_data.get('installation_type')
+    detect = app_data.get('installation_types', {}).get(installation_type, {}).get('detect', app_data.get('detect', {}))
+    if detect:
+        return [f"{kind}:{name}" for kind, key in DETECT_KINDS.items() for name in detect.get(key, [])]
+
+    install_method = entry.get_install_method(installation_type)
+    if install_method.method == "custom" or any(pkg.startswith("@") for pkg in install_method.packages):
+        return []
+    kind = "package" if install_method.method == "dnf" else "flatpak"
+    return [f"{kind}:{pkg}" for pkg in install_method.packages]
+
+def get_install_packages_command(apps: list[tuple], installer: str) -> str:
+    # The install_packages (template.sh) call for (app id, name, packages) tuples
+    items = [shlex.quote(f"{app_id}:{','.join(packages)}:{app_name}") for app_id, app_name, packages in apps]
+    return f"install_packages {shlex.quote(installer)} {' '.join(items)}"
+
+def get_checksum_commands(app_data: Dict[str, Any], downloads: list[DownloadStep]) -> list[str]:
+    # Apps can list the SHA-256 of their downloads in "checksums", keyed by URL
+    checksums = app_data.get("checksums", {})
+    return [f"verify_checksum {step.output} {checksums[step.url]}" for step in downloads if step.url in checksums]
+
+def get_prefetch_items(distro_data: Dict[str, Any]) -> tuple:
+    # What the selected apps will download that can be fetched during the system upgrade: Flathub refs and
+    # direct downloads. DNF packages are left out, as DNF holds its lock for the whole upgrade. Deferred
+    # apps are left out too, as they install after the restart.
+    refs, downloads = [], []
+    distro_data = check_dependencies(distro_data)
+    deferred_apps = get_deferred_apps(distro_data)
+    for entry in get_install_order(distro_data):
+        if entry.category == "system_config" or entry.app_id in deferred_apps:
+            continue
+
+        # Downloads that come with an app's repository setup run before the upgrade, in build_system_config
+        app_data = get_app_data(distro_data, entry.app_id)
+        _, app_steps = split_repo_setup(get_app_steps(distro_data, entry.app_id, app_data))
+        refs.extend(ref for step in app_steps if isinstance(step, FlatpakInstallStep) for ref in step.refs if ref not in refs)
+
+        app_downloads, _ = lift_downloads(app_steps)
+        if app_downloads:
+            downloads.append((app_data.get('name', 'unknown'), render_steps(add_network_retries(app_downloads, app_data.get("mirrors", {})), ""), get_checksum_commands(app_data, app_downloads)))
+
+    return refs, downloads
 
 def build_system_upgrade(options: Dict[str, Any], output_mode: str) -> str:
     quiet_redirect = " > /dev/null 2>&1" if output_mode == "Quiet" else ""
+    refs, downloads = get_prefetch_items(options) if options.get("prefetch") else ([], [])
+
+    lane_steps = [
+        "   [firmware] Updating firmware",
+        f"   [flatpak]  Enabling Flathub repo{' and prefetching Flatpak apps' if refs else ''}",
+        f"   [dnf]      Refresh all enabled repositories, install dnf-plugins-core and perform system upgrade",
+    ]
+    if downloads:
+        lane_steps.append("   [download] Downloading files")
     
     upgrade_commands = [
-        ('generate_log "Performing initial setup steps:\n'
-         '   1. Enabling Flathub repo\n'
-         '   2. Installing dnf-plugins-core\n'
-         '   3. Refresh all enabled repositories\n'
-         '   4. Updating firmware\n'
-         '   5. Performing system upgrade\n'
-         'Please be patient. This may take a while."\n'),
-        f"flatpak remote-add --if-not-exists flathub https://dl.flathub.org/repo/flathub.flatpakrepo{quiet_redirect}",
-        f"dnf -y check-update --refresh{quiet_redirect}",
-        f"dnf -y install dnf-plugins-core{quiet_redirect}",
+        'generate_log "Performing initial setup steps in parallel:\n' + "\n".join(lane_steps) + '\nPlease be patient. This may take a while."\n',
+        # The download lanes of this section and of the app installs need wget
+        WGET_INSTALL_COMMAND + quiet_redirect,
+        "",
+    ]
+    upgrade_commands += build_lane("firmware", "upgrade", [
         f"fwupdmgr refresh --force && fwupdmgr get-updates -y && fwupdmgr update -y --no-reboot-check",
+    ])
+
+    flatpak_commands = [f"retry_network {shlex.quote('flatpak remote-add --if-not-exists flathub https://dl.flathub.org/repo/flathub.flatpakrepo')}{quiet_redirect}"]
+    if refs:
+        # Pull the apps without deploying them, so installing them later only deploys them
+        flatpak_commands.append(f"flatpak install --noninteractive --no-deploy flathub {' '.join(refs)}{quiet_redirect} || generate_log \"WARNING: Prefetching Flatpak apps failed. They will be downloaded during installation.\"")
+    upgrade_commands += build_lane("flatpak", "upgrade", flatpak_commands)
+
+    dnf_commands = [
+        # check-update exits with 100 when updates are available, which is not a failure
+        f"dnf -y check-update --refresh{quiet_redirect} || [ $? -eq 100 ]",
+        f"dnf -y install dnf-plugins-core{quiet_redirect}",
         f"dnf -y upgrade{quiet_redirect}",
     ]
+    upgrade_commands += build_lane("dnf", "upgrade", dnf_commands)
+
+    if downloads:
+        # run_parallel and verify_checksum are defined in template.sh. The downloads run again on a
+        # rerun, as the apps that failed to install may have removed their files.
+        upgrade_commands += build_lane("download", "upgrade", [
+            f"generate_log \"Downloading files for {', '.join(app_name for app_name, _, _ in downloads)}...\"",
+            f"run_parallel {' '.join(shlex.quote(cmd + quiet_redirect) for _, app_downloads, _ in downloads for cmd in app_downloads)}",
+            *(cmd for _, _, checksum_commands in downloads for cmd in checksum_commands),
+        ], resumable=False)
     
     return "\n".join(upgrade_commands)
 
-def should_quiet_redirect(cmd: str) -> bool:
-    no_redirect_patterns = ["generate_log", "echo", "printf", "read", "prompt_", "EOF"]
-    # Check if the command starts with any of the patterns or contains "EOF" anywhere in the cmd
-    return not any(cmd.startswith(pattern) or "EOF" in cmd for pattern in no_redirect_patterns)
-
 def check_dependencies(distro_data: Dict[str, Any]) -> Dict[str, Any]:
-    multimedia_codecs = distro_data["system_config"]["multimedia_codecs"]["apps"]
-    if any(app.get("selected", False) for app in multimedia_codecs.values()):
-        distro_data["system_config"]["useful_repos"]["apps"]["enable_rpmfusion"]["selected"] = True
-    
-    if multimedia_codecs["install_nvidia_codecs"]["selected"]:
-        distro_data["system_config"]["useful_repos"]["apps"]["enable_nvidia_driver"]["selected"] = True
+    # Select the apps that provide what the selected apps require ("requires"/"provides" in the distro's json file),
+    # and put the selected apps in install order. Each builder calls this, but the work is only done once per selection.
+    if distro_data.get("requirements_resolved"):
+        return distro_data
+
+    app_index = get_app_index(distro_data)
+    selected = {app_id: get_app_data(distro_data, app_id).get('installation_type') for app_id in get_selected_ids(distro_data)}
+    for app_id, (installation_type, _) in resolve_requirements(app_index, selected).items():
+        select_app(distro_data, app_id)
+        if installation_type is not None:
+            get_app_data(distro_data, app_id)['installation_type'] = installation_type
+        selected[app_id] = installation_type
+
+    distro_data["install_order"] = sort_install_order(app_index, selected)
+    distro_data["requirements_resolved"] = True
     return distro_data
 
+def get_setup_owners(distro_data: Dict[str, Any], install_order: list[AppEntry]) -> Dict[str, str]:
+    # The first app, in install order, to run each shared setup command. Kept for as long as the install order is.
+    cached = distro_data.get("setup_owners")
+    if cached and cached[0] is install_order:
+        return cached[1]
+
+    setup_owners = {}
+    for entry in install_order:
+        # Plain DNF and Flatpak installs have no setup commands
+        app_data = get_app_data(distro_data, entry.app_id)
+        if entry.get_install_method(app_data.get('installation_type')).method != "custom":
+            continue
+        for step in parse_commands(entry.app_id, get_commands(app_data, app_data.get('installation_type'))):
+            if step.shared:
+                setup_owners.setdefault(step.command.strip(), entry.app_id)
+
+    distro_data["setup_owners"] = (install_order, setup_owners)
+    return setup_owners
+
+def get_deferred_apps(distro_data: Dict[str, Any]) -> set:
+    # Selected apps of the "deferred" tier, which install in the background after the restart. System config
+    # apps, and the apps that critical apps require, stay critical. Kickstart installs have no tiers.
+    install_order = get_install_order(check_dependencies(distro_data))
+    # build_kickstart copies the distro data, so the tiers are kept per install order and kind of output
+    kickstart = distro_data.get("kickstart", False)
+    cached = distro_data.get("deferred_apps")
+    if cached and cached[0] is install_order and cached[1] == kickstart:
+        return cached[2]
+
+    deferred_apps = set()
+    if not kickstart:
+        deferred_apps = {entry.app_id for entry in install_order if entry.tier == "deferred" and entry.category != "system_config"}
+
+    if deferred_apps:
+        installation_types = {entry.app_id: get_app_data(distro_data, entry.app_id).get('installation_type') for entry in install_order}
+        providers = {}
+        for entry in install_order:
+            for capability in entry.get_provides(installation_types[entry.app_id]):
+                providers.setdefault(capability, entry)
+
+        pending = [entry for entry in install_order if entry.app_id not in deferred_apps]
+        while pending:
+            entry = pending.pop()
+            for capability in entry.get_requires(installation_types[entry.app_id]):
+                provider = providers.get(capability)
+                if provider and provider.app_id in deferred_apps:
+                    deferred_apps.discard(provider.app_id)
+                    pending.append(provider)
+
+    distro_data["deferred_apps"] = (install_order, kickstart, deferred_apps)
+    return deferred_apps
+
+def get_parameter_values(app_data: Mapping[str, Any]) -> Dict[str, str]:
+    # The values entered in the interface, as the commands take them (steps.PARAMETERS)
+    values = {}
+    if "entered_name" in app_data:
+        values["entered_name"] = shlex.quote(app_data["entered_name"])
+    if "entered_size" in app_data:
+        swap_size = app_data["entered_size"]
+        if swap_size in {"", "auto"}:
+            values["entered_size"] = "$(tuning_value swap_size)"  # Sized to the memory probed on the target (template.sh)
+        else:
+            values["entered_size"] = shlex.quote(swap_size + "G" if swap_size.isdigit() else swap_size)
+    return values
+
+def get_app_steps(distro_data: Dict[str, Any], app_id: str, app_data: Dict[str, Any]) -> list[Step]:
+    installation_type = app_data.get("installation_type")
+    requires = get_app_index(distro_data)[app_id].get_requires(installation_type)
+    steps = parse_commands(app_id, get_commands(app_data, installation_type), requires)
+    return bind_parameters(steps, get_parameter_values(app_data))
+
 def build_system_config(distro_data: Dict[str, Any], output_mode: str) -> str:
-    def get_commands(app_data: dict) -> list[str]:
-        # Extract commands from app_data, handling installation types and redirection.
-        commands = app_data.get("installation_types", {}).get(app_data.get("installation_type"), {}).get("command", app_data.get("command", ""))
-        return [commands] if isinstance(commands, str) else commands
-    
-    def process_command(distro_data: Dict, output_mode: str, cmd: str, app_key: str) -> str:
-        if app_key == "set_hostname" and "hostnamectl set-hostname" in cmd:
-            cmd += f" {distro_data['system_config']['recommended_settings']['apps']['set_hostname']['entered_name']}"
-        
-        return cmd + (" > /dev/null 2>&1" if output_mode == "Quiet" and should_quiet_redirect(cmd) else "")
-    
+    quiet_redirect = " > /dev/null 2>&1" if output_mode == "Quiet" else ""
     distro_data = check_dependencies(distro_data)
-    config_commands = []
+    install_order = get_install_order(distro_data)
+    setup_owners = get_setup_owners(distro_data, install_order)
+    repo_commands, config_commands = [], []
+
+    for entry in install_order:
+        app_data = get_app_data(distro_data, entry.app_id)
+        if entry.category == "system_config":
+            steps = add_network_retries(remove_shared_setup(get_app_steps(distro_data, entry.app_id, app_data), setup_owners), app_data.get("mirrors", {}))
 
-    for subcategory_value in distro_data.get("system_config", {}).values():
-        if isinstance(subcategory_value, dict):
-            apps = subcategory_value.get("apps", {})
-            for app_key, app_data in apps.items():
-                if isinstance(app_data, dict) and app_data.get("selected"):
-                    config_commands.append(f"# {app_data.get('description', '')}")
-                                            
-                    for cmd in get_commands(app_data):
-                        config_commands.append(process_command(distro_data, output_mode, cmd, app_key))
-                    config_commands.append("")  # Empty line for readability
+            # Apps that set up package sources come first, in install order
+            phase_commands = repo_commands if any(isinstance(step, RepoAddStep) for step in steps) else config_commands
+            phase_commands.append(f"# {app_data.get('description', '')}")
+            phase_commands.extend(build_step(entry.app_id, app_data.get('name', entry.app_id), render_steps(steps, quiet_redirect), detect=get_detect_items(entry, app_data)))
+            # "always_command" runs in a step of its own, which already_present does not skip
+            always_commands = get_commands(app_data, app_data.get('installation_type'), 'always_command')
+            if always_commands:
+                always_steps = add_network_retries(parse_commands(entry.app_id, always_commands), app_data.get("mirrors", {}))
+                phase_commands.extend(build_step(f"{entry.app_id}_always", f"{app_data.get('name', entry.app_id)} (always)", render_steps(always_steps, quiet_redirect)))
+            phase_commands.append("")  # Empty line for readability
+        elif entry.get_install_method(app_data.get('installation_type')).method == "custom":
+            # Repositories added by the commands of other apps are moved here too
+            steps, _ = split_repo_setup(remove_shared_setup(get_app_steps(distro_data, entry.app_id, app_data), setup_owners))
+            if steps:
+                app_name = app_data.get('name', entry.app_id)
+                repo_commands.append(f"# Repositories for {app_name}")
+                commands = render_steps(add_network_retries(steps, app_data.get("mirrors", {})), quiet_redirect)
+                repo_commands.extend(build_step(f"{entry.app_id}_repos", f"{app_name} repositories", [f"generate_log \"Enabling repositories for {app_name}...\"", *commands]))
+                repo_commands.append("")
 
-    return "\n".join(config_commands)
+    return "\n".join(repo_commands + config_commands)
 
 def build_app_install(distro_data: Dict[str, Any], output_mode: str) -> str:
-    def get_commands(app_data: Dict[str, Any], quiet_redirect: str) -> list[str]:
-        commands = []
+    install_commands = []
+    dnf_apps = []
+    flatpak_apps, flatpak_refs = [], []
+    download_commands = []
+    quiet_redirect = " > /dev/null 2>&1" if output_mode == "Quiet" else ""
+    prefetch = distro_data.get("prefetch", False)
+    deferred_tier = distro_data.get("deferred_tier", False)
+    # The deferred script's steps are named apart from the main script's, as both write to the telemetry log
+    step_prefix, section = ("deferred_", "deferred") if deferred_tier else ("", "install")
+    current_subcategory = None
+    distro_data = check_dependencies(distro_data)
+    install_order = get_install_order(distro_data)
+    setup_owners = get_setup_owners(distro_data, install_order)
+    deferred_apps = get_deferred_apps(distro_data)
+
+    # Apps come in catalog order unless their requirements say otherwise, so apps of the same
+    # subcategory are grouped together
+    for entry in install_order:
+        # The deferred tier is built separately, by build_deferred_install
+        if entry.category == "system_config" or (entry.app_id in deferred_apps) != deferred_tier:
+            continue
+
+        app_data = get_app_data(distro_data, entry.app_id)
+        app_name = app_data.get('name', 'unknown')
+        steps = get_app_steps(distro_data, entry.app_id, app_data)
+        batch_step = get_batch_step(steps)
         
-        # Determine if 'command' or 'installation_types.command' is to be used
-        command = app_data.get('installation_types', {}).get(app_data.get('installation_type'), {}).get('command', app_data.get('command'))
+        # Plain package installs are collected into a single DNF transaction. Kickstarts also list them in
+        # %packages, which skips the packages Anaconda cannot find, and the transaction installs those.
+        if isinstance(batch_step, PackageInstallStep):
+            dnf_apps.append((step_prefix + entry.app_id, app_name, batch_step.packages))
+            continue
         
-        if not command:
-            return []
+        # Plain Flathub installs are merged into a single Flatpak call
+        if isinstance(batch_step, FlatpakInstallStep):
+            flatpak_apps.append(app_name)
+            flatpak_refs.extend(ref for ref in batch_step.refs if ref not in flatpak_refs)
+            continue
 
-        # Normalize to a list of commands
-        command_list = command if isinstance(command, list) else [command]
+        steps = add_network_retries(remove_shared_setup(steps, setup_owners), app_data.get("mirrors", {}))
+        _, steps = split_repo_setup(steps)  # Already run by build_system_config
 
-        # Add quiet redirect where applicable
-        for cmd in command_list:
-            if "SELECTEDSWAPSIZE" in cmd:
-                cmd = cmd.replace ("SELECTEDSWAPSIZE", distro_data["advanced_settings"]["system_settings"]["apps"]["extra_swap_space"]["entered_size"])
+        # Downloads are moved to the download lane, or were already fetched by the prefetch step
+        downloads, steps = lift_downloads(steps)
+        if downloads and not prefetch:
+            download_commands.append(f"generate_log \"Downloading files for {app_name}...\"")
+            download_commands.extend(render_steps(downloads, quiet_redirect))
+            download_commands.extend(get_checksum_commands(app_data, downloads))
 
-            commands.append(f"{cmd}{quiet_redirect if should_quiet_redirect(cmd) else ''}")
-        
-        return commands
-    
-    install_commands = []
-    quiet_redirect = " > /dev/null 2>&1" if output_mode == "Quiet" else ""
+        if (entry.category, entry.subcategory) != current_subcategory:
+            if current_subcategory:
+                install_commands.append("")  # Empty line for readability
+            current_subcategory = (entry.category, entry.subcategory)
+            install_commands.append(f"# Install {distro_data[entry.category][entry.subcategory].get('name', 'unknown')} applications")
+
+        install_commands.extend(build_step(step_prefix + entry.app_id, app_name, [
+            f"generate_log \"Installing {app_name}...\"",
+            *render_steps(steps, quiet_redirect),
+            f"generate_log \"{app_name} installed successfully.\"",
+        ], detect=get_detect_items(entry, app_data)))
+
+    if install_commands:
+        install_commands.append("")  # Empty line for readability
+
+    # The batched installs and downloads run in parallel lanes. All lanes, including those
+    # started by build_system_upgrade, finish before the custom install steps that rely on them.
+    batch_commands = []
+    if flatpak_refs:
+        # install_flatpaks (template.sh) falls back to per-ref installs if the batch fails.
+        # install_missing leaves out the refs and packages that were installed before the script started.
+        batch_commands.append("# Install Flatpak applications in a single pass")
+        batch_commands += build_lane("flatpak", section, [
+            f"generate_log \"Installing {', '.join(flatpak_apps)}...\"",
+            f"install_missing flatpak install_flatpaks {' '.join(flatpak_refs)}{quiet_redirect}",
+            f"generate_log \"Flatpak applications installed successfully.\"",
+        ])
+
+    if download_commands:
+        # Kickstarts and deferred installs have no system upgrade section to install wget, and no lanes running yet
+        if distro_data.get("kickstart", False) or deferred_tier:
+            batch_commands.append(WGET_INSTALL_COMMAND + quiet_redirect)
+        batch_commands.append("# Download files needed by the remaining applications")
+        batch_commands += build_lane("download", section, download_commands, resumable=False)
 
-    # Iterate through the top-level categories and their subcategories
-    for options_category, options_category_content in distro_data.items():
-        if options_category not in {"custom_script", "system_config"}:
-            for options_subcategory_content in options_category_content.values():
-                if isinstance(options_subcategory_content, dict):
-                    apps_content = options_subcategory_content.get('apps', {})
-                    selected_apps = {app_id: app_data for app_id, app_data in apps_content.items() if app_data.get('selected', False)}
-
-                    if selected_apps:
-                        install_commands.append(f"# Install {options_subcategory_content.get('name', 'unknown')} applications")
-
-                        # Generate commands for each selected app
-                        for app_data in selected_apps.values():
-                            install_commands.append(f"generate_log \"Installing {app_data.get('name', 'unknown')}...\"")
-                            install_commands.extend(get_commands(app_data, quiet_redirect))
-                            install_commands.append(f"generate_log \"{app_data.get('name', 'unknown')} installed successfully.\"")
-                    
-                        install_commands.append("")  # Empty line for readability
+    if dnf_apps:
+        # install_packages (template.sh) falls back to per-app install steps if the transaction fails
+        batch_commands.append("# Install DNF packages in a single transaction")
+        batch_commands += build_lane("dnf", section, [
+            f"generate_log \"Installing {', '.join(app_name for _, app_name, _ in dnf_apps)}...\"",
+            get_install_packages_command(dnf_apps, 'dnf install -y') + quiet_redirect,
+            f"generate_log \"DNF packages installed successfully.\"",
+        ])
+    
+    if batch_commands:
+        batch_commands += ["wait_lanes", ""]
+    
+    install_commands[:0] = batch_commands
 
     return "\n".join(install_commands)
 
 def build_custom_script(options: Dict[str, Any], output_mode: str) -> str:
     custom_script = options.get("custom_script", "").strip()
     if custom_script:
-        return f"{custom_script}\n"
+        return "\n".join(build_step("custom_script", "Custom script", [custom_script])) + "\n"
     return ""
+
+def build_deferred_install(distro_data: Dict[str, Any], output_mode: str) -> str:
+    # Write the deferred tier to a script that a low priority service runs after the restart, so the
+    # desktop can be used while the deferred apps install. The script disables the timer once all of
+    # its steps have succeeded, or after a few failed attempts.
+    deferred_apps = get_deferred_apps(distro_data)
+    if not deferred_apps:
+        return ""
+
+    script_parts = {"app_install": build_app_install(dict(distro_data, deferred_tier=True, prefetch=False), output_mode)}
+    script_parts["script_id"] = get_script_id(script_parts)
+    deferred_script = render_template(load_deferred_template(), script_parts, get_template_helpers(load_deferred_template(SCRIPT_TEMPLATE)))
+    app_names = ", ".join(get_app_data(distro_data, app_id).get('name', app_id) for app_id in sorted(deferred_apps, key=lambda app_id: get_app_index(distro_data)[app_id].position))
+
+    return "\n".join(build_step("deferred_install", "Schedule deferred installs", [
+        f"generate_log \"Scheduling {app_names} to install in the background after the restart...\"",
+        f"mkdir -p {os.path.dirname(DEFERRED_SCRIPT)} {DEFERRED_WORK_DIR}",
+        f"cat > {DEFERRED_SCRIPT} << 'F_PASS_DEFERRED_EOF'",
+        deferred_script.rstrip("\n"),
+        "F_PASS_DEFERRED_EOF",
+        f"chmod 755 {DEFERRED_SCRIPT}",
+        # Nice and IOSchedulingClass keep the installs from slowing down the desktop
+        "cat > /etc/systemd/system/f-pass-deferred.service << EOF",
+        "[Unit]",
+        "Description=F-PASS deferred app installs",
+        "Wants=network-online.target",
+        "After=network-online.target",
+        "",
+        "[Service]",
+        "Type=oneshot",
+        f"ExecStart={DEFERRED_SCRIPT} $ACTUAL_USER",
+        # Steps run in a directory of their own rather than in /
+        f"WorkingDirectory={DEFERRED_WORK_DIR}",
+        "Nice=19",
+        "IOSchedulingClass=idle",
+        "EOF",
+        "cat > /etc/systemd/system/f-pass-deferred.timer << EOF",
+        "[Unit]",
+        "Description=Start the F-PASS deferred app installs after boot",
+        "",
+        "[Timer]",
+        "OnBootSec=5min",
+        # Retries while steps keep failing, until the script disables the timer
+        "OnUnitInactiveSec=1h",
+        "",
+        "[Install]",
+        "WantedBy=timers.target",
+        "EOF",
+        "systemctl daemon-reload",
+        "systemctl enable f-pass-deferred.timer",
+    ])) + "\n"
+
+@functools.lru_cache(maxsize=None)
+def load_deferred_template(file_name: str = DEFERRED_TEMPLATE) -> str:
+    # The deferred script and its helpers are read once, as the section is rebuilt on every app change
+    return load_template(file_name)
+
+def get_template_helpers(template: str) -> str:
+    helpers = HELPERS_PATTERN.search(template)
+    return helpers.group(1) if helpers else ""
+
+@functools.lru_cache(maxsize=16)
+def compile_template(template: str, helpers: str = "") -> tuple:
+    # The template's text split around its placeholders, whose names are at the odd positions.
+    # The helpers go in first, as they hold the script id placeholder.
+    return tuple(PLACEHOLDER_PATTERN.split(template.replace("{{helpers}}", helpers)))
+
+def render_template(template: str, script_parts: Dict[str, str], helpers: str = "") -> str:
+    # Fills in all placeholders in one pass. Placeholders without a part are left as they are.
+    chunks = list(compile_template(template, helpers))
+    for position in range(1, len(chunks), 2):
+        chunks[position] = script_parts.get(chunks[position], f"{{{{{chunks[position]}}}}}")
+    return "".join(chunks)
+
+def load_template(file_name: str = SCRIPT_TEMPLATE) -> str:
+    with open(file_name, 'r') as file:
+        return file.read()
+
+def get_system_config_mask(app_index: Mapping[str, AppEntry]) -> int:
+    # Bits of the apps that can change the system config section: the system config apps, and the apps with custom
+    # commands, requirements or capabilities, which may add repositories, setup commands or other apps to the selection
+    cached = _SYSTEM_CONFIG_MASKS.get(id(app_index))
+    if cached and cached[0] is app_index:
+        return cached[1]
+
+    mask = 0
+    for entry in app_index.values():
+        if (entry.category == "system_config" or any(method.method == "custom" for method in entry.install_methods.values())
+                or any(entry.requires.values()) or any(len(provides) > 1 for provides in entry.provides.values())):
+            mask |= 1 << entry.position
+    _SYSTEM_CONFIG_MASKS[id(app_index)] = (app_index, mask)
+    return mask
+
+def get_section_key(distro_data: Dict[str, Any], output_mode: str, section: str) -> Optional[tuple]:
+    # What the section is built from, besides the catalog: the session's selection (create_selection_overlay)
+    # before the requirements are resolved, as they only depend on it. None if there is no selection to go by.
+    selection_state = distro_data.get("selection_state")
+    if selection_state is None:
+        return None
+
+    key = (section, output_mode, distro_data.get("kickstart", False))
+    if section == "custom_script":
+        return key + (distro_data.get("custom_script", ""),)
+    prefetch = distro_data.get("prefetch", False)
+    if section == "system_upgrade" and not prefetch:
+        return key
+
+    if section != "system_config":
+        return key + (prefetch, selection_state)
+
+    app_index = get_app_index(distro_data)
+    mask = get_system_config_mask(app_index)
+    bits, install_types, entered_values = selection_state
+    return key + (
+        bits & mask,
+        tuple((app_id, value) for app_id, value in install_types if app_id in app_index and mask >> app_index[app_id].position & 1),
+        tuple((app_id, values) for app_id, values in entered_values if app_id in app_index and mask >> app_index[app_id].position & 1),
+    )
+
+def build_section(distro_data: Dict[str, Any], output_mode: str, section: str) -> str:
+    # Reuse the section when nothing it is built from changed since it was last built
+    app_index = get_app_index(distro_data)
+    key = get_section_key(distro_data, output_mode, section)
+    if key is None:
+        return SECTION_BUILDERS[section](distro_data, output_mode)
+
+    with _SECTION_CACHE_LOCK:
+        cached = _SECTION_CACHE.get(key)
+    if cached and cached[0] is app_index:
+        return cached[1]
+
+    content = SECTION_BUILDERS[section](distro_data, output_mode)
+    with _SECTION_CACHE_LOCK:
+        _SECTION_CACHE.pop(key, None)
+        _SECTION_CACHE[key] = (app_index, content)
+        while len(_SECTION_CACHE) > SECTION_CACHE_SIZE:
+            del _SECTION_CACHE[next(iter(_SECTION_CACHE))]
+    return content
+
+def clear_section_cache():
+    with _SECTION_CACHE_LOCK:
+        _SECTION_CACHE.clear()
+
+def build_script_parts(distro_data: Dict[str, Any], output_mode: str, sections: set = None) -> Dict[str, str]:
+    return {section: build_section(distro_data, output_mode, section) for section in SECTION_BUILDERS if sections is None or section in sections}
+
+SECTION_BUILDERS = {
+    "system_config": build_system_config,
+    "system_upgrade": build_system_upgrade,
+    "app_install": build_app_install,
+    "custom_script": build_custom_script,
+    "deferred_install": build_deferred_install,
+}
+
+def get_script_id(script_parts: Dict[str, str]) -> str:
+    # Identifies the generated steps, so a rerun only resumes from the state of the same script
+    return hashlib.sha256("\0".join(script_parts.values()).encode()).hexdigest()[:16]
+
+def build_full_script(template: str, distro_data: Dict[str, Any], output_mode: str) -> str:
+    script_parts = build_script_parts(distro_data, output_mode)
+    script_parts["script_id"] = get_script_id(script_parts)
+    return render_template(template, script_parts)
+
+def get_kickstart_packages(distro_data: Dict[str, Any]) -> list[str]:
+    packages = ["dnf-plugins-core"]  # For the repositories set up in %post
+    for entry in get_install_order(check_dependencies(distro_data)):
+        if entry.category == "system_config":
+            continue
+        batch_step = get_batch_step(get_app_steps(distro_data, entry.app_id, get_app_data(distro_data, entry.app_id)))
+        if is_kickstart_package(batch_step):
+            packages.extend(pkg for pkg in batch_step.packages if pkg not in packages)
+    return packages
+
+def build_kickstart(kickstart_template: str, script_template: str, distro_data: Dict[str, Any], output_mode: str) -> str:
+    # The same selections as build_full_script, as Kickstart %packages and %post sections. Anaconda installs
+    # an up to date system, so the system upgrade section is left out.
+    distro_data = dict(distro_data, kickstart=True)
+    script_parts = build_script_parts(distro_data, output_mode, {"system_config", "app_install", "custom_script"})
+    script_parts["packages"] = "\n".join(get_kickstart_packages(distro_data))
+    script_parts["script_id"] = get_script_id(script_parts)
+    return render_template(kickstart_template, script_parts, get_template_helpers(script_template))
@@ -0,0 +1,289 @@
+from types import MappingProxyType
+from collections import ChainMap
+import collections
+from typing import Dict, Any, Mapping, NamedTuple, Optional
+from selection import Selection
+from steps import FlatpakInstallStep, PackageInstallStep, get_batch_step, parse_commands
+import heapq
+import logging
+import json
+import registry
+
+class InstallMethod(NamedTuple):
+    method: str  # "dnf", "flatpak" or "custom"
+    packages: tuple = ()
+
+class AppEntry(NamedTuple):
+    app_id: str
+    category: str
+    subcategory: str
+    position: int
+    record: Mapping[str, Any]
+    install_methods: Mapping[Optional[str], InstallMethod]  # Keyed by installation type, or None
+    requires: Mapping[Optional[str], tuple]  # App ids or capabilities needed, keyed like install_methods
+    provides: Mapping[Optional[str], frozenset]  # The app id and the capabilities it provides
+    tier: str = "critical"  # "critical" or "deferred", set on the app, its subcategory or its category
+
+    def get_install_method(self, installation_type: Optional[str] = None) -> InstallMethod:
+        return self.install_methods.get(installation_type) or self.install_methods[None]
+
+    def get_requires(self, installation_type: Optional[str] = None) -> tuple:
+        return self.requires.get(installation_type, self.requires[None])
+
+    def get_provides(self, installation_type: Optional[str] = None) -> frozenset:
+        return self.provides.get(installation_type, self.provides[None])
+
+class CachedCatalog(NamedTuple):
+    signature: tuple
+    catalog: Mapping[str, Any]
+    app_positions: Mapping[str, int]
+    app_index: Mapping[str, AppEntry]
+
+# Parsed catalogs shared by every session in the process, keyed by release or file name
+_CATALOG_CACHE: Dict[str, CachedCatalog] = {}
+
+def load_app_data(file_name: str) -> dict:
+    try:
+        return registry.read_catalog_file(file_name)
+    except FileNotFoundError:
+        logging.error(f"{file_name} not found!")
+        return {}
+    except json.JSONDecodeError:
+        logging.error(f"{file_name} is not a valid JSON file!")
+        return {}
+
+def freeze(data: Any) -> Any:
+    # Recursively convert dicts and lists into read-only mappings and tuples
+    if isinstance(data, dict):
+        return MappingProxyType({key: freeze(value) for key, value in data.items()})
+    if isinstance(data, list):
+        return tuple(freeze(value) for value in data)
+    return data
+
+def load_catalog(file_name: str) -> Mapping[str, Any]:
+    return load_cached_catalog(file_name).catalog
+
+def load_app_positions(file_name: str) -> Mapping[str, int]:
+    return load_cached_catalog(file_name).app_positions
+
+def load_app_index(file_name: str) -> Mapping[str, AppEntry]:
+    return load_cached_catalog(file_name).app_index
+
+def load_cached_catalog(file_name: str) -> CachedCatalog:
+    # Load a release from the registry, or a catalog file, once per process and only again when
+    # its files change on disk
+    signature = registry.get_signature(file_name)
+    cached = _CATALOG_CACHE.get(file_name)
+    if cached and cached.signature == signature:
+        return cached
+
+    data = registry.load_release(file_name, signature)
+    catalog = freeze(load_app_data(file_name) if data is None else data)
+    app_index = build_app_index(catalog)
+    app_positions = MappingProxyType({app_id: entry.position for app_id, entry in app_index.items()})
+    cached = CachedCatalog(signature, catalog, app_positions, app_index)
+    _CATALOG_CACHE[file_name] = cached
+    return cached
+
+def get_commands(app_data: Mapping[str, Any], installation_type: Optional[str] = None, field: str = 'command') -> list[str]:
+    # Use the commands of the installation type if there is one, otherwise the app's own commands
+    command = app_data.get('installation_types', {}).get(installation_type, {}).get(field, app_data.get(field))
+
+    if not command:
+        return []
+    return [command] if isinstance(command, str) else list(command)
+
+def classify_install_method(app_id: str, commands: list[str]) -> InstallMethod:
+    # Apps whose steps are a single package or Flathub install are batched with other apps (steps.get_batch_step)
+    batch_step = get_batch_step(parse_commands(app_id, commands))
+    if isinstance(batch_step, PackageInstallStep):
+        return InstallMethod("dnf", tuple(batch_step.packages))
+    if isinstance(batch_step, FlatpakInstallStep):
+        return InstallMethod("flatpak", tuple(batch_step.refs))
+    return InstallMethod("custom")
+
+def build_app_index(catalog: Mapping[str, Any]) -> Mapping[str, AppEntry]:
+    # Flatten the category/subcategory tree into app id -> AppEntry, in catalog order
+    app_index = {}
+    for options_category, options_category_content in catalog.items():
+        if not isinstance(options_category_content, Mapping):
+            continue
+        for options_subcategory, subcategory_content in options_category_content.items():
+            if not isinstance(subcategory_content, Mapping):
+                continue
+            for app_id, app_data in subcategory_content.get('apps', {}).items():
+                install_methods = {None: classify_install_method(app_id, get_commands(app_data))}
+                requires = {None: tuple(app_data.get('requires', ()))}
+                provides = {None: frozenset((app_id, *app_data.get('provides', ())))}
+
+                # Installation types add their own requirements and capabilities to the app's
+                for installation_type, type_data in app_data.get('installation_types', {}).items():
+                    install_methods[installation_type] = classify_install_method(app_id, get_commands(app_data, installation_type))
+                    requires[installation_type] = tuple(dict.fromkeys((*requires[None], *type_data.get('requires', ()))))
+                    provides[installation_type] = provides[None] | frozenset(type_data.get('provides', ()))
+
+                tier = app_data.get('tier') or subcategory_content.get('tier') or options_category_content.get('tier') or "critical"
+                app_index[app_id] = AppEntry(app_id, options_category, options_subcategory, len(app_index), app_data,
+                                             MappingProxyType(install_methods), MappingProxyType(requires), MappingProxyType(provides), tier)
+
+    return MappingProxyType(app_index)
+
+def create_selection_overlay(catalog: Mapping[str, Any], selection: Optional[Selection] = None, app_index: Optional[Mapping[str, AppEntry]] = None) -> Dict[str, Any]:
+    # Build a per-session view of the catalog. Each app is a ChainMap whose first map holds the
+    # session's values ('selected', 'installation_type', etc.), so writes never reach the shared catalog.
+    distro_data = {}
+    for options_category, options_category_content in catalog.items():
+        if not isinstance(options_category_content, Mapping):
+            distro_data[options_category] = options_category_content
+            continue
+
+        category_overlay = {}
+        for options_subcategory, subcategory_content in options_category_content.items():
+            if isinstance(subcategory_content, Mapping) and 'apps' in subcategory_content:
+                apps = {app_id: ChainMap(get_session_values(selection, app_id), app_data) for app_id, app_data in subcategory_content['apps'].items()}
+                category_overlay[options_subcategory] = dict(subcategory_content, apps=apps)
+            else:
+                category_overlay[options_subcategory] = subcategory_content
+        distro_data[options_category] = category_overlay
+
+    # Lets the builders look up apps directly and visit only the selected ones
+    app_index = app_index if app_index is not None else build_app_index(catalog)
+    distro_data["app_index"] = app_index
+    if selection is not None:
+        app_ids = tuple(app_index)
+        distro_data["selected_apps"] = {app_ids[position] for position in selection.selected_positions()}
+        distro_data["selection_state"] = selection.get_state()  # Lets the builders reuse sections built from the same selection
+
+    return distro_data
+
+def get_session_values(selection: Optional[Selection], app_id: str) -> Dict[str, Any]:
+    if selection is None:
+        return {'selected': False}
+
+    values = {'selected': selection.is_selected(app_id)}
+    if app_id in selection.install_types:
+        values['installation_type'] = selection.install_types[app_id]
+    values.update(selection.entered_values.get(app_id, {}))
+    return values
+
+def get_app_index(distro_data: Dict[str, Any]) -> Mapping[str, AppEntry]:
+    # Plain distro dicts (without an overlay) get an index built on the fly
+    if "app_index" not in distro_data:
+        distro_data["app_index"] = build_app_index(distro_data)
+    return distro_data["app_index"]
+
+def get_app_data(distro_data: Dict[str, Any], app_id: str) -> Mapping[str, Any]:
+    entry = get_app_index(distro_data)[app_id]
+    return distro_data[entry.category][entry.subcategory]['apps'][app_id]
+
+def get_selected_ids(distro_data: Dict[str, Any]) -> set:
+    if "selected_apps" not in distro_data:
+        distro_data["selected_apps"] = {app_id for app_id in get_app_index(distro_data) if get_app_data(distro_data, app_id).get('selected')}
+    return distro_data["selected_apps"]
+
+def get_selected_apps(distro_data: Dict[str, Any]) -> list[AppEntry]:
+    # Selected apps in catalog order
+    app_index = get_app_index(distro_data)
+    return sorted((app_index[app_id] for app_id in get_selected_ids(distro_data)), key=lambda entry: entry.position)
+
+def find_provider(app_index: Mapping[str, AppEntry], capability: str, selected: Mapping[str, Optional[str]]) -> Optional[tuple]:
+    # Find an app and installation type that provides the capability, in catalog order. An app that is
+    # already selected may switch to another installation type, if that type still provides everything
+    # the current one does. Most requirements are app ids, which are found without a search.
+    entries = [app_index[capability]] if capability in app_index else app_index.values()
+    for entry in entries:
+        installation_types = list(entry.record.get('installation_types', {})) or [None]
+        for installation_type in installation_types:
+            provides = entry.get_provides(installation_type)
+            if capability not in provides:
+                continue
+            if entry.app_id not in selected or provides >= entry.get_provides(selected[entry.app_id]):
+                return entry.app_id, installation_type
+    return None
+
+def resolve_requirements(app_index: Mapping[str, AppEntry], selected: Mapping[str, Optional[str]]) -> Dict[str, tuple]:
+    # Work out which apps must be added (or switched to another installation type) so that every
+    # requirement of the selected apps (app id -> installation type) is provided.
+    # Returns app id -> (installation type, id of the app that requires it).
+    selected = {app_id: installation_type for app_id, installation_type in selected.items() if app_id in app_index}
+    pending = collections.deque(app_id for app_id, installation_type in selected.items() if app_index[app_id].get_requires(installation_type))
+    if not pending:
+        return {}
+
+    provided = set().union(*(app_index[app_id].get_provides(installation_type) for app_id, installation_type in selected.items()))
+    changes = {}
+    while pending:
+        app_id = pending.popleft()
+        for capability in app_index[app_id].get_requires(selected[app_id]):
+            if capability in provided:
+                continue
+
+            provider = find_provider(app_index, capability, selected)
+            if provider is None:
+                logging.warning(f"Nothing provides '{capability}', which {app_id} requires")
+                continue
+
+            provider_id, installation_type = provider
+            selected[provider_id] = installation_type
+            provided |= app_index[provider_id].get_provides(installation_type)
+            changes[provider_id] = (installation_type, app_id)
+            pending.append(provider_id)
+
+    return changes
+
+def get_install_order(distro_data: Dict[str, Any]) -> list[AppEntry]:
+    # Selected apps ordered so that each app comes after the apps providing its requirements,
+    # and otherwise in catalog order. The order is kept until another app is selected.
+    if "install_order" not in distro_data:
+        installation_types = {entry.app_id: get_app_data(distro_data, entry.app_id).get('installation_type') for entry in get_selected_apps(distro_data)}
+        distro_data["install_order"] = sort_install_order(get_app_index(distro_data), installation_types)
+    return distro_data["install_order"]
+
+def sort_install_order(app_index: Mapping[str, AppEntry], installation_types: Mapping[str, Optional[str]]) -> list[AppEntry]:
+    # A topological sort of the selected apps (app id -> installation type), with the catalog position as tie-breaker
+    selected_apps = sorted((app_index[app_id] for app_id in installation_types), key=lambda entry: entry.position)
+
+    requirements = {entry.app_id: entry.get_requires(installation_types[entry.app_id]) for entry in selected_apps}
+    requirements = {app_id: capabilities for app_id, capabilities in requirements.items() if capabilities}
+    if not requirements:
+        return selected_apps
+
+    # Only the capabilities that some selected app requires need a provider
+    required = set().union(*requirements.values())
+    providers = {}
+    for entry in selected_apps:
+        for capability in required.intersection(entry.get_provides(installation_types[entry.app_id])):
+            providers.setdefault(capability, entry.app_id)
+
+    dependents, in_degree = {}, dict.fromkeys(installation_types, 0)
+    for app_id, capabilities in requirements.items():
+        for capability in capabilities:
+            provider_id = providers.get(capability)
+            if provider_id and provider_id != app_id:
+                dependents.setdefault(provider_id, []).append(app_id)
+                in_degree[app_id] += 1
+
+    ready = [(entry.position, entry.app_id) for entry in selected_apps if not in_degree[entry.app_id]]
+    heapq.heapify(ready)
+    install_order = []
+    while ready:
+        _, app_id = heapq.heappop(ready)
+        install_order.append(app_index[app_id])
+        for dependent_id in dependents.get(app_id, []):
+            in_degree[dependent_id] -= 1
+            if not in_degree[dependent_id]:
+                heapq.heappush(ready, (app_index[dependent_id].position, dependent_id))
+
+    if len(install_order) < len(selected_apps):
+        ordered = {entry.app_id for entry in install_order}
+        circular = [entry for entry in selected_apps if entry.app_id not in ordered]
+        logging.warning(f"Circular requirements between {', '.join(entry.app_id for entry in circular)}. Using catalog order for them.")
+        install_order.extend(circular)
+
+    return install_order
+
+def select_app(distro_data: Dict[str, Any], app_id: str):
+    get_app_data(distro_data, app_id)['selected'] = True
+    get_selected_ids(distro_data).add(app_id)
+    distro_data.pop("install_order", None)
+    distro_data.pop("requirements_resolved", None)
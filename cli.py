@@ -0,0 +1,125 @@
+# Headless script generation for F-PASS
+#
+# Builds f-pass.sh scripts from profiles without the Streamlit interface, either for a
+# single named profile or for a directory of per-host profile files:
+#
+#   python cli.py --profile Recommended --hostname lab-01 -o f-pass.sh
+#   python cli.py --profile-dir hosts/ --output-dir build/ --jobs 8
+#   python cli.py --profile Recommended --kickstart -o f-pass.ks
+#   python cli.py --profile Recommended --distro "Fedora 41"
+#
+# Per-host profile files are JSON, and may extend a profile from profiles.py:
+#   {"profile": "Recommended", "hostname": "lab-01", "apps": ["install_steam"]}
+#
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Any, Mapping, Optional
+import argparse
+import functools
+import logging
+import os
+import sys
+import builder
+import catalog
+import profiles
+import registry
+
+DEFAULT_DISTRO = registry.DEFAULT_RELEASE
+
+@functools.lru_cache(maxsize=None)
+def get_template(file_name: str = builder.SCRIPT_TEMPLATE) -> str:
+    # Loaded once per process, including each worker process
+    return builder.load_template(file_name)
+
+def create_profile_data(profile: Mapping[str, Any], distro_file: str, prefetch: bool = False) -> Dict[str, Any]:
+    app_index = catalog.load_app_index(distro_file)
+    selection = profiles.create_profile_selection(profile, app_index, catalog.load_app_positions(distro_file))
+
+    distro_data = catalog.create_selection_overlay(catalog.load_catalog(distro_file), selection, app_index)
+    distro_data["custom_script"] = profile.get("custom_script", "")
+    distro_data["prefetch"] = profile.get("prefetch", prefetch)
+    return distro_data
+
+def generate_script(profile: Mapping[str, Any], distro_file: str, output_mode: str, prefetch: bool = False, kickstart: bool = False) -> str:
+    distro_data = create_profile_data(profile, distro_file, prefetch)
+    if kickstart:
+        return builder.build_kickstart(get_template(builder.KICKSTART_TEMPLATE), get_template(), distro_data, profile.get("output_mode", output_mode))
+    return builder.build_full_script(get_template(), distro_data, profile.get("output_mode", output_mode))
+
+def write_script(output_path: str, script: str):
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, 'w') as file:
+        file.write(script)
+    os.chmod(output_path, 0o755)
+
+def generate_host_script(job: tuple) -> tuple:
+    # Runs in the worker processes, so it only takes and returns picklable values
+    profile_file, output_path, distro_file, output_mode, prefetch, kickstart = job
+    try:
+        profile = profiles.load_profile_file(profile_file)
+        write_script(output_path, generate_script(profile, distro_file, output_mode, prefetch, kickstart))
+        return profile_file, None
+    except (OSError, ValueError) as e:
+        return profile_file, str(e)
+
+def generate_host_scripts(profile_dir: str, output_dir: str, distro_file: str, output_mode: str, prefetch: bool, kickstart: bool, jobs: int) -> int:
+    output_name = "f-pass.ks" if kickstart else "f-pass.sh"
+    jobs_list = [
+        (profile_file, os.path.join(output_dir, os.path.splitext(os.path.basename(profile_file))[0], output_name), distro_file, output_mode, prefetch, kickstart)
+        for profile_file in profiles.list_profile_files(profile_dir)
+    ]
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(generate_host_script, jobs_list, chunksize=max(1, len(jobs_list) // (jobs * 4))))
+    else:
+        results = [generate_host_script(job) for job in jobs_list]
+
+    failures = [(profile_file, error) for profile_file, error in results if error]
+    for profile_file, error in failures:
+        logging.error(f"{profile_file}: {error}")
+
+    print(f"Generated {len(results) - len(failures)} of {len(results)} scripts in {output_dir}")
+    return 1 if failures else 0
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Generate F-PASS scripts from profiles without the web interface.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--profile", choices=sorted(profiles.PROFILES), help="Name of a profile from profiles.py.")
+    source.add_argument("--profile-file", help="JSON profile file for a single host.")
+    source.add_argument("--profile-dir", help="Directory of JSON profile files, one per host.")
+    parser.add_argument("--hostname", help="Hostname to set (single profile only).")
+    parser.add_argument("-o", "--output", help="Output file (single profile only). Default: f-pass.sh, or f-pass.ks with --kickstart")
+    parser.add_argument("--output-dir", default="build", help="Output directory for --profile-dir. Each host gets <output-dir>/<profile name>/f-pass.sh (or f-pass.ks). Default: build")
+    parser.add_argument("--distro", default=DEFAULT_DISTRO, help="Release from catalogs.json, or a distro json file. Default: Fedora 40")
+    parser.add_argument("--output-mode", choices=["Verbose", "Quiet"], default="Verbose", help="Default terminal output mode, unless set by the profile.")
+    parser.add_argument("--prefetch", action="store_true", help="Download Flatpak apps and files in the system upgrade step, unless set by the profile.")
+    parser.add_argument("--kickstart", action="store_true", help="Generate Kickstart %%packages and %%post sections instead of a script.")
+    parser.add_argument("-j", "--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes for --profile-dir. Default: number of CPUs")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None) -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    args = parse_args(argv)
+
+    if not catalog.load_app_index(args.distro):
+        logging.error(f"No apps could be loaded from {args.distro}")
+        return 1
+
+    if args.profile_dir:
+        return generate_host_scripts(args.profile_dir, args.output_dir, args.distro, args.output_mode, args.prefetch, args.kickstart, args.jobs)
+
+    output = args.output or ("f-pass.ks" if args.kickstart else "f-pass.sh")
+    try:
+        profile: Dict[str, Any] = profiles.load_profile_file(args.profile_file) if args.profile_file else dict(profiles.PROFILES[args.profile])
+        if args.hostname:
+            profile["hostname"] = args.hostname
+        write_script(output, generate_script(profile, args.distro, args.output_mode, args.prefetch, args.kickstart))
+    except (OSError, ValueError) as e:
+        logging.error(str(e))
+        return 1
+
+    print(f"Generated {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,31 @@
+#!/bin/bash
+# F-Pass - Deferred installs, run in the background by f-pass-deferred.service after the restart.
+# Progress is logged to the journal (journalctl -u f-pass-deferred) and to /var/log/F-PASS.log.
+# Steps that failed are retried an hour later and on the next boots, or run
+# "systemctl start f-pass-deferred.service" to retry them now.
+
+ACTUAL_USER=$1
+ACTUAL_HOME=$(getent passwd "$1" | cut -d: -f6)
+
+{{helpers}}
+generate_log "Installing the deferred apps in the background..."
+
+{{app_install}}
+
+wait_lanes
+
+# The timer starts the script again until every step has succeeded, or it has run DEFERRED_ATTEMPTS times
+DEFERRED_ATTEMPTS=${DEFERRED_ATTEMPTS:-5}
+ATTEMPTS_FILE="$STATE_DIR/$SCRIPT_ID.attempts"
+attempts=$(( $(cat "$ATTEMPTS_FILE" 2> /dev/null || echo 0) + 1 ))
+echo $attempts > "$ATTEMPTS_FILE"
+if [ ! -s "$FAILED_FILE" ]; then
+    systemctl disable --now f-pass-deferred.timer
+    generate_log "Deferred installs completed."
+elif [ $attempts -ge $DEFERRED_ATTEMPTS ]; then
+    systemctl disable --now f-pass-deferred.timer
+    generate_log "ERROR: Deferred steps failed $attempts times and will not be retried: $(sort -u "$FAILED_FILE" | tr '\n' ' ')"
+    exit 1
+else
+    generate_log "WARNING: Deferred steps failed and will be retried (attempt $attempts of $DEFERRED_ATTEMPTS): $(sort -u "$FAILED_FILE" | tr '\n' ' ')"
+fi
@@ -0,0 +1,277 @@
+# Dry runs of generated scripts, with stubbed package managers
+#
+# Runs a generated f-pass.sh in a sandbox directory where dnf, flatpak, fwupdmgr, wget, curl,
+# systemctl, hostnamectl and other system commands are stubs. The stubs record every call and
+# simulate its latency, and the report shows the number of calls, their order and the simulated
+# runtime, lanes included. No network or Fedora system is needed:
+#
+#   python dryrun.py --profile Recommended
+#   python dryrun.py --profile-file hosts/lab-01.json --latency dnf=60 --latency flatpak=10
+#   python dryrun.py --script f-pass.sh --calls --json > dryrun.json
+#   python dryrun.py --profile Recommended --hardware fixtures/nvme-16g
+#
+# Absolute paths under /etc, /var, /tmp and the like are moved into the sandbox, and the root check
+# is removed. The script's PATH only has the stubs and a few local tools (LOCAL_TOOLS), such as awk
+# and mkdir, and sudo only runs those. Other commands are recorded without running, and the report
+# lists them. Dry runs should still be run as a regular user.
+# The hardware tuning reads a copy of the --hardware directory, a tree with the proc/cpuinfo,
+# proc/meminfo, proc/mounts and sys/block files of the host to simulate, or an empty tree by default.
+#
+from typing import Dict, Any, Optional
+import argparse
+import heapq
+import json
+import logging
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import cli
+import profiles
+import telemetry_report
+
+# Simulated seconds per call. Commands that only change the system without taking long get a short latency.
+DEFAULT_LATENCIES = {
+    "dnf": 30.0, "flatpak": 20.0, "fwupdmgr": 15.0, "wget": 5.0, "curl": 2.0, "git": 3.0, "docker": 5.0,
+    "systemctl": 0.5, "hostnamectl": 0.2, "rpm": 0.5, "rpmkeys": 0.5, "reboot": 0.0, "sudo": 0.0,
+    "gsettings": 0.1, "chsh": 0.1, "swapon": 0.1, "mkswap": 0.1, "fallocate": 0.1, "chattr": 0.1, "btrfs": 0.1,
+    "nvidia-ctk": 0.5, "udevadm": 0.1, "sysctl": 0.1, "fc-cache": 1.0, "xdg-open": 0.0, "sleep": 0.0,
+}
+
+# Host commands the script may run for real. They only read and write files, which are in the sandbox.
+LOCAL_TOOLS = [
+    "bash", "sh", "awk", "sed", "grep", "cat", "echo", "printf", "mkdir", "cp", "mv", "rm", "ln", "touch", "chmod",
+    "tee", "head", "tail", "sort", "uniq", "wc", "cut", "tr", "sha256sum", "df", "ls", "dirname", "basename",
+    "date", "env", "timeout", "find", "xargs", "stat", "id", "getent", "true", "false", "test", "unzip",
+]
+
+# Directories whose absolute paths are moved into the sandbox
+SANDBOX_ROOTS = ["etc", "var", "usr/local", "usr/share", "opt", "tmp", "root", "home", "swaps", "boot"]
+SANDBOX_PATH_PATTERN = re.compile(r"(?<![\w.:/~$-])/(" + "|".join(re.escape(root) for root in SANDBOX_ROOTS) + r")(?=[/\s\"';)]|$)", re.MULTILINE)
+
+# Directories and files that the scripts expect on a Fedora system
+SANDBOX_DIRS = ["var/log", "var/lib", "etc/yum.repos.d", "etc/systemd/system", "usr/local/bin", "usr/share/fonts"]
+SANDBOX_FILES = ["etc/dnf/dnf.conf", "etc/dnf/automatic.conf", "etc/fstab", "etc/hostname"]
+
+# Each stub records its start and end time, name, latency and arguments as a tab separated line in
+# DRYRUN_LOG, and sleeps for its latency times DRYRUN_SCALE. A few calls give the output the scripts rely on.
+STUB_TEMPLATE = r"""#!/bin/bash
+start=$EPOCHREALTIME
+latency=LATENCY
+case "$1" in
+    -E) [ "${0##*/}" != rpm ] || echo 40 ;;  # rpm -E %fedora
+esac
+case "${0##*/}" in
+    sleep) latency=${1%s} ;;
+    wget|curl)
+        # Create the downloaded file, as later steps move or install it
+        output="" previous=""
+        for arg in "$@"; do
+            case "$previous" in -O|-o|--output-document|--output) output=$arg ;; esac
+            [[ "$arg" != http* ]] || url=$arg
+            previous=$arg
+        done
+        [ -n "$output" ] || { [ "${0##*/}" = wget ] && output=${url##*/}; }
+        [ -z "$output" ] || [ "$output" = "-" ] || : > "$output" 2> /dev/null
+        ;;
+esac
+command -p sleep "$(awk -v latency="$latency" -v scale="$DRYRUN_SCALE" 'BEGIN { printf "%.4f", latency * scale }')"
+printf '%s\t%s\t%s\t%s\t%s\n' "$start" "$EPOCHREALTIME" "${0##*/}" "$latency" "$*" >> "$DRYRUN_LOG"
+if [ "${0##*/}" = sudo ]; then
+    # Drop the options (sudo -u USER) and variables, and run the command if it is on the sandbox's PATH.
+    # Anything else is only recorded.
+    while [[ "$1" == -* ]]; do [ "$1" != -u ] || shift; shift; done
+    while [[ "$1" == [A-Za-z_]*=* ]]; do shift; done
+    [[ "$1" == */* ]] || [ -z "$(type -P "$1")" ] || exec "$@"
+    printf '%s\t%s\t%s\t0\t%s\n' "$EPOCHREALTIME" "$EPOCHREALTIME" "${1##*/}" "${*:2}" >> "$DRYRUN_LOG"
+fi
+exit 0
+"""
+
+# Commands that are neither stubs nor local tools are recorded without running. Exported, so the shells
+# that the script starts record them too.
+SCRIPT_PRELUDE = r"""command_not_found_handle() {
+    printf '%s\t%s\t%s\t0\t%s\n' "$EPOCHREALTIME" "$EPOCHREALTIME" "${1##*/}" "${*:2}" >> "$DRYRUN_LOG"
+}
+export -f command_not_found_handle
+"""
+
+def rewrite_script(script: str, sandbox_root: str) -> str:
+    # Move absolute system paths into the sandbox and drop the root check
+    script = script.replace('[ "$EUID" -eq 0 ]', 'true', 1)
+    return SANDBOX_PATH_PATTERN.sub(lambda match: f"{sandbox_root}/{match.group(1)}", script)
+
+def create_sandbox(sandbox_dir: str, latencies: Dict[str, float], hardware_dir: Optional[str] = None) -> Dict[str, str]:
+    paths = {name: os.path.join(sandbox_dir, name) for name in ("bin", "tools", "root", "work", "hardware")}
+    # The scripts write the I/O schedulers to sys/block, so they get a copy of the hardware tree
+    if hardware_dir:
+        shutil.copytree(hardware_dir, paths["hardware"])
+    for path in paths.values():
+        os.makedirs(path, exist_ok=True)
+    for directory in SANDBOX_ROOTS + SANDBOX_DIRS:
+        os.makedirs(os.path.join(paths["root"], directory), exist_ok=True)
+    for file_name in SANDBOX_FILES:
+        os.makedirs(os.path.dirname(os.path.join(paths["root"], file_name)), exist_ok=True)
+        open(os.path.join(paths["root"], file_name), 'a').close()
+
+    for command, latency in latencies.items():
+        stub_path = os.path.join(paths["bin"], command)
+        with open(stub_path, 'w') as f:
+            f.write(STUB_TEMPLATE.replace("LATENCY", str(latency)))
+        os.chmod(stub_path, 0o755)
+    for tool in LOCAL_TOOLS:
+        tool_path = shutil.which(tool)
+        if tool_path and tool not in latencies:
+            os.symlink(tool_path, os.path.join(paths["tools"], tool))
+
+    paths["log"] = os.path.join(sandbox_dir, "calls.tsv")
+    return paths
+
+def run_script(script: str, latencies: Dict[str, float], scale: float, timeout: float, sandbox_dir: str,
+               hardware_dir: Optional[str] = None) -> Dict[str, Any]:
+    paths = create_sandbox(sandbox_dir, latencies, hardware_dir)
+    script_path = os.path.join(sandbox_dir, "f-pass.sh")
+    with open(script_path, 'w') as f:
+        f.write(SCRIPT_PRELUDE + rewrite_script(script, paths["root"]))
+
+    env = dict(os.environ, PATH=f"{paths['bin']}:{paths['tools']}", HOME=os.path.join(paths["root"], "home"),
+               SUDO_USER="dryrun", DRYRUN_LOG=paths["log"], DRYRUN_SCALE=str(scale), HARDWARE_ROOT=paths["hardware"])
+    try:
+        completed = subprocess.run(["bash", script_path], cwd=paths["work"], env=env, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=timeout, text=True)
+        exit_status, output = completed.returncode, completed.stdout
+    except subprocess.TimeoutExpired as e:
+        exit_status, output = None, e.stdout.decode(errors="replace") if isinstance(e.stdout, bytes) else (e.stdout or "")
+
+    telemetry_file = os.path.join(paths["root"], "var", "log", "F-PASS.jsonl")
+    steps = telemetry_report.summarize_steps(telemetry_report.collect_steps([telemetry_file])) if os.path.exists(telemetry_file) else []
+    return {"exit_status": exit_status, "output": output, "calls": read_calls(paths["log"]), "steps": steps, "stubs": sorted(latencies)}
+
+def read_calls(log_file: str) -> list[Dict[str, Any]]:
+    calls = []
+    if os.path.exists(log_file):
+        with open(log_file, 'r') as f:
+            for line in f:
+                start, end, command, latency, args = line.rstrip("\n").split("\t", 4)
+                calls.append({"start": float(start), "end": float(end), "command": command, "latency": float(latency), "args": args})
+    return sorted(calls, key=lambda call: call["start"])
+
+def get_simulated_starts(calls: list[Dict[str, Any]]) -> list[float]:
+    # A call starts in simulated time when the calls that had ended before it started, in real time, have ended
+    # in simulated time, and takes its latency. Calls that overlapped in real time, such as those of different
+    # lanes, overlap in simulated time too, and the time bash takes between the calls does not count.
+    starts, running, ended = [], [], 0.0
+    for call in calls:
+        while running and running[0][0] <= call["start"]:
+            ended = max(ended, heapq.heappop(running)[1])
+        starts.append(ended)
+        heapq.heappush(running, (call["end"], ended + call["latency"]))
+    return starts
+
+def summarize(result: Dict[str, Any]) -> Dict[str, Any]:
+    calls = result["calls"]
+    starts = get_simulated_starts(calls)
+    commands: Dict[str, Dict[str, Any]] = {}
+    for call in calls:
+        command = commands.setdefault(call["command"], {"command": call["command"], "calls": 0, "simulated_time": 0.0})
+        command["calls"] += 1
+        command["simulated_time"] += call["latency"]
+
+    return {
+        "exit_status": result["exit_status"],
+        "calls": len(calls),
+        "package_manager_calls": sum(1 for call in calls if call["command"] in ("dnf", "flatpak")),
+        "simulated_runtime": max((start + call["latency"] for start, call in zip(starts, calls)), default=0.0),
+        "serial_runtime": sum(call["latency"] for call in calls),
+        "commands": sorted(commands.values(), key=lambda command: command["simulated_time"], reverse=True),
+        "order": [{"offset": start, "command": call["command"], "args": call["args"]} for start, call in zip(starts, calls)],
+        "not_run": sorted({call["command"] for call in calls} - set(result.get("stubs", ()))),
+        "steps": len(result["steps"]),
+        "failed_steps": [step["step"] for step in result["steps"] if step["failures"]],
+    }
+
+def print_summary(summary: Dict[str, Any], show_calls: bool):
+    status = "timed out" if summary["exit_status"] is None else f"exit status {summary['exit_status']}"
+    print(f"Script finished ({status}) after {summary['steps']} steps, {len(summary['failed_steps'])} failed")
+    if summary["failed_steps"]:
+        print(f"Failed steps: {', '.join(summary['failed_steps'])}")
+    print(f"Simulated runtime: {summary['simulated_runtime']:.1f} s (calls one after another: {summary['serial_runtime']:.1f} s)")
+    print(f"Calls: {summary['calls']}, of which {summary['package_manager_calls']} to dnf or flatpak")
+    if summary["not_run"]:
+        print(f"Recorded without running, as they have no stub: {', '.join(summary['not_run'])}")
+    print()
+
+    print(f"{'command':<14} {'calls':>6} {'simulated (s)':>14}")
+    for command in summary["commands"]:
+        print(f"{command['command']:<14} {command['calls']:>6} {command['simulated_time']:>14.1f}")
+
+    if show_calls:
+        print(f"\n{'offset (s)':>10}  call")
+        for call in summary["order"]:
+            print(f"{call['offset']:>10.1f}  {call['command']} {call['args']}")
+
+def parse_latency(value: str) -> tuple:
+    command, _, seconds = value.partition("=")
+    try:
+        return command, float(seconds)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected COMMAND=SECONDS, got '{value}'")
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run a generated F-PASS script with stubbed package managers and report the calls it makes.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--profile", choices=sorted(profiles.PROFILES), help="Name of a profile from profiles.py.")
+    source.add_argument("--profile-file", help="JSON profile file for a single host.")
+    source.add_argument("--script", help="An already generated script.")
+    parser.add_argument("--distro", default=cli.DEFAULT_DISTRO, help="Release from catalogs.json, or a distro json file. Default: Fedora 40")
+    parser.add_argument("--prefetch", action="store_true", help="Generate the script with prefetching, unless set by the profile.")
+    parser.add_argument("--latency", type=parse_latency, action="append", default=[], metavar="COMMAND=SECONDS", help="Simulated latency of a command. Can be repeated.")
+    parser.add_argument("--hardware", help="Directory with the proc and sys files of the host to simulate. Default: an empty tree")
+    parser.add_argument("--scale", type=float, default=0.01, help="Real seconds slept per simulated second. Default: 0.01")
+    parser.add_argument("--timeout", type=float, default=600, help="Real seconds before the run is stopped. Default: 600")
+    parser.add_argument("--calls", action="store_true", help="List every call in order.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    parser.add_argument("--keep", action="store_true", help="Keep the sandbox directory for inspection.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None) -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    args = parse_args(argv)
+    latencies = {**DEFAULT_LATENCIES, **dict(args.latency)}
+
+    try:
+        if args.script:
+            with open(args.script, 'r') as f:
+                script = f.read()
+        else:
+            profile = profiles.load_profile_file(args.profile_file) if args.profile_file else dict(profiles.PROFILES[args.profile])
+            script = cli.generate_script(profile, args.distro, "Verbose", args.prefetch)
+    except (OSError, ValueError) as e:
+        logging.error(str(e))
+        return 1
+
+    if args.hardware and not os.path.isdir(args.hardware):
+        logging.error(f"Hardware directory not found: {args.hardware}")
+        return 1
+
+    sandbox_dir = tempfile.mkdtemp(prefix="f-pass-dryrun-")
+    try:
+        result = run_script(script, latencies, args.scale, args.timeout, sandbox_dir, args.hardware)
+    finally:
+        if args.keep:
+            print(f"Sandbox kept in {sandbox_dir}", file=sys.stderr)
+        else:
+            shutil.rmtree(sandbox_dir, ignore_errors=True)
+
+    summary = summarize(result)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=2)
+        print()
+    else:
+        print_summary(summary, args.calls)
+    return 0 if result["exit_status"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
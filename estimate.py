@@ -0,0 +1,372 @@
+# Download size and runtime estimates for a selection of apps
+#
+# Joins the DNF packages and Flathub apps of a selection against a local snapshot of the repository
+# metadata, and reports what each category downloads, installs and how long that takes. The metadata
+# directory holds any number of:
+#
+#   *primary.xml[.gz|.xz|.bz2]  DNF repository metadata, e.g. from repodata/ of a mirror
+#   *.tsv                       Flathub listings, from:
+#                               flatpak remote-ls flathub --all --columns=application,branch,runtime,download-size,installed-size
+#   installed.txt               Optional. Packages and Flatpak apps already on a fresh install, which are not counted:
+#                               (rpm -qa --qf '%{NAME}\n'; flatpak list --columns=ref) > installed.txt
+#
+# The metadata is indexed once, into .f-pass-index.json in the same directory, and the index is kept in
+# memory until the files change, so estimates take milliseconds:
+#
+#   python estimate.py metadata/ --profile Recommended
+#   python estimate.py metadata/ --profile-file hosts/lab-01.json --machines 200 --bandwidth 1000 --json
+#
+from typing import Dict, Any, Iterator, Mapping, NamedTuple, Optional
+from xml.etree import ElementTree
+from steps import PackageInstallStep, FlatpakInstallStep
+import argparse
+import bz2
+import gzip
+import json
+import logging
+import lzma
+import os
+import platform
+import re
+import sys
+import builder
+import catalog
+import cli
+import profiles
+
+METADATA_ENV = "F_PASS_METADATA"
+DEFAULT_METADATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'metadata')
+INDEX_FILE = ".f-pass-index.json"
+INSTALLED_FILE = "installed.txt"
+INDEX_VERSION = 1
+
+# Projected times: the downloads share the uplink, and each package or Flatpak app takes some time to
+# install on top of writing its files
+DEFAULT_BANDWIDTH_MBIT = 100.0
+INSTALL_BYTES_PER_SECOND = 50e6
+PACKAGE_INSTALL_SECONDS = 0.5
+FLATPAK_INSTALL_SECONDS = 2.0
+
+RPM_NAMESPACES = {"common": "http://linux.duke.edu/metadata/common", "rpm": "http://linux.duke.edu/metadata/rpm"}
+PRIMARY_PATTERN = re.compile(r"primary\.xml(?:\.gz|\.xz|\.bz2)?$")
+# Sizes as printed by flatpak, e.g. "58.2 MB". GLib uses SI units.
+FLATPAK_SIZE_PATTERN = re.compile(r"([\d.,]+)\s*([kMGT]?B|bytes?)\b")
+FLATPAK_SIZE_UNITS = {"byte": 1, "bytes": 1, "B": 1, "kB": 1e3, "MB": 1e6, "GB": 1e9, "TB": 1e12}
+
+class PackageInfo(NamedTuple):
+    download_size: int
+    installed_size: int
+    requires: tuple = ()  # Names of the packages, or Flatpak runtimes, it needs
+
+class MetadataIndex(NamedTuple):
+    signature: tuple  # The name, modification time and size of each metadata file
+    rpms: Mapping[str, PackageInfo]
+    flatpaks: Mapping[str, PackageInfo]  # Keyed by app id, and by "runtime/branch" for runtimes
+    installed: frozenset
+
+# Indexes shared by every session in the process, keyed by directory
+_INDEX_CACHE: Dict[str, MetadataIndex] = {}
+
+def get_metadata_dir() -> Optional[str]:
+    directory = os.environ.get(METADATA_ENV) or DEFAULT_METADATA_DIR
+    return directory if os.path.isdir(directory) else None
+
+def get_metadata_files(directory: str) -> list[str]:
+    files = []
+    for root, _, names in os.walk(directory):
+        files.extend(os.path.join(root, name) for name in names if PRIMARY_PATTERN.search(name) or name.endswith(".tsv") or name == INSTALLED_FILE)
+    return sorted(files)
+
+def get_signature(directory: str, files: list[str]) -> tuple:
+    return tuple((os.path.relpath(file_name, directory), os.path.getmtime(file_name), os.path.getsize(file_name)) for file_name in files)
+
+def load_metadata_index(directory: str) -> MetadataIndex:
+    # Index the metadata once per process, from the index file when it is up to date, and again when the files change
+    files = get_metadata_files(directory)
+    signature = get_signature(directory, files)
+    cached = _INDEX_CACHE.get(directory)
+    if cached and cached.signature == signature:
+        return cached
+
+    index = read_index_file(directory, signature)
+    if index is None:
+        index = build_metadata_index(files, signature)
+        write_index_file(directory, index)
+    _INDEX_CACHE[directory] = index
+    return index
+
+def read_index_file(directory: str, signature: tuple) -> Optional[MetadataIndex]:
+    try:
+        with open(os.path.join(directory, INDEX_FILE), 'r') as f:
+            data = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if data.get("version") != INDEX_VERSION or [tuple(entry) for entry in data.get("signature", [])] != list(signature):
+        return None
+
+    return MetadataIndex(
+        signature,
+        {name: PackageInfo(download, installed, tuple(requires)) for name, (download, installed, requires) in data["rpms"].items()},
+        {name: PackageInfo(download, installed, tuple(requires)) for name, (download, installed, requires) in data["flatpaks"].items()},
+        frozenset(data["installed"]),
+    )
+
+def write_index_file(directory: str, index: MetadataIndex):
+    data = {
+        "version": INDEX_VERSION,
+        "signature": index.signature,
+        "rpms": index.rpms,
+        "flatpaks": index.flatpaks,
+        "installed": sorted(index.installed),
+    }
+    try:
+        with open(os.path.join(directory, INDEX_FILE), 'w') as f:
+            json.dump(data, f, separators=(",", ":"))
+    except OSError as e:
+        logging.warning(f"Could not save the metadata index: {e}")
+
+def build_metadata_index(files: list[str], signature: tuple) -> MetadataIndex:
+    rpm_records, flatpaks, installed = [], {}, set()
+    for file_name in files:
+        name = os.path.basename(file_name)
+        if name == INSTALLED_FILE:
+            installed.update(read_installed(file_name))
+        elif name.endswith(".tsv"):
+            flatpaks.update(iter_flatpak_listing(file_name))
+        else:
+            rpm_records.extend(iter_primary_packages(file_name))
+    return MetadataIndex(signature, resolve_rpm_requires(rpm_records), flatpaks, frozenset(installed))
+
+def open_metadata(file_name: str):
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, 'rb')
+    if file_name.endswith(".xz"):
+        return lzma.open(file_name, 'rb')
+    if file_name.endswith(".bz2"):
+        return bz2.open(file_name, 'rb')
+    return open(file_name, 'rb')
+
+def version_key(version: str) -> tuple:
+    # Close enough to rpmvercmp to pick the newest build: numeric segments sort as numbers, after letters
+    return tuple((1, int(segment)) if segment.isdigit() else (0, segment) for segment in re.findall(r"\d+|[a-zA-Z]+", version))
+
+def iter_primary_packages(file_name: str, arches: Optional[set] = None) -> Iterator[tuple]:
+    # Yields (name, version key, download size, installed size, requires, provides) of each binary package for this machine
+    arches = arches or {platform.machine(), "noarch"}
+    ns = RPM_NAMESPACES
+    try:
+        with open_metadata(file_name) as f:
+            for _, element in ElementTree.iterparse(f):
+                if element.tag != f"{{{ns['common']}}}package":
+                    continue
+                if element.get("type") == "rpm" and element.findtext("common:arch", namespaces=ns) in arches:
+                    version = element.find("common:version", ns)
+                    size = element.find("common:size", ns)
+                    fmt = element.find("common:format", ns)
+                    yield (
+                        element.findtext("common:name", namespaces=ns),
+                        (int(version.get("epoch") or 0), version_key(version.get("ver", "")), version_key(version.get("rel", ""))),
+                        int(size.get("package", 0)),
+                        int(size.get("installed", 0)),
+                        [entry.get("name") for entry in fmt.iterfind("rpm:requires/rpm:entry", ns)],
+                        [entry.get("name") for entry in fmt.iterfind("rpm:provides/rpm:entry", ns)] + [file.text for file in fmt.iterfind("common:file", ns)],
+                    )
+                element.clear()
+    except (OSError, EOFError, lzma.LZMAError, ElementTree.ParseError) as e:
+        logging.warning(f"{file_name}: skipping unreadable metadata ({e})")
+
+def resolve_rpm_requires(records: list[tuple]) -> Dict[str, PackageInfo]:
+    # Keep the newest build of each package, and turn its requirements into the names of the packages providing them
+    newest = {}
+    for record in records:
+        if record[0] not in newest or record[1] > newest[record[0]][1]:
+            newest[record[0]] = record
+
+    providers = {}
+    for name, _, _, _, _, provides in newest.values():
+        for capability in provides:
+            providers.setdefault(capability, name)
+    providers.update({name: name for name in newest})
+
+    rpms = {}
+    for name, _, download_size, installed_size, requires, _ in newest.values():
+        # Rich dependencies ("(a if b)") and rpmlib features are left out
+        needed = {providers[capability] for capability in requires if capability in providers}
+        needed.discard(name)
+        rpms[name] = PackageInfo(download_size, installed_size, tuple(sorted(needed)))
+    return rpms
+
+def parse_flatpak_size(value: str) -> int:
+    match = FLATPAK_SIZE_PATTERN.search(value)
+    if match is None:
+        return 0
+    return int(float(match.group(1).replace(",", ".")) * FLATPAK_SIZE_UNITS[match.group(2)])
+
+def iter_flatpak_listing(file_name: str) -> Iterator[tuple]:
+    # Yields (key, PackageInfo) for each ref. Apps are keyed by app id and need their runtime; runtimes are keyed by "id/branch".
+    with open(file_name, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) != 5:
+                if line.strip():
+                    logging.warning(f"{file_name}:{line_number}: expected application, branch, runtime, download size and installed size")
+                continue
+            app_id, branch, runtime, download_size, installed_size = fields
+            requires = tuple(get_flatpak_keys(runtime)[:1]) if runtime and not runtime.startswith(app_id + "/") else ()
+            info = PackageInfo(parse_flatpak_size(download_size), parse_flatpak_size(installed_size), requires)
+            yield f"{app_id}/{branch}", info
+            if requires:
+                yield app_id, info
+
+def get_flatpak_keys(ref: str) -> list[str]:
+    # "org.gnome.Platform/x86_64/46" is keyed as "org.gnome.Platform/46", and apps by their app id as well
+    parts = ref.split("/")
+    return [f"{parts[0]}/{parts[-1]}", parts[0]] if len(parts) == 3 else [ref]
+
+def read_installed(file_name: str) -> set:
+    installed = set()
+    with open(file_name, 'r') as f:
+        for line in f:
+            if line.strip() and not line.startswith("#"):
+                installed.update(get_flatpak_keys(line.strip()))
+    return installed
+
+def get_app_sources(distro_data: Dict[str, Any], entry: catalog.AppEntry) -> tuple:
+    # The DNF packages and Flathub apps that an app installs, as the builders run them
+    app_data = catalog.get_app_data(distro_data, entry.app_id)
+    packages, refs = [], []
+    for step in builder.get_app_steps(distro_data, entry.app_id, app_data):
+        if isinstance(step, PackageInstallStep):
+            packages.extend(package for package in step.packages if not package.startswith("@"))
+        elif isinstance(step, FlatpakInstallStep):
+            refs.extend(step.refs)
+    return packages, refs
+
+def add_with_requires(name: str, index: Mapping[str, PackageInfo], counted: set, installed: frozenset) -> tuple:
+    # The packages that installing name adds, with everything they need that is not counted or installed yet
+    added, missing = [], []
+    pending = [name]
+    while pending:
+        name = pending.pop()
+        if name in counted or name in installed:
+            continue
+        counted.add(name)
+        info = index.get(name)
+        if info is None:
+            missing.append(name)
+            continue
+        added.append(info)
+        pending.extend(info.requires)
+    return added, missing
+
+def estimate_selection(distro_data: Dict[str, Any], index: MetadataIndex, bandwidth_mbit: float = DEFAULT_BANDWIDTH_MBIT, machines: int = 1) -> list[Dict[str, Any]]:
+    # One row per category in install order, and a total row. Packages needed by several apps count once, for the first of them.
+    install_order = catalog.get_install_order(builder.check_dependencies(distro_data))
+    counted_rpms, counted_flatpaks = set(), set()
+    rows = {}
+    for entry in install_order:
+        row = rows.setdefault(entry.category, {
+            "category": distro_data[entry.category]["name"], "apps": 0, "packages": 0, "flatpaks": 0,
+            "download_bytes": 0, "installed_bytes": 0, "install_seconds": 0.0, "missing": [],
+        })
+        row["apps"] += 1
+        packages, refs = get_app_sources(distro_data, entry)
+        for name in packages:
+            added, missing = add_with_requires(name, index.rpms, counted_rpms, index.installed)
+            add_to_row(row, added, "packages", PACKAGE_INSTALL_SECONDS)
+            row["missing"].extend(missing)
+        for ref in refs:
+            added, missing = add_with_requires(ref, index.flatpaks, counted_flatpaks, index.installed)
+            add_to_row(row, added, "flatpaks", FLATPAK_INSTALL_SECONDS)
+            row["missing"].extend(missing)
+
+    rows = list(rows.values())
+    total = {"category": "Total", "apps": 0, "packages": 0, "flatpaks": 0, "download_bytes": 0, "installed_bytes": 0, "install_seconds": 0.0, "missing": []}
+    for row in rows:
+        for key in ("apps", "packages", "flatpaks", "download_bytes", "installed_bytes", "install_seconds", "missing"):
+            total[key] += row[key]
+    for row in [*rows, total]:
+        # The machines download at the same time through one uplink
+        row["download_seconds"] = round(row["download_bytes"] * 8 * machines / (bandwidth_mbit * 1e6), 1)
+        row["install_seconds"] = round(row["install_seconds"], 1)
+        row["total_seconds"] = round(row["download_seconds"] + row["install_seconds"], 1)
+    return [*rows, total]
+
+def add_to_row(row: Dict[str, Any], added: list[PackageInfo], count_key: str, seconds_each: float):
+    row[count_key] += len(added)
+    row["download_bytes"] += sum(info.download_size for info in added)
+    row["installed_bytes"] += sum(info.installed_size for info in added)
+    row["install_seconds"] += sum(info.installed_size for info in added) / INSTALL_BYTES_PER_SECOND + len(added) * seconds_each
+
+def format_size(size: float) -> str:
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1000:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1000
+    return f"{size:.1f} TB"
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(round(seconds)), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes:02d}m" if hours else f"{minutes}m {seconds:02d}s"
+
+def get_display_rows(rows: list[Dict[str, Any]]) -> list[Dict[str, Any]]:
+    # Rows for the preview table in the web interface
+    return [{
+        "category": row["category"],
+        "apps": row["apps"],
+        "packages": row["packages"],
+        "flatpaks": row["flatpaks"],
+        "download": format_size(row["download_bytes"]),
+        "installed": format_size(row["installed_bytes"]),
+        "time": format_duration(row["total_seconds"]),
+        "not found": ", ".join(row["missing"]),
+    } for row in rows]
+
+def print_report(rows: list[Dict[str, Any]]):
+    print(f"{'category':<28} {'apps':>5} {'pkgs':>6} {'flatpaks':>8} {'download':>10} {'installed':>10} {'download':>10} {'install':>10}")
+    for row in rows:
+        print(f"{row['category']:<28} {row['apps']:>5} {row['packages']:>6} {row['flatpaks']:>8} {format_size(row['download_bytes']):>10} "
+              f"{format_size(row['installed_bytes']):>10} {format_duration(row['download_seconds']):>10} {format_duration(row['install_seconds']):>10}")
+    missing = rows[-1]["missing"]
+    if missing:
+        print(f"\nNot in the metadata, and not counted: {', '.join(sorted(set(missing)))}")
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Estimate the download size, install size and runtime of an F-PASS selection from local repository metadata.")
+    parser.add_argument("metadata_dir", nargs="?", help=f"Directory of repository metadata. Default: ${METADATA_ENV}, or metadata/")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--profile", choices=sorted(profiles.PROFILES), help="Name of a profile from profiles.py.")
+    source.add_argument("--profile-file", help="JSON profile file for a single host.")
+    parser.add_argument("--distro", default=cli.DEFAULT_DISTRO, help="Release from catalogs.json, or a distro json file. Default: Fedora 40")
+    parser.add_argument("--bandwidth", type=float, default=DEFAULT_BANDWIDTH_MBIT, help=f"Uplink bandwidth in Mbit/s. Default: {DEFAULT_BANDWIDTH_MBIT:g}")
+    parser.add_argument("--machines", type=int, default=1, help="Machines downloading through the uplink at the same time. Default: 1")
+    parser.add_argument("--json", action="store_true", help="Print the estimate as JSON.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None) -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    args = parse_args(argv)
+
+    metadata_dir = args.metadata_dir or get_metadata_dir()
+    if not metadata_dir or not os.path.isdir(metadata_dir):
+        logging.error(f"Metadata directory not found: {metadata_dir or DEFAULT_METADATA_DIR}")
+        return 1
+
+    try:
+        profile = profiles.load_profile_file(args.profile_file) if args.profile_file else dict(profiles.PROFILES[args.profile])
+        distro_data = cli.create_profile_data(profile, args.distro)
+    except (OSError, ValueError) as e:
+        logging.error(str(e))
+        return 1
+
+    rows = estimate_selection(distro_data, load_metadata_index(metadata_dir), args.bandwidth, args.machines)
+    if args.json:
+        json.dump(rows, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(rows)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,20 +1,85 @@
+from typing import Dict, Any, Mapping
+from selection import Selection, is_valid_hostname
+import catalog
+import logging
+import json
+import os
+
+# Each profile lists app ids from the distro's json file, plus optional installation types,
+# entered values (hostname, swap size), a custom script and the output mode.
 PROFILES = {
     "Recommended": {
-        "system_config": ["configure_dnf", "enable_dnf_autoupdate", "firmware_updates", "enable_rpmfusion", "configure_power_settings"],
-        "essential_apps": ["install_mc", "install_bpytop", "install_rsync", "install_fastfetch", "install_unzip", "install_unrar", "install_git", "install_wget", "install_curl", "install_gnome_tweaks"],
-        "additional_apps": {
-            "internet_communication": ["install_vivaldi", "install_betterbird", "install_tor"],
-            "office_productivity": ["install_libreoffice", "install_joplin", "install_freetube"],
-            "media_graphics": ["install_vlc", "install_gimp", "install_inkscape"],
-            "system_tools": ["install_mission_center", "install_extension_manager", "install_gear_lever"],
+        "apps": [
+            "configure_dnf", "tune_system", "enable_dnf_autoupdate", "enable_rpmfusion",
+            "install_midnight_commander", "install_btop", "install_rsync", "install_fastfetch", "install_unzip", "install_unrar", "install_git", "install_wget", "install_curl", "install_gnome_tweaks",
+            "install_vivaldi", "install_betterbird", "install_tor",
+            "install_libreoffice", "install_joplin", "install_freetube",
+            "install_vlc", "install_gimp", "install_inkscape",
+            "install_mission_center", "install_extension_manager", "install_gear_lever",
+            "install_microsoft_fonts", "install_tela_icon_theme"
+        ],
+        "installation_types": {
+            "install_gimp": "DNF",
+            "install_vivaldi": "DNF",
+            "install_inkscape": "DNF",
+            "install_microsoft_fonts": "core"
         },
-        "customization": ["install_windows_fonts", "install_tela_icon_theme"],
-        "custom_script": "echo Created with \u2764\ufe0f for Open Source",
-        "installation_methods": {
-            "gimp_install_method": "DNF",
-            "vivaldi_install_method": "DNF",
-            "inkscape_install_method": "DNF",
-            "windows_fonts_method": "Microsoft Core Fonts"
-        }
+        "custom_script": "echo Created with ❤️ for Open Source"
     }
-}
\ No newline at end of file
+}
+
+def load_profile_file(file_name: str) -> Dict[str, Any]:
+    # A profile file may name a base profile from PROFILES and add to or override it
+    with open(file_name, 'r') as f:
+        host_profile = json.load(f)
+
+    base_name = host_profile.get("profile")
+    if base_name and base_name not in PROFILES:
+        raise ValueError(f"{file_name}: unknown base profile '{base_name}'")
+
+    return merge_profiles(PROFILES.get(base_name, {}), host_profile)
+
+def merge_profiles(base_profile: Mapping[str, Any], host_profile: Mapping[str, Any]) -> Dict[str, Any]:
+    profile = dict(base_profile)
+    profile.update({key: value for key, value in host_profile.items() if key not in {"apps", "installation_types", "entered_values"}})
+    profile["apps"] = list(dict.fromkeys([*base_profile.get("apps", []), *host_profile.get("apps", [])]))
+    profile["installation_types"] = {**base_profile.get("installation_types", {}), **host_profile.get("installation_types", {})}
+    profile["entered_values"] = {**base_profile.get("entered_values", {}), **host_profile.get("entered_values", {})}
+    return profile
+
+def create_profile_selection(profile: Mapping[str, Any], app_index: Mapping[str, catalog.AppEntry], app_positions: Mapping[str, int]) -> Selection:
+    unknown_apps = [app_id for app_id in profile.get("apps", []) if app_id not in app_index]
+    if unknown_apps:
+        raise ValueError(f"Unknown apps: {', '.join(unknown_apps)}")
+
+    selection = Selection(app_positions)
+    for app_id in profile.get("apps", []):
+        selection.set_selected(app_id)
+
+        # Apps with installation types default to the first one, like the sidebar's radio buttons
+        installation_types = app_index[app_id].record.get("installation_types", {})
+        if installation_types:
+            installation_type = profile.get("installation_types", {}).get(app_id, next(iter(installation_types)))
+            if installation_type not in installation_types:
+                raise ValueError(f"Unknown installation type '{installation_type}' for {app_id}")
+            selection.install_types[app_id] = installation_type
+
+    selection.entered_values.update({app_id: dict(values) for app_id, values in profile.get("entered_values", {}).items()})
+
+    # The hostname can also be given directly, as is usual for per-host profiles
+    if "set_hostname" in app_index and (profile.get("hostname") or selection.is_selected("set_hostname")):
+        selection.set_selected("set_hostname")
+        hostname = profile.get("hostname") or selection.entered_values.get("set_hostname", {}).get("entered_name", "")
+        if not is_valid_hostname(hostname):
+            if hostname:
+                logging.warning(f"Invalid hostname '{hostname}'. Using default: {app_index['set_hostname'].record['default']}")
+            hostname = app_index["set_hostname"].record["default"]
+        selection.entered_values["set_hostname"] = {"entered_name": hostname}
+
+    if selection.is_selected("extra_swap_space") and "extra_swap_space" not in selection.entered_values:
+        selection.entered_values["extra_swap_space"] = {"entered_size": app_index["extra_swap_space"].record["default"]}
+
+    return selection
+
+def list_profile_files(profile_dir: str) -> list[str]:
+    return sorted(os.path.join(profile_dir, file_name) for file_name in os.listdir(profile_dir) if file_name.endswith(".json"))
@@ -0,0 +1,157 @@
+# Opt-in profiling of the Streamlit app
+#
+# Set F_PASS_PROFILE=1 in the server's environment, or open the app with ?profile=1, to time the stages
+# of every rerun: loading the catalog, applying the selection, rendering each app section and building
+# the preview and the full script. The timings are shown in a debug panel and logged as one line per
+# rerun, e.g.:
+#
+#   2024-10-01 12:00:00 - INFO - PROFILE {"kind": "page", "rerun": 3, "session": "1f3a...", "stages": {...}, "total_ms": 41.2}
+#
+# Collect the server log from the shared instance and run:
+#
+#   python profiling.py streamlit.log
+#   python profiling.py streamlit.log --kind fragment --json
+#
+from typing import Dict, Any, Iterator, MutableMapping, Optional
+from telemetry_report import percentile
+import argparse
+import contextlib
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+
+PROFILE_ENV = "F_PASS_PROFILE"
+PROFILE_MARKER = "PROFILE "
+
+# Logs at INFO level even though the app logs warnings only
+profile_logger = logging.getLogger("f_pass.profile")
+profile_logger.setLevel(logging.INFO)
+
+def is_enabled(query_params: MutableMapping[str, str]) -> bool:
+    return os.environ.get(PROFILE_ENV, "") not in {"", "0"} or query_params.get("profile") == "1"
+
+def start_rerun(state: MutableMapping[str, Any], kind: str):
+    # kind is "page" for a full rerun, or "fragment" when an app section reran on its own
+    state["profile_rerun"] = {"kind": kind, "started": time.perf_counter(), "stages": {}}
+
+@contextlib.contextmanager
+def stage(state: MutableMapping[str, Any], name: str):
+    # Adds the time spent in the block to the stage of the current rerun. Does nothing unless profiling.
+    rerun = state.get("profile_rerun")
+    if rerun is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        rerun["stages"][name] = rerun["stages"].get(name, 0.0) + (time.perf_counter() - started) * 1000
+
+def finish_rerun(state: MutableMapping[str, Any]) -> Optional[Dict[str, Any]]:
+    # Log the rerun's timings and add them to the session's, which keep the count, total and maximum per stage
+    rerun = state.pop("profile_rerun", None)
+    if rerun is None:
+        return None
+
+    session = state.get("profile_session")
+    if session is None:
+        session = state["profile_session"] = {"id": uuid.uuid4().hex[:12], "reruns": 0, "stages": {}}
+    session["reruns"] += 1
+
+    record = {
+        "session": session["id"],
+        "rerun": session["reruns"],
+        "kind": rerun["kind"],
+        "stages": {name: round(elapsed, 2) for name, elapsed in rerun["stages"].items()},
+        "total_ms": round((time.perf_counter() - rerun["started"]) * 1000, 2),
+    }
+    for name, elapsed in [*record["stages"].items(), ("total", record["total_ms"])]:
+        count, total, maximum = session["stages"].get(name, (0, 0.0, 0.0))
+        session["stages"][name] = (count + 1, total + elapsed, max(maximum, elapsed))
+
+    profile_logger.info(PROFILE_MARKER + json.dumps(record, sort_keys=True))
+    return record
+
+def get_session_rows(state: MutableMapping[str, Any], record: Dict[str, Any]) -> list[Dict[str, Any]]:
+    # One row per stage for the debug panel: this rerun, and the mean and maximum of the session
+    session = state["profile_session"]
+    rows = []
+    for name, (count, total, maximum) in session["stages"].items():
+        rows.append({
+            "stage": name,
+            "this rerun (ms)": record["total_ms"] if name == "total" else record["stages"].get(name),
+            "session mean (ms)": round(total / count, 2),
+            "session max (ms)": round(maximum, 2),
+            "reruns": count,
+        })
+    return sorted(rows, key=lambda row: row["stage"] == "total")
+
+def iter_profile_records(file_name: str) -> Iterator[Dict[str, Any]]:
+    # PROFILE lines can be mixed with any other log output
+    with open(file_name, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            _, marker, payload = line.partition(PROFILE_MARKER)
+            if not marker:
+                continue
+            try:
+                yield json.loads(payload)
+            except json.JSONDecodeError:
+                logging.warning(f"{file_name}:{line_number}: skipping invalid profile line")
+
+def summarize_stages(records: Iterator[Dict[str, Any]]) -> list[Dict[str, Any]]:
+    durations: Dict[str, list[float]] = {}
+    sessions = set()
+    for record in records:
+        sessions.add(record.get("session"))
+        for name, elapsed in [*record.get("stages", {}).items(), ("total", record.get("total_ms", 0.0))]:
+            durations.setdefault(name, []).append(float(elapsed))
+
+    summaries = []
+    for name, values in durations.items():
+        values.sort()
+        summaries.append({
+            "stage": name,
+            "reruns": len(values),
+            "sessions": len(sessions),
+            "p50": percentile(values, 50),
+            "p90": percentile(values, 90),
+            "p99": percentile(values, 99),
+            "max": values[-1],
+        })
+    return sorted(summaries, key=lambda summary: summary["p90"], reverse=True)
+
+def print_report(summaries: list[Dict[str, Any]]):
+    print(f"{'stage':<40} {'reruns':>7} {'p50 (ms)':>10} {'p90 (ms)':>10} {'p99 (ms)':>10} {'max (ms)':>10}")
+    for summary in summaries:
+        print(f"{summary['stage']:<40} {summary['reruns']:>7} {summary['p50']:>10.1f} {summary['p90']:>10.1f} {summary['p99']:>10.1f} {summary['max']:>10.1f}")
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Report per-stage rerun times from the PROFILE lines in F-PASS app logs.")
+    parser.add_argument("paths", nargs="+", help="Log files of the Streamlit server.")
+    parser.add_argument("--kind", choices=["page", "fragment"], help="Only report full page reruns, or app sections that reran on their own.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None) -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    args = parse_args(argv)
+
+    try:
+        records = [record for path in args.paths for record in iter_profile_records(path) if args.kind in {None, record.get("kind")}]
+    except OSError as e:
+        logging.error(str(e))
+        return 1
+
+    summaries = summarize_stages(records)
+    if args.json:
+        json.dump(summaries, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(summaries)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,296 @@
+# Registry of the catalogs (distro releases and spins) F-PASS supports
+#
+# catalogs.json lists the releases in the order the web interface offers them. A release has a
+# complete catalog file, or names a base release and a file with only what differs from it:
+#
+#   "Fedora 41": {"base": "Fedora 40", "file": "fedora41.json"}
+#
+# The differences are merged into the base catalog key by key: objects are merged, null removes
+# a key, and anything else (names, command lists) replaces the base's value. New apps come after
+# the base's apps in their subcategory.
+#
+# Each release is validated and compiled into .f-pass-catalogs/ next to catalogs.json, in marshal
+# format, which loads several times faster than the JSON files and needs no merging. Releases are
+# compiled the first time they are loaded, and again when one of their files changes, or ahead of
+# time with:
+#
+#   python registry.py                # Validate and compile every release
+#   python registry.py --check        # Only validate, and exit with an error status on problems
+#
+# Only the registry and the release that is asked for are read, so the cost of loading a catalog
+# does not grow with the number of releases.
+#
+from typing import Dict, Any, Mapping, NamedTuple, Optional
+import argparse
+import json
+import logging
+import marshal
+import os
+import re
+import sys
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+REGISTRY_FILE = os.path.join(BASE_DIR, 'catalogs.json')
+COMPILED_DIR = ".f-pass-catalogs"
+COMPILED_VERSION = 1
+DEFAULT_RELEASE = "Fedora 40"
+TIERS = ("critical", "deferred")
+
+class Release(NamedTuple):
+    name: str
+    file: str
+    compiled_file: str
+    base: Optional[str] = None
+
+class Registry(NamedTuple):
+    mtime: Optional[float]
+    releases: Mapping[str, Release]
+
+# Registries shared by every session in the process, keyed by file name
+_REGISTRY_CACHE: Dict[str, Registry] = {}
+
+def read_catalog_file(file_name: str) -> dict:
+    with open(file_name, 'r') as f:
+        return json.load(f)
+
+def load_registry(registry_file: str = REGISTRY_FILE) -> Mapping[str, Release]:
+    # Read the registry once per process and only again when it changes on disk
+    try:
+        mtime = os.path.getmtime(registry_file)
+    except OSError:
+        mtime = None
+
+    cached = _REGISTRY_CACHE.get(registry_file)
+    if cached and cached.mtime == mtime:
+        return cached.releases
+
+    try:
+        entries = read_catalog_file(registry_file)
+    except FileNotFoundError:
+        logging.error(f"{registry_file} not found!")
+        entries = {}
+    except json.JSONDecodeError:
+        logging.error(f"{registry_file} is not a valid JSON file!")
+        entries = {}
+
+    releases = {}
+    directory = os.path.dirname(os.path.abspath(registry_file))
+    for name, entry in entries.items():
+        if not isinstance(entry, Mapping) or not isinstance(entry.get('file'), str):
+            logging.error(f"{registry_file}: release '{name}' has no catalog file")
+            continue
+        compiled_file = os.path.join(directory, COMPILED_DIR, re.sub(r"[^\w.-]+", "-", name).lower() + ".marshal")
+        releases[name] = Release(name, os.path.join(directory, entry['file']), compiled_file, entry.get('base'))
+
+    # Releases with a missing or circular base are left out, so the rest of the registry still loads
+    invalid_releases = set()
+    for name in releases:
+        try:
+            get_release_chain(releases, name)
+        except ValueError as e:
+            logging.error(f"{registry_file}: {e}")
+            invalid_releases.add(name)
+    releases = {name: release for name, release in releases.items() if name not in invalid_releases}
+
+    _REGISTRY_CACHE[registry_file] = Registry(mtime, releases)
+    return releases
+
+def get_release_chain(releases: Mapping[str, Release], name: str) -> list[Release]:
+    # The release and its bases, starting with the release that has a complete catalog
+    chain = []
+    while name is not None:
+        release = releases.get(name)
+        if release is None:
+            raise ValueError(f"unknown base release '{name}' of '{chain[-1].name}'")
+        if release in chain:
+            raise ValueError(f"circular base releases: {' -> '.join(entry.name for entry in chain)} -> {name}")
+        chain.append(release)
+        name = release.base
+    return chain[::-1]
+
+def get_file_signature(file_name: str) -> tuple:
+    try:
+        stat = os.stat(file_name)
+    except OSError:
+        return (file_name, None, None)
+    return (file_name, stat.st_mtime, stat.st_size)
+
+def get_signature(name: str, registry_file: str = REGISTRY_FILE) -> tuple:
+    # The modification time and size of each file the catalog is built from. Names that are not
+    # in the registry are catalog files.
+    releases = load_registry(registry_file)
+    files = [release.file for release in get_release_chain(releases, name)] if name in releases else [name]
+    return tuple(get_file_signature(file_name) for file_name in files)
+
+def merge_catalog(base: Mapping[str, Any], override: Mapping[str, Any]) -> Dict[str, Any]:
+    merged = dict(base)
+    for key, value in override.items():
+        if value is None:
+            merged.pop(key, None)
+        elif isinstance(value, Mapping) and isinstance(merged.get(key), Mapping):
+            merged[key] = merge_catalog(merged[key], value)
+        else:
+            merged[key] = value
+    return merged
+
+def is_string_list(value: Any) -> bool:
+    return isinstance(value, list) and all(isinstance(item, str) for item in value)
+
+def validate_app(app_data: Any) -> list[str]:
+    if not isinstance(app_data, Mapping):
+        return ["is not an object"]
+
+    errors = []
+    if not isinstance(app_data.get('name'), str):
+        errors.append("has no name")
+    if app_data.get('tier', TIERS[0]) not in TIERS:
+        errors.append(f"has an unknown tier '{app_data['tier']}'")
+
+    installation_types = app_data.get('installation_types', {})
+    if not isinstance(installation_types, Mapping):
+        return errors + ["has installation types that are not an object"]
+
+    # The app's own fields, then each installation type's, which fall back to the app's command
+    for label, data in [("", app_data), *((f"installation type '{name}' ", data) for name, data in installation_types.items())]:
+        if not isinstance(data, Mapping):
+            errors.append(f"{label}is not an object")
+            continue
+        for field, description in (('command', "a command"), ('always_command', "an always_command")):
+            command = data.get(field)
+            if command is not None and not isinstance(command, str) and not is_string_list(command):
+                errors.append(f"{label}has {description} that is not a string or a list of strings")
+        for field in ('requires', 'provides'):
+            if field in data and not is_string_list(data[field]):
+                errors.append(f"{label}has {field} that are not a list of strings")
+
+    if 'command' not in app_data and not installation_types:
+        errors.append("has no command")
+    errors.extend(f"installation type '{name}' has no command" for name, data in installation_types.items()
+                  if isinstance(data, Mapping) and 'command' not in data and 'command' not in app_data)
+    return errors
+
+def validate_catalog(data: Mapping[str, Any]) -> list[str]:
+    # Problems that would break the web interface or the builders
+    errors, app_ids, provided, required = [], set(), set(), []
+    for options_category, category_content in data.items():
+        if not isinstance(category_content, Mapping):
+            continue
+        if not isinstance(category_content.get('name'), str):
+            errors.append(f"{options_category}: has no name")
+
+        for options_subcategory, subcategory_content in category_content.items():
+            if not isinstance(subcategory_content, Mapping):
+                continue
+            location = f"{options_category}/{options_subcategory}"
+            if not isinstance(subcategory_content.get('name'), str):
+                errors.append(f"{location}: has no name")
+            apps = subcategory_content.get('apps', {})
+            if not isinstance(apps, Mapping):
+                errors.append(f"{location}: has apps that are not an object")
+                continue
+
+            for app_id, app_data in apps.items():
+                app_errors = validate_app(app_data)
+                errors.extend(f"{location}/{app_id}: {error}" for error in app_errors)
+                if app_id in app_ids:
+                    errors.append(f"{location}/{app_id}: is also in another subcategory")
+                app_ids.add(app_id)
+                if app_errors:
+                    continue
+
+                for type_data in [app_data, *app_data.get('installation_types', {}).values()]:
+                    provided.update(type_data.get('provides', ()))
+                    required.extend((app_id, capability) for capability in type_data.get('requires', ()))
+
+    errors.extend(f"{app_id}: nothing provides '{capability}'" for app_id, capability in required
+                  if capability not in app_ids and capability not in provided)
+    return errors
+
+def compile_release(releases: Mapping[str, Release], name: str) -> tuple:
+    # Merge the release's catalog files, and return the catalog and its problems
+    data, errors = {}, []
+    for release in get_release_chain(releases, name):
+        try:
+            data = merge_catalog(data, read_catalog_file(release.file))
+        except (OSError, ValueError) as e:
+            errors.append(f"{release.file}: {e}")
+    if not errors:
+        errors = validate_catalog(data)
+    return data, errors
+
+def read_compiled(file_name: str, signature: tuple) -> Optional[dict]:
+    try:
+        # Reading the whole file first is much faster than marshal.load() on the file
+        with open(file_name, 'rb') as f:
+            version, compiled_signature, data = marshal.loads(f.read())
+    except (OSError, EOFError, ValueError, TypeError):
+        return None
+    # The marshal format may change between Python versions
+    if version != (COMPILED_VERSION, marshal.version) or compiled_signature != signature:
+        return None
+    return data
+
+def write_compiled(file_name: str, signature: tuple, data: Mapping[str, Any]):
+    # Written under a temporary name first, as several processes may compile the same release
+    temp_file = f"{file_name}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(file_name), exist_ok=True)
+        with open(temp_file, 'wb') as f:
+            marshal.dump(((COMPILED_VERSION, marshal.version), signature, data), f)
+        os.replace(temp_file, file_name)
+    except OSError as e:
+        logging.warning(f"Could not save the compiled catalog: {e}")
+
+def load_release(name: str, signature: tuple, registry_file: str = REGISTRY_FILE) -> Optional[dict]:
+    # The release's catalog, from its compiled form when that is up to date. None if the name is not a release.
+    releases = load_registry(registry_file)
+    release = releases.get(name)
+    if release is None:
+        return None
+
+    data = read_compiled(release.compiled_file, signature)
+    if data is None:
+        data, errors = compile_release(releases, name)
+        for error in errors:
+            logging.error(f"{name}: {error}")
+        if not errors:
+            write_compiled(release.compiled_file, signature, data)
+    return data
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Validate the F-PASS catalogs and compile them for fast loading.")
+    parser.add_argument("releases", nargs="*", help="Releases to validate and compile. Default: all of them")
+    parser.add_argument("--registry", default=REGISTRY_FILE, help="Registry file. Default: catalogs.json")
+    parser.add_argument("--check", action="store_true", help="Only validate, without writing the compiled catalogs.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None) -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    args = parse_args(argv)
+
+    releases = load_registry(args.registry)
+    unknown_releases = [name for name in args.releases if name not in releases]
+    if unknown_releases:
+        logging.error(f"Unknown releases: {', '.join(unknown_releases)}")
+        return 1
+
+    failures = 0
+    for name in args.releases or releases:
+        data, errors = compile_release(releases, name)
+        if errors:
+            failures += 1
+            print(f"{name}: {len(errors)} problem(s)")
+            for error in errors:
+                print(f"  {error}")
+            continue
+
+        app_count = sum(len(subcategory_content.get('apps', {})) for category_content in data.values() if isinstance(category_content, Mapping)
+                        for subcategory_content in category_content.values() if isinstance(subcategory_content, Mapping))
+        if not args.check:
+            write_compiled(releases[name].compiled_file, get_signature(name, args.registry), data)
+        print(f"{name}: {app_count} apps{'' if args.check else ', compiled'}")
+
+    return 1 if failures or not releases else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,96 @@
+from typing import Dict, Mapping, Optional
+import base64
+import json
+import re
+import zlib
+
+TOKEN_VERSION = 1
+
+class Selection:
+    # Compact selection state for one session: a bitset over the catalog's app positions,
+    # plus the chosen installation types and entered values of the apps that have them.
+    __slots__ = ("app_positions", "bits", "install_types", "entered_values")
+
+    def __init__(self, app_positions: Mapping[str, int]):
+        self.app_positions = app_positions
+        self.bits = 0
+        self.install_types: Dict[str, str] = {}
+        self.entered_values: Dict[str, Dict[str, str]] = {}
+
+    def is_selected(self, app_id: str) -> bool:
+        position = self.app_positions.get(app_id)
+        return position is not None and bool(self.bits >> position & 1)
+
+    def set_selected(self, app_id: str, selected: bool = True):
+        position = self.app_positions.get(app_id)
+        if position is None:
+            return
+        self.bits = self.bits | (1 << position) if selected else self.bits & ~(1 << position)
+
+    def selected_positions(self) -> list[int]:
+        # Walks only the set bits, so the cost grows with the number of selected apps
+        positions, bits = [], self.bits
+        while bits:
+            lowest_bit = bits & -bits
+            positions.append(lowest_bit.bit_length() - 1)
+            bits ^= lowest_bit
+        return positions
+
+    def selected_apps(self) -> list[str]:
+        return [app_id for app_id, position in self.app_positions.items() if self.bits >> position & 1]
+
+    def get_state(self) -> tuple:
+        # A hashable snapshot of the selection
+        return (
+            self.bits,
+            tuple(sorted(self.install_types.items())),
+            tuple(sorted((app_id, tuple(sorted(values.items()))) for app_id, values in self.entered_values.items())),
+        )
+
+    def to_token(self) -> str:
+        # Only values of selected apps are kept so the token stays short
+        selected = set(self.selected_apps())
+        payload = {
+            "v": TOKEN_VERSION,
+            "c": catalog_fingerprint(self.app_positions),
+            "s": format(self.bits, "x"),
+            "t": {app_id: value for app_id, value in self.install_types.items() if app_id in selected},
+            "e": {app_id: values for app_id, values in self.entered_values.items() if app_id in selected},
+        }
+        data = zlib.compress(json.dumps(payload, separators=(",", ":")).encode(), 9)
+        return base64.urlsafe_b64encode(data).decode().rstrip("=")
+
+    @classmethod
+    def from_token(cls, token: str, app_positions: Mapping[str, int]) -> Optional["Selection"]:
+        # Returns None if the token is malformed or was created from a different catalog
+        try:
+            data = zlib.decompress(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+            payload = json.loads(data)
+            if payload.get("v") != TOKEN_VERSION or payload.get("c") != catalog_fingerprint(app_positions):
+                return None
+
+            selection = cls(app_positions)
+            selection.bits = int(payload["s"], 16)
+            selection.install_types = {str(key): str(value) for key, value in payload.get("t", {}).items()}
+            selection.entered_values = {str(key): {str(field): str(value) for field, value in values.items()}
+                                        for key, values in payload.get("e", {}).items()}
+            return selection
+        except (ValueError, TypeError, KeyError, AttributeError, zlib.error):
+            return None
+
+def catalog_fingerprint(app_positions: Mapping[str, int]) -> str:
+    # Tokens are only valid for the catalog layout they were created from
+    return format(zlib.crc32(",".join(app_positions).encode()), "08x")
+
+def is_valid_hostname(hostname: str) -> bool:
+    if not hostname or len(hostname) > 253:
+        return False
+
+    regex = re.compile(
+        r'^(?!-)[A-Za-z0-9-]{1,63}(?<!-)$'
+        r'(\.[A-Za-z0-9-]{1,63})*$'
+    )
+
+    # Split hostname by dots and validate each label
+    labels = hostname.split('.')
+    return all(regex.match(label) for label in labels)
@@ -0,0 +1,249 @@
+# Typed steps between the catalog's commands and the generated bash
+#
+# The builders parse each app's commands into steps once. Passes then work on the step types instead of
+# matching text: batching plain installs, sharing setup commands between apps, moving repository setup
+# and downloads ahead of the installs, filling in the values entered in the interface, and wrapping
+# network access in retries. Only the last pass renders the steps to bash. Parsed steps are shared by
+# every build in the process, so passes copy a step before changing it.
+#
+from typing import Mapping, Optional
+import copy
+import functools
+import os
+import re
+import shlex
+
+# Matches a single, plain DNF install of named packages (no URLs, local files or shell syntax)
+DNF_INSTALL_PATTERN = re.compile(r"^(?:sudo )?dnf (?:install -y|-y install) ([\w@.+-]+(?: [\w@.+-]+)*)\s*$")
+# Matches a single Flathub install of one application ref
+FLATPAK_INSTALL_PATTERN = re.compile(r"^flatpak install -y flathub ([\w.-]+)\s*$")
+
+# Placeholders in the catalog's commands for the values entered in the interface, and the app data keys of the values
+PARAMETERS = {"SELECTEDHOSTNAME": "entered_name", "SELECTEDSWAPSIZE": "entered_size"}
+
+# Setup commands that several apps may share (repos, keys, dnf plugins). Each runs once per script.
+SETUP_COMMAND_PATTERN = re.compile(r"^(?:sudo )?(?:dnf (?:-y )?config-manager |dnf (?:-y )?copr enable |rpm --import |rpmkeys --import |dnf (?:install -y|-y install) dnf-plugins-core\s*$)")
+
+# Commands that set up package sources: repositories, their keys and the DNF configuration. They all run before
+# the system upgrade refreshes the metadata, so the installs after it find every repository's metadata fresh.
+# Only commands that add, enable or write them count; reading or editing a repo file is left to the app.
+REPO_SETUP_PATTERN = re.compile(r"dnf (?:-y )?config-manager |dnf (?:-y )?copr enable |rpm(?:keys)? --import |dnf (?:-y )?install (?:-y )?https?://\S+-release-"
+                                r"|(?:>>?|\btee (?:-a )?|\bwget -O |\bset_config_value )\s*['\"]?(?:/etc/yum\.repos\.d/[^\s'\"]+\.repo|/etc/dnf/dnf\.conf)\b")
+
+# Matches a standalone download of a URL to a file, which can run ahead of the rest of an app's steps.
+# Groups: output file given before the URL, URL, output file given after the URL
+DOWNLOAD_PATTERN = re.compile(r"^(?:sudo -u \$ACTUAL_USER )?wget (?:-O (\S+) )?(https?://\S+)(?: -O (\S+))?\s*$")
+
+# Commands that fetch from the network, and can be retried when a mirror is slow or down. "config-manager
+# addrepo" is the DNF 5 form of "config-manager --add-repo", used from Fedora 41 on.
+# Group: the URL
+NETWORK_COMMAND_PATTERN = re.compile(r"^(?:sudo -u \$ACTUAL_USER )?(?:wget |curl |git clone |flatpak remote-add |rpm(?:keys)? (?:--import|-i) |dnf (?:-y )?(?:install (?:-y )?(?=https?://)|config-manager (?:--add-repo|addrepo) ))[^|;&]*?(https?://[^\s|;&]+)")
+
+# Opens a heredoc, whose body runs in another shell or is written to a file. Group: the delimiter
+HEREDOC_PATTERN = re.compile(r"(?<!<)<<(?!<)-?\s*(['\"]?)([A-Za-z_]\w*)\1")
+# A heredoc fed to a shell, whose body lines are commands
+HEREDOC_SCRIPT_PATTERN = re.compile(r"\b(?:ba|z)?sh (?:-s )?<<")
+
+# Commands that print or prompt, whose output Quiet mode keeps
+UNREDIRECTED_PREFIXES = ("generate_log", "echo", "printf", "read", "prompt_")
+
+class Step:
+    # A command of an app. url is set for network-bound commands, and retry once they are wrapped in retry_network,
+    # with the URL and its alternatives. shared marks setup commands that the first app to need them runs. requires
+    # holds what the app needs installed first ("requires" in the catalog). parameters maps the entered values the
+    # command takes to their shell-quoted values, which are None until bind_parameters fills them in.
+    __slots__ = ("app_id", "command", "redirect", "shared", "url", "retry", "requires", "parameters")
+
+    def __init__(self, app_id: str, command: str):
+        self.app_id = app_id
+        self.command = command
+        self.redirect = not command.startswith(UNREDIRECTED_PREFIXES)
+        self.shared = bool(SETUP_COMMAND_PATTERN.match(command))
+        match = NETWORK_COMMAND_PATTERN.match(command)
+        self.url = match.group(1) if match else None
+        self.retry = None
+        self.requires = ()
+        self.parameters = {name: None for placeholder, name in PARAMETERS.items() if placeholder in command}
+
+    def render(self, quiet_redirect: str) -> list[str]:
+        command = self.command
+        for placeholder, name in PARAMETERS.items():
+            if self.parameters.get(name) is not None:
+                command = command.replace(placeholder, self.parameters[name])
+        if self.retry is not None:
+            command = " ".join(["retry_network", shlex.quote(command), *(shlex.quote(url) for url in self.retry)])
+        return [command + (quiet_redirect if self.redirect else "")]
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.app_id!r}, {self.command!r})"
+
+class ShellStep(Step):
+    __slots__ = ()
+
+class LogStep(Step):
+    __slots__ = ()
+
+class RepoAddStep(Step):
+    # Sets up a repository, its key or the DNF configuration
+    __slots__ = ()
+
+class PackageInstallStep(Step):
+    __slots__ = ("packages",)
+
+    def __init__(self, app_id: str, command: str, packages: list[str]):
+        super().__init__(app_id, command)
+        self.packages = packages
+
+class FlatpakInstallStep(Step):
+    __slots__ = ("refs",)
+
+    def __init__(self, app_id: str, command: str, refs: list[str]):
+        super().__init__(app_id, command)
+        self.refs = refs
+
+class DownloadStep(Step):
+    __slots__ = ("output",)
+
+    def __init__(self, app_id: str, command: str, output: str):
+        super().__init__(app_id, command)
+        self.output = output
+
+class HeredocStep(Step):
+    # The command that opens a heredoc, its body and the closing delimiter. The body is left as it is
+    # by the passes, as it runs in another shell or is written to a file.
+    __slots__ = ("body", "end")
+
+    def __init__(self, app_id: str, command: str, body: list[Step], end: Optional[str]):
+        super().__init__(app_id, command)
+        self.redirect = False
+        self.url = None
+        self.body = body
+        self.end = end
+
+    def render(self, quiet_redirect: str) -> list[str]:
+        lines = [self.command, *(line for step in self.body for line in step.render(quiet_redirect))]
+        return lines + [self.end] if self.end is not None else lines
+
+def parse_command(app_id: str, command: str) -> Step:
+    if command.startswith("generate_log"):
+        return LogStep(app_id, command)
+    if REPO_SETUP_PATTERN.search(command):
+        return RepoAddStep(app_id, command)
+    if match := DOWNLOAD_PATTERN.match(command):
+        output_before, url, output_after = match.groups()
+        return DownloadStep(app_id, command, output_before or output_after or os.path.basename(url))
+    if match := DNF_INSTALL_PATTERN.match(command):
+        return PackageInstallStep(app_id, command, match.group(1).split())
+    if match := FLATPAK_INSTALL_PATTERN.match(command):
+        return FlatpakInstallStep(app_id, command, match.group(1).split())
+    return ShellStep(app_id, command)
+
+def parse_commands(app_id: str, commands: list[str], requires: tuple = ()) -> list[Step]:
+    return list(_parse_commands(app_id, tuple(commands), tuple(requires)))
+
+@functools.lru_cache(maxsize=None)
+def _parse_commands(app_id: str, commands: tuple, requires: tuple) -> tuple:
+    steps = []
+    lines = iter(commands)
+    for command in lines:
+        heredoc = HEREDOC_PATTERN.search(command)
+        if heredoc is None:
+            steps.append(parse_command(app_id, command))
+            continue
+        if heredoc.group(2) in (line.strip() for line in command[heredoc.end():].splitlines()):
+            steps.append(HeredocStep(app_id, command, [], None))  # The whole heredoc is in this command
+            continue
+
+        # Lines inside a heredoc are never lifted out of it, and are only redirected when they are commands
+        body, end = [], None
+        script = bool(HEREDOC_SCRIPT_PATTERN.search(command))
+        for line in lines:
+            if line.strip() == heredoc.group(2):
+                end = line
+                break
+            body.append(ShellStep(app_id, line))
+            body[-1].redirect = body[-1].redirect and script
+        steps.append(HeredocStep(app_id, command, body, end))
+
+    for step in steps:
+        step.requires = requires
+    return tuple(steps)
+
+def get_batch_step(steps: list[Step]) -> Optional[Step]:
+    # The package or Flathub install of apps that consist of nothing else, which can be batched with other apps'
+    install_steps = [step for step in steps if not isinstance(step, LogStep)]
+    if len(install_steps) == 1 and isinstance(install_steps[0], (PackageInstallStep, FlatpakInstallStep)):
+        return install_steps[0]
+    return None
+
+def with_command(step: Step, command: str) -> Step:
+    step = copy.copy(step)
+    step.command = command
+    return step
+
+def remove_shared_setup(steps: list[Step], setup_owners: Mapping[str, str]) -> list[Step]:
+    # Leave out the setup commands that an earlier app already runs
+    return [step for step in steps if not step.shared or setup_owners.get(step.command.strip(), step.app_id) == step.app_id]
+
+def split_repo_setup(steps: list[Step]) -> tuple:
+    # The repository setup that can run ahead of the app's other steps, and those other steps. Setup that
+    # comes after another of the app's steps stays in place, as it may need it, except for downloads and
+    # shared setup commands, which move along with the setup after them.
+    end = 0
+    for position, step in enumerate(steps):
+        if isinstance(step, RepoAddStep):
+            end = position + 1
+        elif not (isinstance(step, (LogStep, DownloadStep)) or step.shared):
+            break
+    return [step for step in steps[:end] if not isinstance(step, LogStep)], [step for step in steps[:end] if isinstance(step, LogStep)] + steps[end:]
+
+def lift_downloads(steps: list[Step]) -> tuple:
+    # The downloads that can run ahead of the app's other steps, and those other steps. They run from another
+    # directory than the app's steps, so files saved to the working directory go to DOWNLOAD_DIR (template.sh)
+    # instead, and the other steps refer to them there. Downloads run as the user and saved to the working
+    # directory stay with the app, as the user cannot write to DOWNLOAD_DIR.
+    downloads, others, renames = [], [], {}
+    for step in steps:
+        if not isinstance(step, DownloadStep):
+            others.append(step)
+        elif step.output.startswith(("/", "$")):
+            downloads.append(step)
+        elif step.command.startswith("sudo "):
+            others.append(step)
+        else:
+            output = f'"$DOWNLOAD_DIR/{step.output}"'
+            renames[step.output] = output
+            downloads.append(with_command(step, f"wget -O {output} {step.url}"))
+            downloads[-1].output = output
+
+    if renames:
+        pattern = re.compile(r"(?<![\w/.$-])(?:\./)?(" + "|".join(re.escape(name) for name in renames) + r")(?![\w/.-])")
+        others = [with_command(step, pattern.sub(lambda match: renames[match.group(1)], step.command))
+                  if not isinstance(step, HeredocStep) and pattern.search(step.command) else step for step in others]
+    return downloads, others
+
+def bind_parameters(steps: list[Step], values: Mapping[str, str]) -> list[Step]:
+    # Fill in the entered values that the steps take, including those in heredoc bodies
+    bound_steps = []
+    for step in steps:
+        if step.parameters or isinstance(step, HeredocStep) and any(line.parameters for line in step.body):
+            step = copy.copy(step)
+            step.parameters = {name: values.get(name) for name in step.parameters}
+            if isinstance(step, HeredocStep):
+                step.body = bind_parameters(step.body, values)
+        bound_steps.append(step)
+    return bound_steps
+
+def add_network_retries(steps: list[Step], mirrors: Mapping[str, list[str]]) -> list[Step]:
+    # Network-bound steps run through retry_network (template.sh), which falls back to the alternative URLs
+    # that apps can list in "mirrors", keyed by the URL (or part of it) they replace
+    retried_steps = []
+    for step in steps:
+        if step.url is not None:
+            step = copy.copy(step)
+            step.retry = next(([url, *alternatives] for url, alternatives in mirrors.items() if url in step.url), [])
+        retried_steps.append(step)
+    return retried_steps
+
+def render_steps(steps: list[Step], quiet_redirect: str) -> list[str]:
+    return [line for step in steps for line in step.render(quiet_redirect)]
@@ -0,0 +1,127 @@
+# Report on the step telemetry written by generated scripts
+#
+# Each script run appends JSON lines to /var/log/F-PASS.jsonl: a "start" and an "end" record per
+# step, with the step's duration and exit status. Collect the files from your machines and run:
+#
+#   python telemetry_report.py logs/*.jsonl
+#   python telemetry_report.py logs/ --sort failure_rate --min-runs 5
+#   python telemetry_report.py logs/ --json > report.json
+#
+# Steps that started but never ended (the script was interrupted or the machine rebooted) are
+# counted as failures.
+#
+from typing import Dict, Any, Iterator, Optional
+import argparse
+import json
+import logging
+import math
+import os
+import sys
+
+SORT_KEYS = ["p50", "p90", "p99", "max", "total", "failure_rate", "runs"]
+
+def iter_log_files(paths: list[str]) -> Iterator[str]:
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, file_names in os.walk(path):
+                yield from (os.path.join(root, file_name) for file_name in sorted(file_names) if file_name.endswith(".jsonl"))
+        else:
+            yield path
+
+def iter_records(file_name: str) -> Iterator[Dict[str, Any]]:
+    # Skip lines that are not valid records, such as a line cut short by a power loss
+    with open(file_name, 'r') as f:
+        for line_number, line in enumerate(f, 1):
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                logging.warning(f"{file_name}:{line_number}: skipping invalid line")
+                continue
+            if isinstance(record, dict) and "step" in record and "event" in record:
+                yield record
+
+def collect_steps(paths: list[str]) -> Dict[str, Dict[str, Any]]:
+    # Gather the durations and exit statuses of every step, across all runs in all files
+    steps: Dict[str, Dict[str, Any]] = {}
+    for file_name in iter_log_files(paths):
+        open_steps = {}
+        for record in iter_records(file_name):
+            step = steps.setdefault(record["step"], {"name": record["step"], "durations": [], "failures": 0, "incomplete": 0, "hosts": set()})
+            run_key = (record.get("host"), record.get("run"), record["step"])
+
+            if record["event"] == "start":
+                step["name"] = record.get("name") or step["name"]
+                open_steps[run_key] = record
+            elif record["event"] == "end":
+                open_steps.pop(run_key, None)
+                step["durations"].append(float(record.get("duration", 0)))
+                step["failures"] += record.get("status", 0) != 0
+                step["hosts"].add(record.get("host"))
+
+        for _, _, step_id in open_steps:
+            steps[step_id]["incomplete"] += 1
+
+    return steps
+
+def percentile(sorted_values: list[float], percent: float) -> float:
+    # Nearest-rank percentile
+    if not sorted_values:
+        return 0.0
+    return sorted_values[max(0, math.ceil(percent / 100 * len(sorted_values)) - 1)]
+
+def summarize_steps(steps: Dict[str, Dict[str, Any]]) -> list[Dict[str, Any]]:
+    summaries = []
+    for step_id, step in steps.items():
+        durations = sorted(step["durations"])
+        runs = len(durations) + step["incomplete"]
+        failures = step["failures"] + step["incomplete"]
+        summaries.append({
+            "step": step_id,
+            "name": step["name"],
+            "runs": runs,
+            "hosts": len(step["hosts"]),
+            "failures": failures,
+            "incomplete": step["incomplete"],
+            "failure_rate": failures / runs if runs else 0.0,
+            "p50": percentile(durations, 50),
+            "p90": percentile(durations, 90),
+            "p99": percentile(durations, 99),
+            "max": durations[-1] if durations else 0.0,
+            "total": sum(durations),
+        })
+    return summaries
+
+def print_report(summaries: list[Dict[str, Any]]):
+    print(f"{'step':<36} {'runs':>6} {'hosts':>6} {'fail %':>7} {'p50 (s)':>9} {'p90 (s)':>9} {'p99 (s)':>9} {'max (s)':>9} {'total (s)':>10}")
+    for summary in summaries:
+        print(f"{summary['step']:<36} {summary['runs']:>6} {summary['hosts']:>6} {summary['failure_rate']:>7.1%} "
+              f"{summary['p50']:>9.1f} {summary['p90']:>9.1f} {summary['p99']:>9.1f} {summary['max']:>9.1f} {summary['total']:>10.1f}")
+
+def parse_args(argv: Optional[list] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Report per-step latency percentiles and failure rates from F-PASS telemetry logs.")
+    parser.add_argument("paths", nargs="+", help="Telemetry files (F-PASS.jsonl), or directories containing them.")
+    parser.add_argument("--sort", choices=SORT_KEYS, default="p90", help="Sort the steps by this column, highest first. Default: p90")
+    parser.add_argument("--min-runs", type=int, default=1, help="Only report steps with at least this many runs.")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON.")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[list] = None) -> int:
+    logging.basicConfig(level=logging.WARNING, format='%(levelname)s - %(message)s')
+    args = parse_args(argv)
+
+    try:
+        summaries = summarize_steps(collect_steps(args.paths))
+    except OSError as e:
+        logging.error(str(e))
+        return 1
+
+    summaries = sorted((summary for summary in summaries if summary["runs"] >= args.min_runs), key=lambda summary: summary[args.sort], reverse=True)
+    if args.json:
+        json.dump(summaries, sys.stdout, indent=2)
+        print()
+    else:
+        print_report(summaries)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
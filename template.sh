@@ -7,15 +7,127 @@
 # Set variables
 ACTUAL_USER=$SUDO_USER
 ACTUAL_HOME=$(eval echo ~$SUDO_USER)
+
+# >>> Helpers, also used by the Kickstart %post section (kickstart.ks) and the deferred installs (deferred.sh)
 LOG_FILE="/var/log/F-PASS.log"
+TELEMETRY_FILE="/var/log/F-PASS.jsonl"
+RUN_ID="${EPOCHSECONDS}-$$"
 
+# Timestamps use the printf builtin, so logging does not start a process per message
 get_timestamp() {
-    date +"%Y-%m-%d %H:%M:%S"
+    printf '%(%Y-%m-%d %H:%M:%S)T' -1
 }
 
 generate_log() {
-    local message="$1"
-    echo "$(get_timestamp) - $message" | tee -a "$LOG_FILE"
+    local timestamp
+    printf -v timestamp '%(%Y-%m-%d %H:%M:%S)T' -1
+    local message="$timestamp - $1"
+    echo "$message"
+    echo "${LOG_PREFIX}$message" >> "$LOG_FILE"
+}
+
+# Step telemetry: each step writes a start and an end record as JSON lines to TELEMETRY_FILE.
+# A failing command anywhere in a step sets STEP_STATUS through the ERR trap, which errtrace
+# passes on to functions and lanes.
+declare -A STEP_STARTS
+STEP_STATUS=0
+set -o errtrace
+trap 'STEP_STATUS=$?' ERR
+
+get_microseconds() {
+    printf -v "$1" '%s' "${EPOCHREALTIME/[.,]/}"
+}
+
+write_step_record() {
+    local step="$1" event="$2" fields="$3" timestamp
+    printf -v timestamp '%(%Y-%m-%dT%H:%M:%S%z)T' -1
+    printf '{"run":"%s","host":"%s","time":"%s","step":"%s","event":"%s"%s}\n' \
+        "$RUN_ID" "$HOSTNAME" "$timestamp" "$step" "$event" "$fields" >> "$TELEMETRY_FILE"
+}
+
+# Starts a step, or fails if a previous run completed it. Steps started with "always" run every time.
+step_start() {
+    local step="$1" name="${2//\\/\\\\}"
+    if [ -n "${COMPLETED_STEPS[$step]}" ] && [ "$3" != "always" ]; then
+        generate_log "Skipping $2. It was completed by a previous run."
+        write_step_record "$step" skip ",\"name\":\"${name//\"/\\\"}\""
+        return 1
+    fi
+    STEP_STATUS=0
+    get_microseconds "STEP_STARTS[$step]"
+    write_step_record "$step" start ",\"name\":\"${name//\"/\\\"}\""
+}
+
+step_end() {
+    local step="$1" status=$STEP_STATUS now elapsed
+    get_microseconds now
+    elapsed=$(( now - ${STEP_STARTS[$step]:-$now} ))
+    printf -v elapsed '%d.%06d' $(( elapsed / 1000000 )) $(( elapsed % 1000000 ))
+    write_step_record "$step" end ",\"status\":$status,\"duration\":$elapsed"
+    unset "STEP_STARTS[$step]"
+    if [ "$status" -eq 0 ]; then echo "$step" >> "$STATE_FILE"; else echo "$step" >> "$FAILED_FILE"; fi
+}
+
+# Resumable runs: finished steps are recorded in STATE_FILE, and running the same script again
+# skips them. The state file belongs to this exact script; run with --restart to start over.
+# FAILED_FILE lists the steps that failed in this run.
+SCRIPT_ID="{{script_id}}"
+STATE_DIR="/var/lib/F-PASS"
+STATE_FILE="$STATE_DIR/$SCRIPT_ID.state"
+FAILED_FILE="$STATE_DIR/$SCRIPT_ID.failed"
+declare -A COMPLETED_STEPS
+mkdir -p "$STATE_DIR"
+rm -f "$FAILED_FILE"
+[ "$1" != "--restart" ] || rm -f "$STATE_FILE"
+if [ -f "$STATE_FILE" ]; then
+    while read -r step; do COMPLETED_STEPS[$step]=1; done < "$STATE_FILE"
+    generate_log "Resuming a previous run. ${#COMPLETED_STEPS[@]} completed steps will be skipped. Run with --restart to start over."
+fi
+
+# Files downloaded ahead of the steps that use them, which may run from any directory
+DOWNLOAD_DIR="$STATE_DIR/downloads"
+mkdir -p "$DOWNLOAD_DIR"
+
+# Snapshot of the installed packages, Flatpak apps and enabled repos, taken once at the start so
+# steps can skip what is already present without running a package manager for each app
+declare -A INSTALLED_PACKAGES INSTALLED_FLATPAKS ENABLED_REPOS
+take_snapshot() {
+    local name
+    while read -r name; do INSTALLED_PACKAGES[$name]=1; done < <(rpm -qa --queryformat '%{NAME}\n' 2> /dev/null)
+    while read -r name; do INSTALLED_FLATPAKS[$name]=1; done < <(flatpak list --app --columns=application 2> /dev/null)
+    # Repo ids from the repo files, where repos are enabled unless they say otherwise
+    while read -r name; do ENABLED_REPOS[$name]=1; done < <(awk -F= '
+        /^\[.*\]/ { if (id != "" && enabled) print id; id = substr($1, 2, length($1) - 2); enabled = 1; next }
+        /^enabled[ \t]*=/ { gsub(/[ \t]/, "", $2); enabled = ($2 == "1") }
+        END { if (id != "" && enabled) print id }' /etc/yum.repos.d/*.repo 2> /dev/null)
+}
+take_snapshot
+
+# Succeeds if all of the given package:NAME, flatpak:ID and repo:ID items were present at the start
+already_present() {
+    local name="$1" item
+    shift
+    for item in "$@"; do
+        case "$item" in
+            package:*) [ -n "${INSTALLED_PACKAGES[${item#*:}]}" ] || return 1 ;;
+            flatpak:*) [ -n "${INSTALLED_FLATPAKS[${item#*:}]}" ] || return 1 ;;
+            repo:*) [ -n "${ENABLED_REPOS[${item#*:}]}" ] || return 1 ;;
+            *) return 1 ;;
+        esac
+    done
+    generate_log "Skipping $name. It is already present."
+}
+
+# Run the installer for the packages (or Flatpak apps) that were not installed at the start
+install_missing() {
+    local kind="$1" installer="$2" name missing=()
+    shift 2
+    if [ "$kind" = "flatpak" ]; then local -n installed=INSTALLED_FLATPAKS; else local -n installed=INSTALLED_PACKAGES; fi
+    for name in "$@"; do
+        [ -n "${installed[$name]}" ] || missing+=("$name")
+    done
+    [ ${#missing[@]} -eq $# ] || generate_log "Skipping $(( $# - ${#missing[@]} )) of $# ${kind}s that are already installed."
+    [ ${#missing[@]} -eq 0 ] || $installer "${missing[@]}"
 }
 
 error_handler() {
@@ -23,17 +135,267 @@ error_handler() {
     [ $exit_code -eq 0 ] || { generate_log "ERROR: $message"; exit $exit_code; }
 }
 
-request_restart() {
-    sudo -u $ACTUAL_USER bash -c 'read -p "Your computer must restart to complete the process. Restart now? (y/n): " choice; [[ $choice == [yY] ]]'
-    [ $? -eq 0 ] && generate_log "Rebooting." && reboot || generate_log "Reboot cancelled."
-}
-
 # Function to backup files
 backup_file() {
     local file="$1"
     [ -f "$file" ] && cp "$file" "$file.bak" && { generate_log "Backed up $file"; } || error_handler "Failed to backup $file"
 }
 
+# Set KEY=VALUE in SECTION of an ini-style file ("" for files without sections). Earlier values of KEY are
+# replaced rather than added to, so reruns leave the file as it is. The file is only written when it changes.
+set_config_value() {
+    local file="$1" section="$2" key="$3" value="$4" updated
+    mkdir -p "$(dirname "$file")" && touch "$file" || { generate_log "ERROR: Cannot write $file"; return 1; }
+    updated=$(awk -v section="$section" -v key="$key" -v value="$value" '
+        function flush() { if (in_section && !done) { print key "=" value; done = 1 } }
+        function blanks() { for (; pending > 0; pending--) print "" }
+        BEGIN { in_section = seen = (section == "") }
+        /^[[:space:]]*$/ { pending++; next }
+        /^[[:space:]]*\[[^]]*\][[:space:]]*$/ {
+            flush(); blanks()
+            name = $0; gsub(/^[[:space:]]*\[|\][[:space:]]*$/, "", name)
+            in_section = (name == section); seen = seen || in_section
+            print; next
+        }
+        {
+            line = $0; sub(/^[[:space:]]+/, "", line)
+            if (in_section && index(line, key) == 1 && substr(line, length(key) + 1) ~ /^[[:space:]]*=/) {
+                if (!done) { blanks(); flush() }
+                next
+            }
+            blanks(); print
+        }
+        END {
+            if (!seen) { if (NR && !pending) print ""; blanks(); print "[" section "]"; in_section = 1 }
+            flush(); blanks()
+        }' "$file")
+    if [ "$updated" = "$(cat "$file")" ]; then
+        generate_log "$key is already $value in $file"
+    else
+        printf '%s\n' "$updated" > "$file" && generate_log "Set $key to $value in $file"
+    fi
+}
+
+# Hardware facts for the tuning steps, read from /proc and /sys at the start of the script. Set HARDWARE_ROOT
+# to a fixture tree with proc/cpuinfo, proc/meminfo, proc/mounts and sys/block to check the tuning values.
+HARDWARE_ROOT=${HARDWARE_ROOT:-}
+probe_hardware() {
+    CPU_COUNT=$(grep -c '^processor' "$HARDWARE_ROOT/proc/cpuinfo" 2> /dev/null)
+    [ "${CPU_COUNT:-0}" -gt 0 ] || CPU_COUNT=1
+    MEMORY_MB=$(awk '/^MemTotal:/ { print int($2 / 1024) }' "$HARDWARE_ROOT/proc/meminfo" 2> /dev/null)
+    MEMORY_MB=${MEMORY_MB:-0}
+    DISK_FREE_GB=$(df -P -BG "${HARDWARE_ROOT:-/}" 2> /dev/null | awk 'NR == 2 { print int($4) }')
+    DISK_FREE_GB=${DISK_FREE_GB:-0}
+    ROOT_DISK=$(get_root_disk)
+    case "$(cat "$HARDWARE_ROOT/sys/block/$ROOT_DISK/queue/rotational" 2> /dev/null)" in
+        0) DISK_TYPE=ssd ;;
+        1) DISK_TYPE=hdd ;;
+        *) DISK_TYPE=unknown ;;
+    esac
+    generate_log "Hardware: $CPU_COUNT CPUs, $MEMORY_MB MB of memory, root disk ${ROOT_DISK:-unknown} ($DISK_TYPE) with $DISK_FREE_GB GB free"
+}
+
+# The disk holding the root file system. Device mapper devices (LUKS, LVM) are followed to the disk below them.
+get_root_disk() {
+    local device name block depth
+    device=$(awk '$2 == "/" { source = $1 } END { print source }' "$HARDWARE_ROOT/proc/mounts" 2> /dev/null)
+    name=${device##*/}
+    if [[ "$device" == /dev/mapper/* ]]; then
+        for block in "$HARDWARE_ROOT"/sys/block/dm-*; do
+            [ "$(cat "$block/dm/name" 2> /dev/null)" != "$name" ] || name=${block##*/}
+        done
+    fi
+    for (( depth = 0; depth < 4; depth++ )); do
+        [ -n "$name" ] || return 1
+        if [ -n "$(ls "$HARDWARE_ROOT/sys/block/$name/slaves" 2> /dev/null)" ]; then
+            name=$(ls "$HARDWARE_ROOT/sys/block/$name/slaves" | head -n 1)
+            continue
+        fi
+        # A partition is listed under its disk
+        for block in "$HARDWARE_ROOT"/sys/block/*; do
+            [ ! -d "$block/$name" ] || { name=${block##*/}; break; }
+        done
+        break
+    done
+    [ -d "$HARDWARE_ROOT/sys/block/$name" ] && echo "$name"
+}
+
+# Tuning values for this machine, from the facts of probe_hardware
+tuning_value() {
+    local memory_gb=$(( (MEMORY_MB + 1023) / 1024 ))
+    case "$1" in
+        # A download per CPU, from DNF's default of 3 up to 10
+        max_parallel_downloads) echo $(( CPU_COUNT < 3 ? 3 : CPU_COUNT > 10 ? 10 : CPU_COUNT )) ;;
+        # Keep installed packages when the disk has room for them
+        keepcache) [ "$DISK_FREE_GB" -ge 64 ] && echo True || echo False ;;
+        # Compressed swap in memory, in MB: all of the memory up to 8 GB, then half of it, up to 16 GB.
+        # Fedora's default when the memory is unknown.
+        zram_size)
+            [ "$MEMORY_MB" -gt 0 ] || { echo "min(ram, 8192)"; return; }
+            echo $(( MEMORY_MB <= 8192 ? MEMORY_MB : MEMORY_MB / 2 < 8192 ? 8192 : MEMORY_MB / 2 > 16384 ? 16384 : MEMORY_MB / 2 )) ;;
+        # Swapping to zram is cheaper than dropping the file cache, unless there is memory to spare
+        swappiness) [ "$MEMORY_MB" -ge 32768 ] && echo 100 || echo 180 ;;
+        # zram has no seek time, so swap pages are read one at a time rather than in clusters
+        page_cluster) echo 0 ;;
+        # Swap file size: twice the memory up to 2 GB of it, then as much as the memory, up to 32 GB
+        swap_size) echo "$(( memory_gb == 0 ? 8 : memory_gb <= 2 ? memory_gb * 2 : memory_gb > 32 ? 32 : memory_gb ))G" ;;
+        # I/O scheduler of a disk: none for NVMe, bfq for spinning disks and mq-deadline for other SSDs
+        io_scheduler)
+            case "$2" in
+                nvme*) echo none ;;
+                *) [ "$(cat "$HARDWARE_ROOT/sys/block/$2/queue/rotational" 2> /dev/null)" = 1 ] && echo bfq || echo mq-deadline ;;
+            esac ;;
+    esac
+}
+
+# Set the I/O scheduler of each disk by its type, now and, through a udev rule, on every boot
+set_io_schedulers() {
+    local queue disk scheduler
+    mkdir -p /etc/udev/rules.d
+    printf '%s\n' \
+        '# Written by F-PASS: none for NVMe disks, bfq for spinning disks and mq-deadline for other SSDs' \
+        'ACTION=="add|change", KERNEL=="nvme[0-9]*n[0-9]*", ATTR{queue/scheduler}="none"' \
+        'ACTION=="add|change", KERNEL=="sd[a-z]*|vd[a-z]*|mmcblk[0-9]*", ATTR{queue/rotational}=="1", ATTR{queue/scheduler}="bfq"' \
+        'ACTION=="add|change", KERNEL=="sd[a-z]*|vd[a-z]*|mmcblk[0-9]*", ATTR{queue/rotational}=="0", ATTR{queue/scheduler}="mq-deadline"' \
+        > /etc/udev/rules.d/60-f-pass-io-scheduler.rules
+    for queue in "$HARDWARE_ROOT"/sys/block/*/queue; do
+        disk=${queue%/queue}
+        disk=${disk##*/}
+        case "$disk" in
+            nvme*|sd*|vd*|mmcblk*) ;;
+            *) continue ;;
+        esac
+        scheduler=$(tuning_value io_scheduler "$disk")
+        if echo "$scheduler" 2> /dev/null > "$queue/scheduler"; then
+            generate_log "I/O scheduler of $disk set to $scheduler"
+        else
+            generate_log "WARNING: The $scheduler I/O scheduler is not available for $disk"
+        fi
+    done
+}
+
+# Install Flathub apps in one pass, falling back to one at a time if the batch fails
+install_flatpaks() {
+    flatpak install --noninteractive flathub "$@" && return 0
+    generate_log "Batched Flatpak install failed. Installing apps individually..."
+    local ref failed=0
+    for ref in "$@"; do
+        flatpak install --noninteractive flathub "$ref" || { generate_log "ERROR: Failed to install $ref"; failed=1; }
+    done
+    return $failed
+}
+
+# Install the packages of several apps in one transaction, given as APP_ID:PACKAGE,...:NAME items after
+# the installer. If the transaction fails, each app is installed on its own as a step, so a package that
+# cannot be installed only fails its own app, and only the apps that failed are retried by a rerun.
+install_packages() {
+    local installer="$1" item rest app_packages packages=() failed=0
+    shift
+    for item in "$@"; do
+        rest=${item#*:}
+        IFS=, read -ra app_packages <<< "${rest%%:*}"
+        packages+=("${app_packages[@]}")
+    done
+    install_missing package "$installer" "${packages[@]}" && return 0
+    generate_log "Batched DNF install failed. Installing apps individually..."
+    for item in "$@"; do
+        rest=${item#*:}
+        IFS=, read -ra app_packages <<< "${rest%%:*}"
+        step_start "${item%%:*}" "${rest#*:}" || continue
+        # Failures in an || list do not set STEP_STATUS through the ERR trap
+        install_missing package "$installer" "${app_packages[@]}" || { STEP_STATUS=1; generate_log "ERROR: Failed to install ${rest#*:}"; failed=1; }
+        step_end "${item%%:*}"
+    done
+    return $failed
+}
+
+# Run commands concurrently and wait for all of them. Fails if any of them failed.
+run_parallel() {
+    local cmd pid failed=0 pids=()
+    for cmd in "$@"; do
+        eval "$cmd" &
+        pids+=($!)
+    done
+    for pid in "${pids[@]}"; do
+        wait "$pid" || failed=1
+    done
+    return $failed
+}
+
+# Run a network-bound command, retrying it with exponential backoff. Each attempt gets NETWORK_TIMEOUT
+# seconds, except for dnf, which has its own stall timeout and must not be stopped mid-transaction.
+# Alternative URLs can follow the command: "retry_network CMD URL ALT...". Once the attempts with URL
+# are used up, the command is retried with each ALT in its place.
+NETWORK_TIMEOUT=${NETWORK_TIMEOUT:-300}
+NETWORK_ATTEMPTS=${NETWORK_ATTEMPTS:-3}
+retry_network() {
+    local cmd="$1" url="$2" candidate attempt_cmd attempt delay status=1
+    shift $(( $# > 1 ? 2 : 1 ))
+    for candidate in "$url" "$@"; do
+        attempt_cmd=$cmd
+        if [ "$candidate" != "$url" ]; then
+            generate_log "WARNING: Trying $candidate instead of $url..."
+            attempt_cmd=${cmd//"$url"/"$candidate"}
+        fi
+        delay=5
+        for (( attempt = 1; attempt <= NETWORK_ATTEMPTS; attempt++ )); do
+            case "$attempt_cmd" in
+                dnf\ *) ( set -o pipefail; eval "$attempt_cmd" ) ;;
+                *) ( set -o pipefail; eval "timeout $NETWORK_TIMEOUT $attempt_cmd" ) ;;
+            esac
+            status=$?
+            [ $status -ne 0 ] || return 0
+            [ $status -ne 124 ] || generate_log "WARNING: Timed out after ${NETWORK_TIMEOUT}s: ${attempt_cmd%% *}"
+            if [ $attempt -lt $NETWORK_ATTEMPTS ]; then
+                generate_log "WARNING: Attempt $attempt of $NETWORK_ATTEMPTS failed. Retrying in ${delay}s..."
+                sleep $delay
+                delay=$(( delay * 2 ))
+            fi
+        done
+    done
+    return $status
+}
+
+# Check a downloaded file against its SHA-256 checksum, removing it if it does not match
+verify_checksum() {
+    local file="$1" checksum="$2"
+    echo "$checksum  $file" | sha256sum --check --status 2> /dev/null && return 0
+    generate_log "ERROR: Checksum mismatch for $file. The file has been removed."
+    rm -f "$file"
+    return 1
+}
+
+# Run a function as a background job, prefixing its output with the lane name.
+# Jobs in the same lane run in order; jobs in different lanes run concurrently.
+declare -A LANE_PIDS
+start_lane() {
+    local lane="$1" func="$2"
+    wait_lanes "$lane"
+    (
+        LOG_PREFIX="[$lane] "
+        "$func" 2>&1 < /dev/null | sed -u "s/^/[$lane] /"
+        exit "${PIPESTATUS[0]}"
+    ) &
+    LANE_PIDS[$lane]=$!
+}
+
+# Wait for the given lanes to finish, or for all lanes if none are given
+wait_lanes() {
+    local lane lanes=("$@")
+    [ ${#lanes[@]} -gt 0 ] || lanes=("${!LANE_PIDS[@]}")
+    for lane in "${lanes[@]}"; do
+        [ -n "${LANE_PIDS[$lane]}" ] || continue
+        wait "${LANE_PIDS[$lane]}" || generate_log "WARNING: Steps in the $lane lane finished with errors."
+        unset "LANE_PIDS[$lane]"
+    done
+}
+# <<< Helpers
+
+request_restart() {
+    sudo -u $ACTUAL_USER bash -c 'read -p "Your computer must restart to complete the process. Restart now? (y/n): " choice; [[ $choice == [yY] ]]'
+    [ $? -eq 0 ] && generate_log "Rebooting." && reboot || generate_log "Reboot cancelled."
+}
+
 echo -e "";
 echo -e "\e[34m      ╔════════════════════════════════════════════════╗\e[0m";
 echo -e "\e[34m      ║ ███████╗░░░░░░██████╗░░█████╗░░██████╗░██████╗ ║\e[0m";
@@ -51,6 +413,7 @@ echo "";
 echo -e "        \e[1m\e[31mONLY\e[0m run this script if you trust the source!";
 echo "";
 read -p "Press Enter to continue or CTRL+C to cancel."
+probe_hardware
 
 {{system_config}}
 
@@ -58,8 +421,12 @@ read -p "Press Enter to continue or CTRL+C to cancel."
 
 {{app_install}}
 
+wait_lanes
+
 {{custom_script}}
 
+{{deferred_install}}
+
 echo "";
 echo -e "\e[34m╔═════════════════════════════════════════════════════════════════════════════════════════════════════════════════════╗\e[0m";
 echo -e "\e[34m║ ░██████╗███████╗████████╗██╗░░░██╗██████╗░░░░█████╗░░█████╗░███╗░░░███╗██████╗░██╗░░░░░███████╗████████╗███████╗██╗ ║\e[0m";
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import builder
+import dryrun
+
+@pytest.fixture
+def run_helpers(tmp_path):
+    # Run bash commands after the helpers of template.sh, with their system paths moved under tmp_path
+    sandbox_root = str(tmp_path / "root")
+    for directory in dryrun.SANDBOX_ROOTS + dryrun.SANDBOX_DIRS:
+        os.makedirs(os.path.join(sandbox_root, directory), exist_ok=True)
+    for file_name in dryrun.SANDBOX_FILES:
+        os.makedirs(os.path.dirname(os.path.join(sandbox_root, file_name)), exist_ok=True)
+        open(os.path.join(sandbox_root, file_name), 'a').close()
+    helpers = builder.get_template_helpers(builder.load_template()).replace("{{script_id}}", "test")
+
+    def run(commands: str, env: dict = None) -> subprocess.CompletedProcess:
+        script = dryrun.rewrite_script(helpers + commands, sandbox_root)
+        return subprocess.run(["bash", "-c", script], capture_output=True, text=True, cwd=tmp_path,
+                              env=dict(os.environ, **(env or {})))
+
+    run.root = sandbox_root
+    return run
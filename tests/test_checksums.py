@@ -0,0 +1,43 @@
+import hashlib
+import json
+import os
+import cli
+from conftest import REPO_DIR
+
+NOMACHINE_URL = "https://download.nomachine.com/download/8.13/Linux/nomachine_8.13.1_1_x86_64.rpm"
+NOMACHINE_FILE = '"$DOWNLOAD_DIR/nomachine_8.13.1_1_x86_64.rpm"'
+CHECKSUM = hashlib.sha256(b"nomachine").hexdigest()
+
+def write_catalog(tmp_path) -> str:
+    # fedora40.json with a checksum for the NoMachine download, as catalog entries opt in to them
+    with open(os.path.join(REPO_DIR, "fedora40.json")) as f:
+        data = json.load(f)
+    for category in data.values():
+        for subcategory in category.values():
+            if isinstance(subcategory, dict) and "install_nomachine" in subcategory.get("apps", {}):
+                subcategory["apps"]["install_nomachine"]["checksums"] = {NOMACHINE_URL: CHECKSUM}
+    file_name = str(tmp_path / "catalog.json")
+    with open(file_name, "w") as f:
+        json.dump(data, f)
+    return file_name
+
+def test_checksums_are_verified_after_the_downloads(tmp_path):
+    catalog_file = write_catalog(tmp_path)
+    for prefetch in (False, True):
+        script = cli.generate_script({"apps": ["install_nomachine"]}, catalog_file, "Verbose", prefetch)
+        download = script.index(f"wget -O {NOMACHINE_FILE} {NOMACHINE_URL}")
+        verify = script.index(f"verify_checksum {NOMACHINE_FILE} {CHECKSUM}")
+        assert download < verify < script.index(f"dnf install -y {NOMACHINE_FILE}")
+
+def test_apps_without_checksums_are_not_verified():
+    script = cli.generate_script({"apps": ["install_nomachine"]}, cli.DEFAULT_DISTRO, "Verbose")
+    assert "verify_checksum " not in script
+
+def test_verify_checksum(run_helpers, tmp_path):
+    (tmp_path / "good.rpm").write_bytes(b"nomachine")
+    (tmp_path / "bad.rpm").write_bytes(b"something else")
+    result = run_helpers(f"verify_checksum good.rpm {CHECKSUM} && ! verify_checksum bad.rpm {CHECKSUM}")
+    assert result.returncode == 0, result.stderr
+    assert (tmp_path / "good.rpm").exists()
+    assert not (tmp_path / "bad.rpm").exists()
+    assert "Checksum mismatch for bad.rpm" in result.stdout
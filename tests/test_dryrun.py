@@ -0,0 +1,28 @@
+import dryrun
+
+def make_call(command: str, start: float, end: float, latency: float) -> dict:
+    return {"command": command, "start": start, "end": end, "latency": latency, "args": ""}
+
+def test_simulated_runtime_comes_from_the_latencies():
+    # Two lanes: dnf, then wget, next to a flatpak call. The real times include slow bash and a late wget.
+    calls = [make_call("dnf", 0.0, 0.5, 30.0), make_call("flatpak", 0.1, 0.3, 20.0), make_call("wget", 2.0, 2.1, 5.0)]
+    summary = dryrun.summarize({"exit_status": 0, "calls": calls, "steps": [], "stubs": sorted(dryrun.DEFAULT_LATENCIES)})
+    assert [call["offset"] for call in summary["order"]] == [0.0, 0.0, 30.0]
+    assert summary["simulated_runtime"] == 35.0
+    assert summary["serial_runtime"] == 55.0
+
+def test_commands_without_a_stub_are_recorded_without_running(tmp_path):
+    script = "\n".join([
+        "#!/bin/bash",
+        "python3 -c 'open(\"ran\", \"w\")'",
+        "sudo -u dryrun python3 -c 'open(\"ran\", \"w\")'",
+        "sudo -u dryrun HOME=/tmp dnf install -y pip",
+        "mkdir -p /etc/f-pass-test",
+    ])
+    result = dryrun.run_script(script, dryrun.DEFAULT_LATENCIES, 0.001, 60, str(tmp_path / "sandbox"))
+    summary = dryrun.summarize(result)
+    assert result["exit_status"] == 0, result["output"]
+    assert not list(tmp_path.rglob("ran"))
+    assert [call["command"] for call in result["calls"]] == ["python3", "sudo", "python3", "sudo", "dnf"]
+    assert summary["not_run"] == ["python3"]
+    assert (tmp_path / "sandbox" / "root" / "etc" / "f-pass-test").is_dir()
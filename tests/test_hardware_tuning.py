@@ -0,0 +1,68 @@
+import os
+import re
+import shutil
+import catalog
+import cli
+from conftest import REPO_DIR
+
+FIXTURE = os.path.join(REPO_DIR, "fixtures", "nvme-16g")
+TUNING_KEYS = ["max_parallel_downloads", "keepcache", "zram_size", "swappiness", "page_cluster", "swap_size"]
+# Fedora's dnf.conf, which configure_dnf backs up and edits
+DNF_CONF = "[main]\ngpgcheck=True\ninstallonly_limit=3\nclean_requirements_on_remove=True\nbest=False\nskip_if_unavailable=True\n"
+
+def get_tuning_commands() -> str:
+    # The commands of the DNF and memory tuning apps, without the system commands they run
+    data, app_index = catalog.load_catalog(cli.DEFAULT_DISTRO), catalog.load_app_index(cli.DEFAULT_DISTRO)
+    commands = [command for app_id in ("configure_dnf", "tune_system")
+                for command in catalog.get_commands(data[app_index[app_id].category][app_index[app_id].subcategory]["apps"][app_id])]
+    return "\n".join(command for command in commands if not command.startswith("sysctl "))
+
+def read_tree(root: str) -> dict:
+    contents = {}
+    for directory, _, files in os.walk(root):
+        for file_name in files:
+            with open(os.path.join(directory, file_name)) as f:
+                contents[os.path.relpath(os.path.join(directory, file_name), root)] = f.read()
+    return contents
+
+def test_tuning_is_idempotent(run_helpers, tmp_path):
+    hardware_root = str(tmp_path / "hardware")
+    shutil.copytree(FIXTURE, hardware_root)
+    with open(os.path.join(run_helpers.root, "etc", "dnf", "dnf.conf"), "w") as f:
+        f.write(DNF_CONF)
+
+    commands = "\n".join([
+        "probe_hardware",
+        *(f'echo "{key}=$(tuning_value {key})"' for key in TUNING_KEYS),
+        'echo "io_scheduler=$(tuning_value io_scheduler nvme0n1) $(tuning_value io_scheduler sda)"',
+        get_tuning_commands(),
+    ])
+    runs = []
+    for _ in range(2):
+        result = run_helpers(commands, {"HARDWARE_ROOT": hardware_root})
+        assert result.returncode == 0, result.stderr
+        runs.append((re.sub(r"^\S+ \S+ - ", "", result.stdout, flags=re.MULTILINE).splitlines(),
+                     read_tree(os.path.join(run_helpers.root, "etc")), read_tree(hardware_root)))
+
+    (first_output, first_files, first_hardware), (second_output, second_files, second_hardware) = runs
+    # The hardware line and the tuning values come first, and are the same in both runs
+    assert first_output[:len(TUNING_KEYS) + 2] == second_output[:len(TUNING_KEYS) + 2]
+    values = dict(line.split("=", 1) for line in first_output[1:len(TUNING_KEYS) + 2])
+    assert first_output[0].startswith("Hardware: 8 CPUs, 15921 MB of memory, root disk nvme0n1 (ssd)")
+    assert values["max_parallel_downloads"] == "8"
+    assert values["zram_size"] == "8192"
+    assert values["swappiness"] == "180"
+    assert values["page_cluster"] == "0"
+    assert values["swap_size"] == "16G"
+    assert values["io_scheduler"] == "none bfq"
+
+    # The second run finds every value already set, and leaves the files as the first run wrote them
+    assert not [line for line in second_output if line.startswith("Set ")]
+    first_files.pop("dnf/dnf.conf.bak")
+    assert second_files.pop("dnf/dnf.conf.bak") == first_files["dnf/dnf.conf"]
+    assert first_files == second_files
+    assert first_hardware == second_hardware
+    assert "max_parallel_downloads=8" in first_files["dnf/dnf.conf"]
+    assert "[zram0]\nzram-size=8192\ncompression-algorithm=zstd\n" in first_files["systemd/zram-generator.conf"]
+    assert first_hardware["sys/block/nvme0n1/queue/scheduler"].strip() == "none"
+    assert first_hardware["sys/block/sda/queue/scheduler"].strip() == "bfq"
@@ -0,0 +1,31 @@
+from steps import DownloadStep, RepoAddStep, ShellStep, parse_commands, split_repo_setup
+
+def test_only_commands_that_add_repositories_are_repo_setup():
+    steps = parse_commands("app", [
+        "dnf config-manager --add-repo https://example.com/app.repo",
+        "echo -e \"[app]\nbaseurl=https://example.com/rpms\" | tee /etc/yum.repos.d/app.repo > /dev/null",
+        "cat /etc/yum.repos.d/app.repo",
+        "grep -q app /etc/dnf/dnf.conf",
+        "sed -i 's/enabled=0/enabled=1/' /etc/yum.repos.d/app.repo",
+    ])
+    assert [type(step) for step in steps] == [RepoAddStep, RepoAddStep, ShellStep, ShellStep, ShellStep]
+
+def test_repo_setup_moves_with_the_downloads_before_it():
+    setup, others = split_repo_setup(parse_commands("app", [
+        "generate_log \"Installing App...\"",
+        "wget https://example.com/app.asc",
+        "rpm --import app.asc",
+        "dnf install -y app",
+    ]))
+    assert [type(step) for step in setup] == [DownloadStep, RepoAddStep]
+    assert [step.command for step in others] == ["generate_log \"Installing App...\"", "dnf install -y app"]
+
+def test_repo_setup_after_other_steps_stays_in_place():
+    steps = parse_commands("app", [
+        "dnf install -y app-release-tools",
+        "app-release-tools --write /tmp/app.repo",
+        "wget -O /etc/yum.repos.d/app.repo https://example.com/app.repo",
+        "dnf install -y app",
+    ])
+    setup, others = split_repo_setup(steps)
+    assert setup == [] and others == steps
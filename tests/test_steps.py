@@ -0,0 +1,17 @@
+from builder import is_kickstart_package
+from steps import bind_parameters, get_batch_step, parse_commands, render_steps
+
+def test_entered_values_are_filled_in_when_rendered():
+    steps = parse_commands("set_hostname", ["generate_log \"Setting hostname...\"", "hostnamectl set-hostname SELECTEDHOSTNAME"])
+    assert steps[1].parameters == {"entered_name": None}
+
+    bound = bind_parameters(steps, {"entered_name": "'my-host'"})
+    assert render_steps(bound, "")[1] == "hostnamectl set-hostname 'my-host'"
+    # The parsed steps are shared, so they keep their placeholder
+    assert render_steps(steps, "")[1] == "hostnamectl set-hostname SELECTEDHOSTNAME"
+
+def test_batch_steps_carry_the_app_requirements():
+    plain = get_batch_step(parse_commands("app", ["dnf install -y app"]))
+    with_repo = get_batch_step(parse_commands("repo_app", ["dnf install -y repo-app"], ("app_repo",)))
+    assert is_kickstart_package(plain) and not is_kickstart_package(with_repo)
+    assert get_batch_step(parse_commands("app", ["dnf install -y app", "systemctl enable app"])) is None